@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
-from typing import Iterable, List
+from typing import Iterable
 
 from config import GOOGLE_API_KEY, GOOGLE_CSE_ID
 from const import (
@@ -14,7 +14,7 @@ from const import (
 )
 from datastore.datastore import DataStore
 from googleapiclient.discovery import build
-from pydantic_schemas.document import DocumentChunk, Query
+from pydantic_schemas.document import Query
 from services.openai import (
     get_completion,
     stream_chat_response,
@@ -49,22 +49,12 @@ async def get_relevant_doc(query: str, datastore: DataStore):
     try:
         # translate query to english
         # query = translate(query)
-        query_result = await datastore.query(queries=[Query(query=query)])
+        # The datastore returns the best chunk of each of the top documents
+        query_result = await datastore.query(
+            queries=[Query(query=query, unique_documents=True)]
+        )
         docs = query_result[0].results
 
-        def get_top_chunk_from_unique_doc(chunks: List[DocumentChunk]):
-            unique_id = set()
-            result = []
-            for chunk in chunks:
-                if chunk.metadata.document_id not in unique_id:
-                    unique_id.add(chunk.metadata.document_id)
-                    result.append(chunk)
-                else:
-                    continue
-            return result
-
-        docs = get_top_chunk_from_unique_doc(docs)
-
         return [doc.dict() for doc in docs], 200
     except Exception as e:
         print(f"Caught exception: {e}")
@@ -4,6 +4,11 @@ import os
 
 # DEV CONFIG
 INIT_DB = False
+# Directory of the files written at runtime: embedding store, assets, local datastore and query cache
+# Their paths below are resolved against it, not against the working directory the server is started from
+DATA_DIR = os.environ.get(
+    "DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
 
 
 # OPENAI
@@ -12,6 +17,34 @@ OPENAI_API_BASE = ""
 OPENAI_API_TYPE = ""
 OPENAI_API_VERSION = ""
 OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME = ""
+# Embedding store, embeddings of texts that were already embedded are re-used instead of calling the API
+# Set to "" to always call the API
+EMBEDDING_STORE_PATH = os.path.join(DATA_DIR, "embedding_store.sqlite")
+# Asset store, the images and tables of the pages are stored once as files, chunks only keep their ids
+# The API serves them at /assets/{asset_id}
+# Set to "" to not extract images and tables
+ASSET_STORE_PATH = os.path.join(DATA_DIR, "assets")
+# Embedding of the chunks of uploaded documents, batches are sent concurrently within the quotas of the deployment
+EMBEDDING_CONCURRENCY = 4  # number of embedding requests in flight
+EMBEDDING_REQUESTS_PER_MINUTE = (
+    1440  # requests per minute quota of the deployment, 0 for no limit
+)
+EMBEDDING_TOKENS_PER_MINUTE = (
+    240000  # tokens per minute quota of the deployment, 0 for no limit
+)
+# Embedding provider, the model embedding the chunks and the queries, choose one from [openai, local, hashing]
+# openai: text-embedding-ada-002 from Azure OpenAI, local: a sentence-transformers model run on the CPU,
+# hashing: deterministic embeddings without a model, for tests
+# The local provider needs torch and sentence-transformers: poetry install --extras local-embeddings
+# The vector size of the datastore follows the dimension of the provider, re-index after changing it
+EMBEDDING_PROVIDER = "openai"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_EMBEDDING_DIMENSION = 384  # dimension of the embeddings of LOCAL_EMBEDDING_MODEL
+LOCAL_EMBEDDING_BATCH_SIZE = 32  # number of texts encoded at once
+LOCAL_EMBEDDING_THREADS = (
+    4  # number of CPU threads of the model, 0 for the torch default
+)
+HASHING_EMBEDDING_DIMENSION = 256
 # Azure OpenAI
 
 
@@ -40,8 +73,29 @@ POSTGRE_PASSWORD = ""
 
 
 # Datastore
+# choose one from [elasticsearch, local, hnsw, local_hybrid]
 DATASTORE = "elasticsearch"
 
+## Local datastore, an in-process alternative to Elasticsearch for tests, benchmarks and small deployments
+# Directory of the vectors and chunk table
+LOCAL_DATASTORE_PATH = os.path.join(DATA_DIR, "local_datastore")
+# Index options of the HNSW graph of the hnsw datastore, same as in ELASTICSEARCH_INDEX_OPTIONS
+# Searches consider NUM_CANDIDATES candidates (the ef_search of the graph), like the Elasticsearch kNN search
+HNSW_INDEX_OPTIONS = {"m": 16, "ef_construction": 100}
+
+## Retrieval cache in front of DataStore.query
+QUERY_CACHE = "memory"  # choose one from [memory, disk, none]
+QUERY_CACHE_SIZE = 1024  # maximum number of cached query results
+QUERY_CACHE_TTL = 600  # number of seconds a cached query result stays valid
+# Database file of the disk cache
+QUERY_CACHE_PATH = os.path.join(DATA_DIR, "query_cache.sqlite")
+
+## Micro-batching of the query embeddings, the queries arriving together share one embedding request
+QUERY_EMBEDDING_BATCH_WAIT_MS = (
+    5  # maximum milliseconds a query waits for others, 0 to embed each query directly
+)
+QUERY_EMBEDDING_BATCH_SIZE = 16  # maximum number of queries embedded in one request
+
 ########   Elasticsearch #########
 ELASTICSEARCH_URL = os.environ.get("ELASTICSEARCH_URL", "http://localhost:9200")
 
@@ -54,6 +108,17 @@ ELASTICSEARCH_API_KEY = ""
 ELASTICSEARCH_INDEX = "mck_rag"
 ELASTICSEARCH_REPLICAS = 1
 ELASTICSEARCH_SHARDS = 1
+# Index options of the embedding dense_vector field
+# The int8 types quantize each dimension to one byte, which cuts the kNN memory footprint by ~4x (Elasticsearch 8.12+)
+ELASTICSEARCH_INDEX_OPTIONS = {
+    "type": "hnsw",  # choose one from [hnsw, int8_hnsw, flat, int8_flat]
+    "m": 16,  # number of neighbors each node is connected to in the HNSW graph
+    "ef_construction": 100,  # number of candidates considered for each node while building the HNSW graph
+}
+# Business units with their own index, an alias named f"{ELASTICSEARCH_INDEX}-{bu}" (lowercase)
+# Queries filtered on one of these BUs only search its index, the chunks of the other BUs stay in ELASTICSEARCH_INDEX
+# Each BU can override the shards and replicas of its index, e.g. {"CIPS": {"shards": 3, "replicas": 1}}
+ELASTICSEARCH_BU_INDICES = {}
 
 ## Search parameters for ES
 SEARCH_TYPE = "hybrid"  # choose one from [hybrid, keyword, semantic]
@@ -61,6 +126,10 @@ SIZE = 5  # number of results to return
 K = 5  # number of candidates to return from semantic search
 NUM_CANDIDATES = 50  # The number of nearest neighbor candidates to consider per shard. Cannot exceed 10,000. Elasticsearch collects num_candidates results from each shard, then merges them to find the top k results. Increasing num_candidates tends to improve the accuracy of the final k results.
 WINDOW_SIZE = 100  # the size of the individual result sets per query, higher the better
+## Fusion of the keyword and semantic results of hybrid search, done by the datastore
+FUSION_METHOD = "rrf"  # choose one from [rrf, linear]
+FUSION_WEIGHTS = [1.0, 1.0]  # weights of the keyword and semantic results
+RANK_CONSTANT = 60  # rank constant of reciprocal rank fusion, higher values give lower ranked results more weight
 ########## Elasticsearch ##########
 
 
@@ -18,7 +18,9 @@ MIN_CHUNK_SIZE_CHARS = 350  # The minimum size of each text chunk in characters
 MIN_CHUNK_LENGTH_TO_EMBED = (
     7  # The minimum number of characters a line must have to be kept
 )
-EMBEDDINGS_BATCH_SIZE = 10  # The number of chunks to embed at once
+# Chunks are packed into embedding requests up to both limits, Azure OpenAI takes at most 16 inputs per request
+EMBEDDINGS_BATCH_SIZE = 16  # The maximum number of chunks to embed at once
+EMBEDDINGS_BATCH_TOKENS = 32768  # The maximum number of tokens to embed at once
 PAGE_SPLITTER = "###PAGE_SPLITTER###"  # The string to use to split pages
 MAX_NUM_CHUNKS = 10000  # The maximum number of chunks to generate from a text
 MIN_LINE_CHARS = 10
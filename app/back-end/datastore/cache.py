@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import QUERY_CACHE, QUERY_CACHE_PATH, QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+from pydantic_schemas.document import Query, QueryResult
+
+
+class QueryCacheBackend(ABC):
+    """
+    Storage of cached query results with LRU and TTL eviction.
+    Every backend tracks an index generation, entries written under an older generation are never returned.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        assert max_size > 0, "Cache size must be greater than 0."
+        assert ttl > 0, "Cache TTL must be greater than 0."
+        self.max_size = max_size
+        self.ttl = ttl
+
+    @property
+    @abstractmethod
+    def generation(self) -> int:
+        """
+        Returns the current index generation.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[QueryResult]:
+        """
+        Returns the cached query result, or None if it is missing or expired.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: QueryResult) -> None:
+        """
+        Caches a query result, evicting the least recently used entries above max_size.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def invalidate(self) -> None:
+        """
+        Moves to the next index generation and drops all cached query results.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryQueryCacheBackend(QueryCacheBackend):
+    def __init__(self, max_size: int, ttl: float):
+        super().__init__(max_size, ttl)
+        self._generation = 0
+        self._entries: "OrderedDict[str, Tuple[float, QueryResult]]" = OrderedDict()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: str) -> Optional[QueryResult]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: QueryResult) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskQueryCacheBackend(QueryCacheBackend):
+    """
+    Query cache persisted in a SQLite database.
+    The generation is stored in the database as well, so processes sharing the file invalidate each other.
+    """
+
+    def __init__(self, max_size: int, ttl: float, path: str):
+        super().__init__(max_size, ttl)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache "
+            "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache_generation (generation INTEGER)"
+        )
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM query_cache_generation"
+        ).fetchone()
+        if count == 0:
+            self.conn.execute("INSERT INTO query_cache_generation VALUES (0)")
+
+    @property
+    def generation(self) -> int:
+        return self.conn.execute(
+            "SELECT generation FROM query_cache_generation"
+        ).fetchone()[0]
+
+    def get(self, key: str) -> Optional[QueryResult]:
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT value, expires_at FROM query_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < now:
+            self.conn.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+            return None
+        self.conn.execute(
+            "UPDATE query_cache SET accessed_at = ? WHERE key = ?", (now, key)
+        )
+        return QueryResult.parse_raw(value)
+
+    def set(self, key: str, value: QueryResult) -> None:
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?)",
+            (key, value.json(), now + self.ttl, now),
+        )
+        overflow = len(self) - self.max_size
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM query_cache WHERE key IN "
+                "(SELECT key FROM query_cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+
+    def invalidate(self) -> None:
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(
+            "UPDATE query_cache_generation SET generation = generation + 1"
+        )
+        self.conn.execute("DELETE FROM query_cache")
+        self.conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+
+
+class QueryCache:
+    """
+    Retrieval result cache in front of DataStore.query, with hit and miss counters.
+    """
+
+    def __init__(self, backend: QueryCacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, query: Query, **search_params: Any) -> str:
+        """
+        Builds the cache key from the normalized query text, the other query fields (filter, top_k...),
+        the search parameters and the index generation.
+        """
+        payload = {
+            **query.dict(),
+            "query": " ".join(query.query.casefold().split()),
+            "generation": self.backend.generation,
+            **search_params,
+        }
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[QueryResult]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: QueryResult) -> None:
+        self.backend.set(key, value)
+
+    def invalidate(self) -> None:
+        self.backend.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.backend),
+            "max_size": self.backend.max_size,
+            "generation": self.backend.generation,
+        }
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    match QUERY_CACHE:
+        case "memory":
+            return QueryCache(
+                InMemoryQueryCacheBackend(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+            )
+        case "disk":
+            return QueryCache(
+                DiskQueryCacheBackend(
+                    QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_PATH
+                )
+            )
+        case "none" | None:
+            return None
+        case _:
+            raise ValueError(
+                f"Unsupported query cache: {QUERY_CACHE}. "
+                f"Try one of the following: memory, disk, none"
+            )
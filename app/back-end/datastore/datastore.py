@@ -4,8 +4,12 @@
 
 import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+from config import NUM_CANDIDATES, SEARCH_TYPE, SIZE, K
+from datastore.cache import QueryCache, get_query_cache
+from embedding.factory import get_embedding_dimension
+from loguru import logger
 from pydantic_schemas.document import (
     Document,
     DocumentChunk,
@@ -14,36 +18,113 @@ from pydantic_schemas.document import (
     QueryResult,
     QueryWithEmbedding,
 )
-from services.chunks import get_document_chunks
-from services.openai import get_embeddings
+from services.chunks import embed_document_chunks, get_document_chunks
+from services.embeddings import query_embedding_batcher
+
+# Fields that are expensive to fetch and serialize, query results leave them out unless asked for.
+# They can be fetched later for the chunks that need them with DataStore.get_chunks.
+# The images and tables are asset ids, small enough to return with every result.
+HEAVY_FIELDS = ["embedding"]
+VECTOR_SIZE = (
+    get_embedding_dimension()
+)  # dimension of the embeddings of EMBEDDING_PROVIDER
+MAX_NUM_CANDIDATES = 10000  # upper limit of num_candidates of a kNN search
+
+
+def get_num_candidates(k: int) -> int:
+    """
+    Returns the number of candidates of a kNN search for the top k chunks.
+    It scales with k, so a larger top_k keeps the recall of the configured K / NUM_CANDIDATES.
+    """
+    return min(max(NUM_CANDIDATES * k // K, k), MAX_NUM_CANDIDATES)
 
 
 class DataStore(ABC):
+    # Values of SEARCH_TYPE the provider serves
+    search_types = ["hybrid", "keyword", "semantic"]
+
+    def __init__(
+        self,
+        query_cache: Optional[QueryCache] = None,
+        search_type: Optional[str] = None,
+    ):
+        """
+        Args:
+            query_cache: Cache of query results, defaults to the one configured in config.py
+            search_type: Any of "hybrid" / "keyword" / "semantic", defaults to SEARCH_TYPE in config.py
+        """
+        self.query_cache = query_cache or get_query_cache()
+        self.search_type = search_type or SEARCH_TYPE
+        assert self.search_type in [
+            "hybrid",
+            "keyword",
+            "semantic",
+        ], "Search type must be one of 'hybrid' / 'keyword' / 'semantic'."
+
     async def upsert(
-        self, documents: List[Document], chunk_token_size: Optional[int] = None
+        self,
+        documents: List[Document],
+        chunk_token_size: Optional[int] = None,
+        skip_delete: bool = False,
+        incremental: bool = False,
     ) -> List[str]:
         """
         Takes in a list of documents and inserts them into the database.
         First deletes all the existing vectors with the document id (if necessary, depends on the vector db), then inserts the new ones.
+        Set skip_delete when the documents are known to be new, to skip the delete entirely.
+
+        Set incremental to only embed and write the chunks that are new or whose content hash changed,
+        and delete the chunks the documents no longer have. The other chunks are left as they are.
+        A document that moves to another business unit changes every chunk hash but keeps its old chunks
+        in the index of the previous business unit, it takes a full upsert.
         Return a list of document ids.
         """
-        # Delete any existing vectors for documents with the input document ids
-        await asyncio.gather(
-            *[
-                self.delete(
-                    filter=DocumentMetadataFilter(
-                        document_id=document.id,
-                    ),
-                    delete_all=False,
-                )
-                for document in documents
-                if document.id
-            ]
+        document_ids = [document.id for document in documents if document.id]
+        if incremental:
+            return await self._upsert_incremental(
+                documents, document_ids, chunk_token_size
+            )
+
+        # Delete any existing vectors for documents with the input document ids, in a single request
+        if document_ids and not skip_delete:
+            await self.delete(ids=document_ids, delete_all=False)
+
+        # Chunking and embedding block on CPU work, requests and rate limit pauses, so they run in a worker thread
+        # and queries keep being served during an upload
+        chunks = await asyncio.to_thread(
+            get_document_chunks, documents, chunk_token_size
         )
 
-        chunks = get_document_chunks(documents, chunk_token_size)
+        ids = await self._upsert(chunks)
+        self._invalidate_query_cache()
+        return ids
 
-        return await self._upsert(chunks)
+    async def _upsert_incremental(
+        self,
+        documents: List[Document],
+        document_ids: List[str],
+        chunk_token_size: Optional[int],
+    ) -> List[str]:
+        chunks = await asyncio.to_thread(
+            get_document_chunks, documents, chunk_token_size, embed=False
+        )
+        existing = await self._get_content_hashes(document_ids) if document_ids else {}
+        num_chunks = sum(len(chunk_list) for chunk_list in chunks.values())
+        chunks, vanished = diff_chunks(chunks, existing)
+
+        changed = [chunk for chunk_list in chunks.values() for chunk in chunk_list]
+        logger.info(
+            f"Incremental upsert of {len(documents)} documents: {len(changed)} new or changed chunks, "
+            f"{num_chunks - len(changed)} unchanged, {len(vanished)} vanished"
+        )
+        await asyncio.to_thread(embed_document_chunks, changed)
+        ids = await self._upsert(chunks)
+        # The vanished chunks are deleted last, so the documents are never missing from search results
+        if vanished:
+            await self._delete_chunk_ids(vanished)
+        if changed or vanished:
+            self._invalidate_query_cache()
+        return ids
 
     @abstractmethod
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
@@ -54,28 +135,104 @@ class DataStore(ABC):
 
         raise NotImplementedError
 
-    async def query(self, queries: List[Query]) -> List[QueryResult]:
+    async def query(
+        self,
+        queries: List[Query],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> List[QueryResult]:
         """
         Takes in a list of queries and filters and returns a list of query results with matching document chunks and scores.
+        Results are served from the query cache when possible, only the remaining queries are embedded and searched.
+
+        The fields of the returned chunks can be projected with includes and excludes (e.g. "text", "metadata.title").
+        By default every field but the HEAVY_FIELDS is returned, pass excludes=[] to return them as well.
         """
+        excludes = HEAVY_FIELDS if excludes is None else excludes
+        results: List[Optional[QueryResult]] = [None] * len(queries)
+        cache_keys: List[Optional[str]] = [None] * len(queries)
+        if self.query_cache is not None:
+            search_params = {
+                **self._get_query_cache_params(),
+                "includes": includes,
+                "excludes": excludes,
+            }
+            for i, query in enumerate(queries):
+                cache_keys[i] = self.query_cache.get_key(query, **search_params)
+                cached = self.query_cache.get(cache_keys[i])
+                if cached is not None:
+                    results[i] = cached.copy(update={"query": query.query})
+
+        missed = [i for i, result in enumerate(results) if result is None]
+        if not missed:
+            return results
+
         # get a list of of just the queries from the Query list
-        query_texts = [query.query for query in queries]
-        query_embeddings = get_embeddings(query_texts)
+        query_texts = [queries[i].query for i in missed]
+        # Embedded together with the queries of the other requests in flight
+        query_embeddings = await query_embedding_batcher.embed(query_texts)
         # hydrate the queries with embeddings
         queries_with_embeddings = [
-            QueryWithEmbedding(**query.dict(), embedding=embedding)
-            for query, embedding in zip(queries, query_embeddings)
+            QueryWithEmbedding(**queries[i].dict(), embedding=embedding)
+            for i, embedding in zip(missed, query_embeddings)
         ]
-        return await self._query(queries_with_embeddings)
+        query_results = await self._query(
+            queries_with_embeddings, includes=includes, excludes=excludes
+        )
+        for i, result in zip(missed, query_results):
+            results[i] = result
+            if self.query_cache is not None:
+                self.query_cache.set(cache_keys[i], result)
+        return results
+
+    def _get_query_cache_params(self) -> Dict[str, Any]:
+        """
+        Returns the search parameters that change query results, they are part of the query cache key.
+        """
+        return {
+            "search_type": self.search_type,
+            "size": SIZE,
+            "k": K,
+            "num_candidates": NUM_CANDIDATES,
+        }
+
+    def _invalidate_query_cache(self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.invalidate()
 
     @abstractmethod
-    async def _query(self, queries: List[QueryWithEmbedding]) -> List[QueryResult]:
+    async def _query(
+        self,
+        queries: List[QueryWithEmbedding],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> List[QueryResult]:
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
+        Only the fields matching includes (all if None) and not matching excludes are fetched for each chunk.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _get_content_hashes(
+        self, document_ids: List[str]
+    ) -> Dict[str, Optional[str]]:
+        """
+        Returns the content hash of every chunk of the documents, by chunk id.
+        Chunks written before content hashes were stored have a None hash.
         """
         raise NotImplementedError
 
     @abstractmethod
+    async def get_chunks(
+        self, ids: List[str], includes: Optional[List[str]] = None
+    ) -> List[DocumentChunk]:
+        """
+        Fetches document chunks by chunk id, e.g. to load the HEAVY_FIELDS of query results that are rendered.
+        Only the fields matching includes (all if None) are fetched, chunks that do not exist are skipped.
+        """
+        raise NotImplementedError
+
     async def delete(
         self,
         ids: Optional[List[str]] = None,
@@ -87,4 +244,62 @@ class DataStore(ABC):
         Multiple parameters can be used at once.
         Returns whether the operation was successful.
         """
+        try:
+            return await self._delete(ids=ids, filter=filter, delete_all=delete_all)
+        finally:
+            self._invalidate_query_cache()
+
+    @abstractmethod
+    async def _delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        Multiple parameters can be used at once.
+        Returns whether the operation was successful.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _delete_chunk_ids(self, ids: List[str]) -> None:
+        """
+        Removes the chunks with the given chunk ids, unlike delete which takes document ids.
+        """
         raise NotImplementedError
+
+    @abstractmethod
+    async def close(self) -> None:
+        """
+        Releases the connections and files of the datastore, it is not used afterwards.
+        """
+        raise NotImplementedError
+
+
+def diff_chunks(
+    chunks: Dict[str, List[DocumentChunk]], existing: Dict[str, Optional[str]]
+) -> Tuple[Dict[str, List[DocumentChunk]], List[str]]:
+    """
+    Compares the chunks of the documents to the content hashes of their indexed chunks.
+
+    Args:
+        chunks: The chunks of the documents, by document id.
+        existing: The content hashes of the indexed chunks of the documents, by chunk id.
+
+    Returns:
+        A tuple of (chunks, vanished), where chunks only keeps the chunks that are new or changed
+        and vanished is the list of the ids of the indexed chunks the documents no longer have.
+    """
+    new_ids = set()
+    changed = {}
+    for document_id, chunk_list in chunks.items():
+        changed[document_id] = []
+        for chunk in chunk_list:
+            new_ids.add(chunk.id)
+            stored_hash = existing.get(chunk.id)
+            if stored_hash is None or stored_hash != chunk.metadata.content_hash:
+                changed[document_id].append(chunk)
+    vanished = [chunk_id for chunk_id in existing if chunk_id not in new_ids]
+    return changed, vanished
@@ -16,8 +16,22 @@ async def get_datastore() -> DataStore:
             )
 
             return ElasticsearchDataStore()
+        case "local":
+            from datastore.providers.local_datastore import LocalDataStore
+
+            return LocalDataStore()
+        case "hnsw":
+            from datastore.providers.hnsw_datastore import HnswDataStore
+
+            return HnswDataStore()
+        case "local_hybrid":
+            from datastore.providers.local_hybrid_datastore import (
+                LocalHybridDataStore,
+            )
+
+            return LocalHybridDataStore()
         case _:
             raise ValueError(
                 f"Unsupported vector database: {DATASTORE}. "
-                f"Try one of the following: elasticsearch"
+                f"Try one of the following: elasticsearch, local, hnsw, local_hybrid"
             )
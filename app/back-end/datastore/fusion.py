@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FUSION_METHODS = ["rrf", "linear"]
+
+
+def fuse_rankings(
+    ids: Sequence[Sequence[str]],
+    scores: Sequence[Sequence[float]],
+    weights: Sequence[float],
+    method: str = "rrf",
+    rank_constant: int = 60,
+    size: Optional[int] = None,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Fuses the ranked results of several search legs (e.g. keyword and semantic) into one ranking.
+
+    Args:
+        ids: The ids of the results of each leg, best first.
+        scores: The scores of the results of each leg, in the order of ids.
+        weights: The weight of each leg.
+        method:
+            "rrf": reciprocal rank fusion, each result gets weight / (rank_constant + rank) from every leg it appears in.
+            "linear": the scores of each leg are min-max normalized to [0, 1], then summed with the leg weights.
+        rank_constant: The rank constant of reciprocal rank fusion, higher values give lower ranked results more weight.
+        size: The number of fused results to return, all of them if None.
+
+    Returns:
+        A tuple of (ids, scores) of the fused results, best first.
+
+    Raises:
+        ValueError: If the method is unknown, or there is not one weight per leg.
+    """
+    # The method and weights may come from a request, they are checked even when assertions are off
+    if method not in FUSION_METHODS:
+        raise ValueError("Fusion method must be one of 'rrf' / 'linear'.")
+    if not len(ids) == len(scores) == len(weights):
+        raise ValueError(
+            f"Expected one weight per leg, got {len(weights)} weights for {len(ids)} legs."
+        )
+
+    leg_sizes = [len(leg_ids) for leg_ids in ids]
+    if sum(leg_sizes) == 0:
+        return [], np.zeros(0)
+
+    # Map the results of all legs onto one array of unique ids
+    unique_ids, positions = np.unique(
+        np.concatenate([np.asarray(leg_ids, dtype=object) for leg_ids in ids]),
+        return_inverse=True,
+    )
+    fused_scores = np.zeros(len(unique_ids))
+
+    offset = 0
+    for leg_size, leg_scores, weight in zip(leg_sizes, scores, weights):
+        if leg_size == 0:
+            continue
+        if method == "rrf":
+            contributions = weight / (rank_constant + np.arange(1, leg_size + 1))
+        else:
+            leg_scores = np.asarray(leg_scores, dtype=np.float64)
+            score_range = np.ptp(leg_scores)
+            normalized = (
+                (leg_scores - leg_scores.min()) / score_range
+                if score_range > 0
+                else np.ones(leg_size)
+            )
+            contributions = weight * normalized
+        np.add.at(fused_scores, positions[offset : offset + leg_size], contributions)
+        offset += leg_size
+
+    order = np.argsort(-fused_scores, kind="stable")[:size]
+    return unique_ids[order].tolist(), fused_scores[order]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from elasticsearch import Elasticsearch
+from loguru import logger
+
+# Index settings while bulk loading: no replica copies and no refresh, i.e. no new segment every second
+BULK_LOAD_SETTINGS = {"number_of_replicas": 0, "refresh_interval": "-1"}
+# Key of the original settings in the _meta of the index mapping
+BULK_LOAD_META_KEY = "bulk_load"
+FORCE_MERGE_TIMEOUT = 3600  # seconds
+
+
+@contextmanager
+def bulk_load_mode(
+    client: Elasticsearch, index: str, force_merge: bool = False
+) -> Iterator[None]:
+    """
+    Relaxes the refresh interval and replicas of an index for the duration of a large load, then restores them.
+
+    The original settings are saved in the _meta of the index mapping before they are changed, so a load that
+    crashes before restoring them is recovered by the next bulk_load_mode (or exit_bulk_load_mode) on the index,
+    instead of taking the bulk-load settings for the original ones.
+
+    This module only depends on elasticsearch and loguru, so the data pipelines can share it.
+
+    Args:
+        client: Elasticsearch client
+        index: Index or alias to load into
+        force_merge: Merge the index down to one segment at the end of the load
+
+    Example:
+        with bulk_load_mode(es_client, "my-index", force_merge=True):
+            for document in documents:
+                es_client.index(index="my-index", document=document)
+    """
+    enter_bulk_load_mode(client, index)
+    try:
+        yield
+    finally:
+        exit_bulk_load_mode(client, index, force_merge)
+
+
+def enter_bulk_load_mode(client: Elasticsearch, index: str) -> None:
+    for name, settings in client.indices.get_settings(
+        index=index, flat_settings=True
+    ).items():
+        if _get_original_settings(client, name) is not None:
+            # Left over by a load that did not finish, its original settings are kept
+            logger.warning(f"Index '{name}' is already in bulk-load mode")
+            continue
+        # None means the setting was never set, restoring None resets it to the Elasticsearch default
+        original_settings = {
+            "number_of_replicas": settings["settings"].get("index.number_of_replicas"),
+            "refresh_interval": settings["settings"].get("index.refresh_interval"),
+        }
+        _set_original_settings(client, name, original_settings)
+        client.indices.put_settings(index=name, settings={"index": BULK_LOAD_SETTINGS})
+        logger.info(f"Index '{name}' entered bulk-load mode, was {original_settings}")
+
+
+def exit_bulk_load_mode(
+    client: Elasticsearch, index: str, force_merge: bool = False
+) -> None:
+    """
+    Restores the settings saved by enter_bulk_load_mode, also recovers an index left in bulk-load mode by a crash.
+    """
+    for name in client.indices.get_settings(index=index).keys():
+        original_settings = _get_original_settings(client, name)
+        if original_settings is None:
+            continue
+        client.indices.put_settings(
+            index=name,
+            settings={
+                "index": {"refresh_interval": original_settings["refresh_interval"]}
+            },
+        )
+        client.indices.refresh(index=name)
+        if force_merge:
+            # Merge before adding the replicas, so they copy the merged segments instead of merging on every copy
+            client.options(request_timeout=FORCE_MERGE_TIMEOUT).indices.forcemerge(
+                index=name, max_num_segments=1
+            )
+        client.indices.put_settings(
+            index=name,
+            settings={
+                "index": {"number_of_replicas": original_settings["number_of_replicas"]}
+            },
+        )
+        _set_original_settings(client, name, None)
+        logger.info(f"Index '{name}' left bulk-load mode, restored {original_settings}")
+
+
+def is_in_bulk_load_mode(client: Elasticsearch, index: str) -> bool:
+    return any(
+        _get_original_settings(client, name) is not None
+        for name in client.indices.get_settings(index=index).keys()
+    )
+
+
+def _get_original_settings(
+    client: Elasticsearch, index: str
+) -> Optional[Dict[str, Any]]:
+    mapping = client.indices.get_mapping(index=index)[index]["mappings"]
+    return mapping.get("_meta", {}).get(BULK_LOAD_META_KEY)
+
+
+def _set_original_settings(
+    client: Elasticsearch, index: str, settings: Optional[Dict[str, Any]]
+) -> None:
+    # The _meta of a mapping is replaced as a whole, so the other keys are carried over
+    meta = client.indices.get_mapping(index=index)[index]["mappings"].get("_meta", {})
+    meta.pop(BULK_LOAD_META_KEY, None)
+    if settings is not None:
+        meta[BULK_LOAD_META_KEY] = settings
+    client.indices.put_mapping(index=index, meta=meta)
@@ -1,37 +1,97 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
-from typing import Any, Dict, List, Optional
+import asyncio
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
 import elasticsearch
+import numpy as np
 from config import (
     ELASTICSEARCH_API_KEY,
+    ELASTICSEARCH_BU_INDICES,
     ELASTICSEARCH_CLOUD_ID,
     ELASTICSEARCH_INDEX,
+    ELASTICSEARCH_INDEX_OPTIONS,
     ELASTICSEARCH_PASSWORD,
     ELASTICSEARCH_REPLICAS,
     ELASTICSEARCH_SHARDS,
     ELASTICSEARCH_URL,
     ELASTICSEARCH_USERNAME,
-    NUM_CANDIDATES,
-    SEARCH_TYPE,
+    FUSION_METHOD,
+    FUSION_WEIGHTS,
+    RANK_CONSTANT,
     SIZE,
+    WINDOW_SIZE,
     K,
 )
-from datastore.datastore import DataStore
-from elasticsearch import Elasticsearch
+from datastore.datastore import VECTOR_SIZE, DataStore, get_num_candidates
+from datastore.fusion import fuse_rankings
+from datastore.providers.elasticsearch_bulk_load import (
+    BULK_LOAD_SETTINGS,
+    enter_bulk_load_mode,
+    exit_bulk_load_mode,
+    is_in_bulk_load_mode,
+)
+from datastore.providers.elasticsearch_routing import (
+    BU_NORMALIZER,
+    get_bu_alias,
+    get_bu_aliases,
+)
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch.helpers import BulkIndexError, async_scan
+from elasticsearch.serializer import OrjsonSerializer
 from loguru import logger
 from pydantic_schemas.document import (
     DocumentChunk,
     DocumentChunkWithScore,
     DocumentMetadataFilter,
+    Fusion,
     QueryResult,
     QueryWithEmbedding,
 )
 from services.date import to_unix_timestamp
 
-VECTOR_SIZE = 1536
-UPSERT_BATCH_SIZE = 100
+HNSW_INDEX_TYPES = ["hnsw", "int8_hnsw"]
+FLAT_INDEX_TYPES = ["flat", "int8_flat"]
+UPSERT_BATCH_SIZE = 100  # maximum number of chunks sent in one bulk request
+# maximum body size of one bulk request, well below Elasticsearch's http.max_content_length
+UPSERT_BATCH_BYTES = 10 * 1024 * 1024
+UPSERT_CONCURRENCY = 4  # number of bulk requests in flight at the same time
+REFRESH_INTERVAL = "1s"  # refresh interval of the live index
+TASK_POLL_INTERVAL = 5  # seconds between two checks of a reindex or force merge task
+# Field the hits of unique_documents queries are collapsed on, and name of the inner hits of each document
+COLLAPSE_FIELD = "metadata.document_id"
+INNER_HITS_NAME = "best_chunks"
+# Stored but neither indexed nor kept in doc values: the field is only returned in the _source
+STORED_ONLY = {"type": "keyword", "index": False, "doc_values": False}
+# Mapping of the chunk fields but the embedding, fields missing from it are stored but not indexed (dynamic: false)
+# Filtered fields are keywords, so term filters and deletes match the exact value
+CHUNK_PROPERTIES = {
+    "id": {"type": "keyword"},
+    "text": {"type": "text"},
+    "created_at": {"type": "date", "format": "epoch_second"},  # see to_unix_timestamp
+    "metadata": {
+        "properties": {
+            "document_id": {"type": "keyword"},
+            "source": {"type": "keyword"},
+            "source_id": {"type": "keyword"},
+            "author": {"type": "keyword"},
+            # Business units match whatever their case, like the routing of the chunks to the BU indices
+            "bu": {"type": "keyword", "normalizer": BU_NORMALIZER},
+            "url": STORED_ONLY,
+            # Any date format, the filterable timestamp is the top-level created_at
+            "created_at": STORED_ONLY,
+            "title": {"type": "text", "index": False},
+            "summary": {"type": "text", "index": False},
+            "page": STORED_ONLY,
+            # Asset ids of the images and tables, only returned with the chunk
+            "images": {"type": "object", "enabled": False},
+            "tables": {"type": "object", "enabled": False},
+        }
+    },
+}
 
 
 class ElasticsearchDataStore(DataStore):
@@ -42,21 +102,43 @@ class ElasticsearchDataStore(DataStore):
         similarity: str = "cosine",
         replicas: int = ELASTICSEARCH_REPLICAS,
         shards: int = ELASTICSEARCH_SHARDS,
+        index_options: Dict[str, Any] = ELASTICSEARCH_INDEX_OPTIONS,
+        bu_indices: Dict[str, Dict[str, int]] = ELASTICSEARCH_BU_INDICES,
         recreate_index: bool = False,
+        search_type: Optional[str] = None,
     ):
         """
         Args:
-            index_name: Name of the index to be used
+            index_name: Name of the index to be used. It is an alias over versioned indices, see reindex
+            bu_indices: Business units with their own index, named f"{index_name}-{bu}", and the shards and
+                replicas overriding the defaults for it, e.g. {"CIPS": {"shards": 3}}
             vector_size: Size of the embedding stored in a collection
             similarity:
                 Any of "cosine" / "l2_norm" / "dot_product".
+            index_options: Index options of the embedding field, e.g.
+                {"type": "int8_hnsw", "m": 16, "ef_construction": 100}
+            recreate_index: Delete the documents and create an empty index
+            search_type: Any of "hybrid" / "keyword" / "semantic", defaults to SEARCH_TYPE in config.py
 
         """
+        super().__init__(search_type=search_type)
+
         assert similarity in [
             "cosine",
             "l2_norm",
             "dot_product",
         ], "Similarity must be one of 'cosine' / 'l2_norm' / 'dot_product'."
+        assert (
+            index_options.get("type") in HNSW_INDEX_TYPES + FLAT_INDEX_TYPES
+        ), "Index options type must be one of 'hnsw' / 'int8_hnsw' / 'flat' / 'int8_flat'."
+        if index_options["type"] in HNSW_INDEX_TYPES:
+            assert index_options.get("m", 16) > 0, "HNSW m must be greater than 0."
+            assert (
+                index_options.get("ef_construction", 100) > 0
+            ), "HNSW ef_construction must be greater than 0."
+        else:
+            # Flat indices do not build a graph, Elasticsearch rejects the HNSW parameters
+            index_options = {"type": index_options["type"]}
         assert replicas > 0, "Replicas must be greater than or equal to 0."
         assert shards > 0, "Shards must be greater than or equal to 0."
 
@@ -67,42 +149,146 @@ class ElasticsearchDataStore(DataStore):
             ELASTICSEARCH_USERNAME,
             ELASTICSEARCH_PASSWORD,
         )
+        # The async client serves the request path (query), so a slow search never blocks the event loop.
+        # The sync client above is kept for index administration done at start-up.
+        self.async_client = connect_to_async_elasticsearch(
+            ELASTICSEARCH_URL,
+            ELASTICSEARCH_CLOUD_ID,
+            ELASTICSEARCH_API_KEY,
+            ELASTICSEARCH_USERNAME,
+            ELASTICSEARCH_PASSWORD,
+        )
         assert (
             index_name != "" or ELASTICSEARCH_INDEX != ""
         ), "Please provide an index name."
         self.index_name = index_name or ELASTICSEARCH_INDEX or ""
+        # Chunks are routed by business unit: the BUs of bu_indices to their own alias, the others to index_name.
+        # BUs are matched case-insensitively, so "CIPS" and "cips" chunks share an index
+        self.bu_aliases = get_bu_aliases(self.index_name, bu_indices)
+        self.aliases = [self.index_name, *self.bu_aliases.values()]
+        # Upserts and deletes go to the write index of each alias, it is the alias except during a reindex
+        self.write_indices = {alias: alias for alias in self.aliases}
 
-        replicas = replicas or ELASTICSEARCH_REPLICAS
-        shards = shards or ELASTICSEARCH_SHARDS
+        self.vector_size = vector_size
+        self.similarity = similarity
+        self.index_options = index_options
+        self.replicas = replicas or ELASTICSEARCH_REPLICAS
+        self.shards = shards or ELASTICSEARCH_SHARDS
+        # Shards and replicas of the indices behind each alias
+        self.index_settings = {
+            self.index_name: {"shards": self.shards, "replicas": self.replicas},
+            **{
+                self.bu_aliases[bu.lower()]: {
+                    "shards": settings.get("shards", self.shards),
+                    "replicas": settings.get("replicas", self.replicas),
+                }
+                for bu, settings in bu_indices.items()
+            },
+        }
 
         # Set up the collection so the documents might be inserted or queried
-        self._set_up_index(vector_size, similarity, replicas, shards, recreate_index)
+        self._set_up_index(recreate_index)
 
     async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
         """
         Takes in a list of document chunks and inserts them into the database.
+        The chunks are streamed to Elasticsearch in size and byte bounded bulk requests,
+        with up to UPSERT_CONCURRENCY requests in flight.
         Return a list of document ids.
         """
-        actions = []
-        for _, chunkList in chunks.items():
-            for chunk in chunkList:
-                actions = (
-                    actions
-                    + self._convert_document_chunk_to_es_document_operation(chunk)
-                )
+        failures: List[Dict[str, Any]] = []
+        in_flight = asyncio.Semaphore(UPSERT_CONCURRENCY)
+        tasks = []
+
+        async def send(body: bytes) -> None:
+            try:
+                failures.extend(await self._send_bulk_request(body))
+            finally:
+                in_flight.release()
+
+        # Batches are only built when a request slot is free, so memory stays bounded by the in-flight bodies
+        for body in self._iter_bulk_bodies(chunks):
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(send(body)))
+        await asyncio.gather(*tasks)
+
+        if failures:
+            logger.error(f"{len(failures)} chunks failed to index: {failures[:5]}")
+            raise BulkIndexError(f"{len(failures)} chunk(s) failed to index.", failures)
 
-        self.client.bulk(operations=actions, index=self.index_name)
         return list(chunks.keys())
 
+    def _iter_bulk_bodies(
+        self, chunks: Dict[str, List[DocumentChunk]]
+    ) -> Iterator[bytes]:
+        """
+        Lazily serializes the document chunks into NDJSON bulk bodies of at most
+        UPSERT_BATCH_SIZE chunks and UPSERT_BATCH_BYTES bytes each.
+        """
+        body = bytearray()
+        num_chunks = 0
+        for chunk_list in chunks.values():
+            for chunk in chunk_list:
+                lines = b"".join(
+                    self._serialize(operation) + b"\n"
+                    for operation in self._convert_document_chunk_to_es_document_operation(
+                        chunk
+                    )
+                )
+                if num_chunks and (
+                    num_chunks >= UPSERT_BATCH_SIZE
+                    or len(body) + len(lines) > UPSERT_BATCH_BYTES
+                ):
+                    yield bytes(body)
+                    body = bytearray()
+                    num_chunks = 0
+                body += lines
+                num_chunks += 1
+        if num_chunks:
+            yield bytes(body)
+
+    async def _send_bulk_request(self, body: bytes) -> List[Dict[str, Any]]:
+        """
+        Sends one bulk request and returns the items that failed to index.
+        """
+        # Every operation names its index, chunks of different business units share a request
+        response = await self.async_client.bulk(operations=body)
+        if not response["errors"]:
+            return []
+        failures = []
+        for item in response["items"]:
+            # Each item is keyed by its operation type, e.g. {"index": {...}}
+            result = next(iter(item.values()))
+            if "error" in result:
+                failures.append(
+                    {
+                        "id": result.get("_id"),
+                        "status": result.get("status"),
+                        "error": result["error"],
+                    }
+                )
+        return failures
+
+    def _serialize(self, operation: Dict[str, Any]) -> bytes:
+        return self.async_client.transport.serializers.dumps(
+            operation, mimetype="application/json"
+        )
+
     async def _query(
         self,
         queries: List[QueryWithEmbedding],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
     ) -> List[QueryResult]:
         """
         Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
         """
-        searches = self._convert_queries_to_msearch_query(queries)
-        results = self.client.msearch(searches=searches)
+        searches = self._convert_queries_to_msearch_query(queries, includes, excludes)
+        results = await self.async_client.msearch(searches=searches)
+        if self.search_type == "hybrid":
+            return await self._fuse_hybrid_results(
+                queries, results["responses"], includes, excludes
+            )
         return [
             QueryResult(
                 query=query.query,
@@ -110,11 +296,203 @@ class ElasticsearchDataStore(DataStore):
                     self._convert_hit_to_document_chunk_with_score(hit)
                     for hit in result["hits"]["hits"]
                 ],
+                timings={self.search_type: result["took"]},
             )
             for query, result in zip(queries, results["responses"])
         ]
 
-    async def delete(
+    async def _fuse_hybrid_results(
+        self,
+        queries: List[QueryWithEmbedding],
+        responses: List[Dict[str, Any]],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> List[QueryResult]:
+        """
+        Fuses the keyword and semantic results of each query, then fetches the _source of the fused top hits
+        of all queries with a single mget request.
+        """
+        fused = []
+        for i, query in enumerate(queries):
+            # Every hybrid query has a keyword and a semantic search, in this order
+            legs = [
+                responses[2 * i]["hits"]["hits"],
+                responses[2 * i + 1]["hits"]["hits"],
+            ]
+            fusion = query.fusion or Fusion()
+            size = query.top_k or SIZE
+            start = time.perf_counter()
+            ids, scores = fuse_rankings(
+                ids=[[hit["_id"] for hit in hits] for hits in legs],
+                scores=[[hit["_score"] for hit in hits] for hits in legs],
+                weights=fusion.weights or FUSION_WEIGHTS,
+                method=fusion.method or FUSION_METHOD,
+                rank_constant=RANK_CONSTANT,
+                size=None if query.unique_documents else size,
+            )
+            inner_hits: Dict[str, List[Dict[str, Any]]] = {}
+            if query.unique_documents:
+                ids, scores, inner_hits = self._collapse_fused_hits(
+                    legs, ids, scores, size
+                )
+            timings = {
+                "keyword": responses[2 * i]["took"],
+                "semantic": responses[2 * i + 1]["took"],
+                "fusion": (time.perf_counter() - start) * 1000,
+            }
+            fused.append((ids, scores, inner_hits, timings))
+
+        # Fetch phase: the searches above only return ids and scores, and the index of each hit
+        start = time.perf_counter()
+        indices = {
+            hit["_id"]: hit["_index"]
+            for response in responses
+            for top_hit in response["hits"]["hits"]
+            for hit in [top_hit, *get_inner_hits(top_hit)]
+        }
+        ids = list(
+            dict.fromkeys(
+                chunk_id
+                for result_ids, _, inner_hits, _ in fused
+                for chunk_id in [
+                    *result_ids,
+                    *(hit["_id"] for hits in inner_hits.values() for hit in hits),
+                ]
+            )
+        )
+        sources = {}
+        if ids:
+            response = await self.async_client.mget(
+                docs=[
+                    {"_index": indices[chunk_id], "_id": chunk_id} for chunk_id in ids
+                ],
+                source_includes=includes,
+                source_excludes=excludes,
+            )
+            sources = {doc["_id"]: doc for doc in response["docs"] if doc.get("found")}
+        fetch_time = (time.perf_counter() - start) * 1000
+
+        def get_hit(chunk_id: str, score: float) -> Dict[str, Any]:
+            return {**sources[chunk_id], "_score": score}
+
+        return [
+            QueryResult(
+                query=query.query,
+                results=[
+                    self._convert_hit_to_document_chunk_with_score(
+                        get_hit(chunk_id, score),
+                        inner_hits=[
+                            get_hit(hit["_id"], hit["_score"])
+                            for hit in inner_hits[chunk_id]
+                            if hit["_id"] in sources
+                        ]
+                        if chunk_id in inner_hits
+                        else None,
+                    )
+                    for chunk_id, score in zip(result_ids, scores.tolist())
+                    # Chunks deleted between the search and the fetch are skipped
+                    if chunk_id in sources
+                ],
+                timings={**timings, "fetch": fetch_time},
+            )
+            for query, (result_ids, scores, inner_hits, timings) in zip(queries, fused)
+        ]
+
+    def _collapse_fused_hits(
+        self,
+        legs: List[List[Dict[str, Any]]],
+        ids: List[str],
+        scores: np.ndarray,
+        size: int,
+    ) -> Tuple[List[str], np.ndarray, Dict[str, List[Dict[str, Any]]]]:
+        """
+        Keeps the best fused chunk of the first size documents.
+        Each leg is collapsed already, but a document may have a different best chunk in each leg.
+        Returns the ids and scores of the kept chunks, and the inner hits of each of them.
+        """
+        hits: Dict[str, Dict[str, Any]] = {}
+        for leg in legs:
+            for hit in leg:
+                hits.setdefault(hit["_id"], hit)
+
+        document_ids = set()
+        kept = []
+        for position, chunk_id in enumerate(ids):
+            # Chunks without a document_id are documents of their own
+            document_id = (
+                hits[chunk_id].get("fields", {}).get(COLLAPSE_FIELD, [chunk_id])[0]
+            )
+            if document_id in document_ids:
+                continue
+            document_ids.add(document_id)
+            kept.append(position)
+            if len(kept) == size:
+                break
+
+        ids = [ids[position] for position in kept]
+        inner_hits = {
+            chunk_id: get_inner_hits(hits[chunk_id])
+            for chunk_id in ids
+            if "inner_hits" in hits[chunk_id]
+        }
+        return ids, scores[kept], inner_hits
+
+    async def _get_content_hashes(
+        self, document_ids: List[str]
+    ) -> Dict[str, Optional[str]]:
+        """
+        Returns the content hash of every chunk of the documents, by chunk id.
+        Only the hashes are read, the chunks are scrolled through in the write index of every alias:
+        during a reindex, the unchanged chunks an incremental upsert skips must already be in the new index.
+        """
+        index = self._get_write_indices(self.aliases)
+        rebuilt = [
+            self.write_indices[alias]
+            for alias in self.aliases
+            if self.write_indices[alias] != alias
+        ]
+        if rebuilt:
+            # The new index is not refreshed while it is loaded, its chunks are only searchable after a refresh
+            await self.async_client.indices.refresh(index=",".join(rebuilt))
+        hashes = {}
+        async for hit in async_scan(
+            self.async_client,
+            index=index,
+            query={"query": {"terms": {"metadata.document_id": document_ids}}},
+            _source=["metadata.content_hash"],
+        ):
+            hashes[hit["_id"]] = hit["_source"].get("metadata", {}).get("content_hash")
+        return hashes
+
+    async def get_chunks(
+        self, ids: List[str], includes: Optional[List[str]] = None
+    ) -> List[DocumentChunk]:
+        """
+        Fetches document chunks by chunk id with a single mget request.
+        The business unit of a chunk is not known from its id, every alias is looked up.
+        """
+        response = await self.async_client.mget(
+            docs=[
+                {"_index": alias, "_id": chunk_id}
+                for chunk_id in ids
+                for alias in self.aliases
+            ],
+            source_includes=includes,
+        )
+        return [
+            self._convert_hit_to_document_chunk(doc)
+            for doc in response["docs"]
+            if doc.get("found")
+        ]
+
+    async def close(self) -> None:
+        """
+        Closes the connections to Elasticsearch.
+        """
+        await self.async_client.close()
+        self.client.close()
+
+    async def _delete(
         self,
         ids: Optional[List[str]] = None,
         filter: Optional[DocumentMetadataFilter] = None,
@@ -129,8 +507,10 @@ class ElasticsearchDataStore(DataStore):
         if delete_all:
             try:
                 logger.info(f"Deleting all vectors from index")
-                self.client.delete_by_query(
-                    index=self.index_name, query={"match_all": {}}
+                await self.async_client.delete_by_query(
+                    index=self._get_write_indices(self.aliases),
+                    query={"match_all": {}},
+                    conflicts="proceed",
                 )
                 logger.info(f"Deleted all vectors successfully")
                 return True
@@ -144,7 +524,11 @@ class ElasticsearchDataStore(DataStore):
         if es_filters != {}:
             try:
                 logger.info(f"Deleting vectors with filter {es_filters}")
-                self.client.delete_by_query(index=self.index_name, query=es_filters)
+                await self.async_client.delete_by_query(
+                    index=self._get_write_indices(self._get_target_aliases(filter)),
+                    query=es_filters,
+                    conflicts="proceed",
+                )
                 logger.info(f"Deleted vectors with filter successfully")
             except Exception as e:
                 logger.error(f"Error deleting vectors with filter: {e}")
@@ -154,9 +538,11 @@ class ElasticsearchDataStore(DataStore):
             try:
                 documents_to_delete = [doc_id for doc_id in ids]
                 logger.info(f"Deleting {len(documents_to_delete)} documents")
-                res = self.client.delete_by_query(
-                    index=self.index_name,
+                # One terms query removes the chunks of all the documents in a single pass over the index
+                await self.async_client.delete_by_query(
+                    index=self._get_write_indices(self.aliases),
                     query={"terms": {"metadata.document_id": documents_to_delete}},
+                    conflicts="proceed",
                 )
                 logger.info(f"Deleted documents successfully")
             except Exception as e:
@@ -165,6 +551,21 @@ class ElasticsearchDataStore(DataStore):
 
         return True
 
+    async def _delete_chunk_ids(self, ids: List[str]) -> None:
+        """
+        Removes the chunks with the given chunk ids, from every alias as the business unit of a chunk is not known from its id.
+        """
+        try:
+            logger.info(f"Deleting {len(ids)} chunks")
+            await self.async_client.delete_by_query(
+                index=self._get_write_indices(self.aliases),
+                query={"ids": {"values": ids}},
+                conflicts="proceed",
+            )
+        except Exception as e:
+            logger.error(f"Error deleting chunks: {e}")
+            raise e
+
     def _get_es_filters(
         self, filter: Optional[DocumentMetadataFilter] = None
     ) -> Dict[str, Any]:
@@ -173,29 +574,50 @@ class ElasticsearchDataStore(DataStore):
 
         es_filters = {
             "bool": {
-                "must": [],
+                "filter": [],
             }
         }
 
-        # For each field in the MetadataFilter, check if it has a value and add the corresponding pinecone filter expression
+        # For each field in the MetadataFilter, check if it has a value and add the corresponding filter clause
         # For start_date and end_date, uses the range query - gte and lte operators respectively
         # For other fields, uses the term query
         for field, value in filter.dict().items():
             if value is not None:
                 if field == "start_date":
-                    es_filters["bool"]["must"].append(
+                    es_filters["bool"]["filter"].append(
                         {"range": {"created_at": {"gte": to_unix_timestamp(value)}}}
                     )
                 elif field == "end_date":
-                    es_filters["bool"]["must"].append(
+                    es_filters["bool"]["filter"].append(
                         {"range": {"created_at": {"lte": to_unix_timestamp(value)}}}
                     )
                 else:
-                    es_filters["bool"]["must"].append(
+                    es_filters["bool"]["filter"].append(
                         {"term": {f"metadata.{field}": value}}
                     )
 
-        return es_filters
+        # A filter without any value matches everything, like no filter
+        return es_filters if es_filters["bool"]["filter"] else {}
+
+    def get_alias(self, bu: Optional[str] = None) -> str:
+        """
+        Returns the alias of the index holding the chunks of a business unit, whatever the case of its name.
+        """
+        return get_bu_alias(self.index_name, self.bu_aliases, bu)
+
+    def _get_target_aliases(
+        self, filter: Optional[DocumentMetadataFilter] = None
+    ) -> List[str]:
+        """
+        Returns the aliases holding the chunks that may match the filter:
+        the alias of its business unit, or every alias when it has none.
+        """
+        if filter is not None and filter.bu is not None:
+            return [self.get_alias(filter.bu)]
+        return self.aliases
+
+    def _get_write_indices(self, aliases: List[str]) -> str:
+        return ",".join(self.write_indices[alias] for alias in aliases)
 
     def _convert_document_chunk_to_es_document_operation(
         self, document_chunk: DocumentChunk
@@ -208,7 +630,9 @@ class ElasticsearchDataStore(DataStore):
 
         action_and_metadata = {
             "index": {
-                "_index": self.index_name,
+                "_index": self.write_indices[
+                    self.get_alias(document_chunk.metadata.bu)
+                ],
                 "_id": document_chunk.id,
             }
         }
@@ -223,78 +647,98 @@ class ElasticsearchDataStore(DataStore):
 
         return [action_and_metadata, source]
 
-    def _convert_queries_to_msearch_query(self, queries: List[QueryWithEmbedding]):
+    def _convert_queries_to_msearch_query(
+        self,
+        queries: List[QueryWithEmbedding],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ):
         searches = []
+        source = self._get_source_filter(includes, excludes)
 
         for query in queries:
-            searches.append({"index": self.index_name})
-            if SEARCH_TYPE == "hybrid":
+            # A query on a business unit with its own index only searches that index,
+            # the other queries fan out to every index
+            aliases = self._get_target_aliases(query.filter)
+            filter = query.filter
+            if aliases[0] != self.index_name:
+                # Every chunk of the index belongs to the business unit, so the kNN search walks its HNSW graph
+                # without a filter
+                filter = filter.copy(update={"bu": None})
+            index = ",".join(aliases)
+            # The metadata filter is applied inside the searches, so the kNN search only visits
+            # the matching chunks and the top_k hits are all matches
+            es_filters = self._get_es_filters(filter)
+            size = query.top_k or SIZE
+            k = query.top_k or K
+            searches.append({"index": index})
+            if self.search_type == "hybrid":
+                # The keyword and semantic searches run as separate searches of the msearch request and are fused
+                # client-side, see _fuse_hybrid_results. They only return ids and scores, the _source is fetched
+                # once for the fused top hits.
+                # With unique_documents, each search returns the best chunk of WINDOW_SIZE documents
+                window_size = max(WINDOW_SIZE, size)
                 searches.append(
                     {
-                        "size": SIZE,
-                        "query": {
-                            # "bool": {
-                            #     "should": [
-                            #         {
-                            #             "multi_match": {
-                            #                 "query": query.query,
-                            #                 "fields": ["filename^3", "content"],
-                            #                 "type": "phrase",
-                            #             }
-                            #         },
-                            #         {
-                            #             "multi_match": {
-                            #                 "query": query.query,
-                            #                 "fields": ["filename^3", "content"],
-                            #                 "type": "most_fields",
-                            #                 "tie_breaker": 0.8,
-                            #             }
-                            #         },
-                            #     ],
-                            #     "minimum_should_match": 1,
-                            #     "boost": 0.8,
-                            # }
-                            "multi_match": {
-                                "query": query.query,
-                                "fields": ["text"],
-                                "type": "best_fields",
-                                "boost": 0.8,
+                        "size": window_size,
+                        "_source": False,
+                        "query": self._get_keyword_query(
+                            {
+                                "multi_match": {
+                                    "query": query.query,
+                                    "fields": ["text"],
+                                    "type": "best_fields",
+                                },
                             },
-                        },
-                        "knn": {
-                            "field": "embedding",
-                            "query_vector": query.embedding,
-                            "k": K,
-                            "num_candidates": NUM_CANDIDATES,
-                            "boost": 0.2,
-                        },
-                        # "rank": {"rrf": {"window_size": WINDOW_SIZE}},
+                            es_filters,
+                        ),
+                        **self._get_collapse(query, False),
+                    }
+                )
+                searches.append({"index": index})
+                searches.append(
+                    {
+                        "size": window_size,
+                        "_source": False,
+                        "knn": self._get_knn_query(
+                            query.embedding, window_size, es_filters
+                        ),
+                        **self._get_collapse(query, False),
                     }
                 )
-            elif SEARCH_TYPE == "keyword":
+            elif self.search_type == "keyword":
                 searches.append(
                     {
-                        "size": SIZE,
-                        "query": {
-                            "multi_match": {
-                                "query": query.query,
-                                "fields": ["filename^3", "content"],
-                                "type": "best_fields",
-                                "tie_breaker": 0.3,
-                                "operator": "and",
-                            }
-                        },
+                        "size": size,
+                        "_source": source,
+                        "query": self._get_keyword_query(
+                            {
+                                "multi_match": {
+                                    "query": query.query,
+                                    "fields": ["text"],
+                                    "type": "best_fields",
+                                    "tie_breaker": 0.3,
+                                    "operator": "and",
+                                }
+                            },
+                            es_filters,
+                        ),
+                        **self._get_collapse(query, source),
                     }
                 )
-            elif SEARCH_TYPE == "semantic":
+            elif self.search_type == "semantic":
+                # The kNN search returns k chunks before they are collapsed, with unique_documents it returns
+                # WINDOW_SIZE chunks so they are likely to cover k documents
                 searches.append(
                     {
-                        "knn": {
-                            "field": "embedding",
-                            "query_vector": query.embedding,
-                            "k": K,
-                            "num_candidates": NUM_CANDIDATES,
-                        },
+                        "size": k,
+                        "_source": source,
+                        "knn": self._get_knn_query(
+                            query.embedding,
+                            max(WINDOW_SIZE, k) if query.unique_documents else k,
+                            es_filters,
+                        ),
+                        **self._get_collapse(query, source),
                     }
                 )
             else:
@@ -304,81 +748,445 @@ class ElasticsearchDataStore(DataStore):
 
         return searches
 
-    def _convert_hit_to_document_chunk_with_score(self, hit) -> DocumentChunkWithScore:
+    def _get_collapse(
+        self, query: QueryWithEmbedding, source: Union[bool, Dict[str, List[str]]]
+    ) -> Dict[str, Any]:
+        """
+        Returns the collapse of a search on the document_id of the chunks for unique_documents queries,
+        so each document is returned once with its best chunk, and its best chunks as inner hits.
+        """
+        if not query.unique_documents:
+            return {}
+        collapse = {"field": COLLAPSE_FIELD}
+        if query.inner_hits_size:
+            collapse["inner_hits"] = {
+                "name": INNER_HITS_NAME,
+                "size": query.inner_hits_size,
+                "_source": source,
+            }
+        return {"collapse": collapse}
+
+    def _get_keyword_query(
+        self, query: Dict[str, Any], es_filters: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        if not es_filters:
+            return query
+        # Filter clauses do not contribute to the BM25 score
+        return {"bool": {"must": [query], **es_filters["bool"]}}
+
+    def _get_knn_query(
+        self, embedding: np.ndarray, k: int, es_filters: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        knn = {
+            "field": "embedding",
+            "query_vector": embedding,
+            "k": k,
+            "num_candidates": get_num_candidates(k),
+        }
+        if es_filters:
+            # Pre-filter: the HNSW graph is searched for the nearest chunks among the matching ones
+            knn["filter"] = es_filters
+        return knn
+
+    def _get_source_filter(
+        self, includes: Optional[List[str]] = None, excludes: Optional[List[str]] = None
+    ) -> Union[bool, Dict[str, List[str]]]:
+        source = {}
+        if includes:
+            source["includes"] = includes
+        if excludes:
+            source["excludes"] = excludes
+        # Fetch the whole _source when there is nothing to filter
+        return source or True
+
+    def _convert_hit_to_document_chunk(self, hit) -> DocumentChunk:
+        return DocumentChunk(
+            id=hit["_id"],
+            text=hit["_source"].get("text", ""),  # type: ignore
+            metadata=hit["_source"].get("metadata", {}),  # type: ignore
+            embedding=hit["_source"].get("embedding"),  # type: ignore
+        )
+
+    def _convert_hit_to_document_chunk_with_score(
+        self, hit, inner_hits: Optional[List[Dict[str, Any]]] = None
+    ) -> DocumentChunkWithScore:
+        # Fields left out by the _source filter are not set on the chunk
+        if inner_hits is None and "inner_hits" in hit:
+            inner_hits = get_inner_hits(hit)
         return DocumentChunkWithScore(
             id=hit["_id"],
-            text=hit["_source"]["text"],  # type: ignore
-            metadata=hit["_source"]["metadata"],  # type: ignore
-            embedding=hit["_source"]["embedding"],  # type: ignore
+            text=hit["_source"].get("text", ""),  # type: ignore
+            metadata=hit["_source"].get("metadata", {}),  # type: ignore
+            embedding=hit["_source"].get("embedding"),  # type: ignore
             score=hit["_score"],
+            inner_hits=[
+                self._convert_hit_to_document_chunk_with_score(inner_hit)
+                for inner_hit in inner_hits
+            ]
+            if inner_hits is not None
+            else None,
         )
 
-    def _set_up_index(
-        self,
-        vector_size: int,
-        similarity: str,
-        replicas: int,
-        shards: int,
-        recreate_index: bool,
-    ) -> None:
+    def _set_up_index(self, recreate_index: bool) -> None:
+        for alias in self.aliases:
+            self._set_up_alias(alias, recreate_index)
+
+    def _set_up_alias(self, alias: str, recreate_index: bool) -> None:
         if recreate_index:
-            self._recreate_index(similarity, vector_size, replicas, shards)
+            self._recreate_index(alias)
 
         try:
-            index_mapping = self.client.indices.get_mapping(index=self.index_name)
-            current_similarity = index_mapping[self.index_name]["mappings"]["properties"]["embedding"]["similarity"]  # type: ignore
-            current_vector_size = index_mapping[self.index_name]["mappings"]["properties"]["embedding"]["dims"]  # type: ignore
+            index_mapping = self.client.indices.get_mapping(index=alias)
+            # The mapping is keyed by the versioned index behind the alias
+            properties = next(iter(index_mapping.values()))["mappings"]["properties"]  # type: ignore
+            embedding_mapping = properties["embedding"]
+            current_similarity = embedding_mapping["similarity"]
+            current_vector_size = embedding_mapping["dims"]
+            # Indices created without index_options use the defaults of the cluster, which depend on its version
+            # (int8_hnsw since 8.14), so the effective index options are read with the defaults of the field
+            field_mapping = self.client.indices.get_field_mapping(
+                index=alias, fields="embedding", include_defaults=True
+            )
+            effective_mapping = next(iter(field_mapping.values()))["mappings"]["embedding"]["mapping"]["embedding"]  # type: ignore
+            # Clusters that do not report the default index options index every vector in an hnsw graph
+            current_index_options = effective_mapping.get("index_options", {"type": "hnsw", "m": 16, "ef_construction": 100})  # type: ignore
 
-            if current_similarity != similarity:
+            if current_similarity != self.similarity:
                 raise ValueError(
-                    f"Collection '{self.index_name}' already exists in Elasticsearch, "
+                    f"Collection '{alias}' already exists in Elasticsearch, "
                     f"but it is configured with a similarity '{current_similarity}'. "
                     f"If you want to use that collection, but with a different "
                     f"similarity, please set `recreate_index=True` argument."
                 )
 
-            if current_vector_size != vector_size:
+            if current_vector_size != self.vector_size:
                 raise ValueError(
-                    f"Collection '{self.index_name}' already exists in Elasticsearch, "
+                    f"Collection '{alias}' already exists in Elasticsearch, "
                     f"but it is configured with a vector size '{current_vector_size}'. "
                     f"If you want to use that collection, but with a different "
                     f"vector size, please set `recreate_index=True` argument."
                 )
+
+            for option, value in self.index_options.items():
+                if current_index_options.get(option) != value:
+                    raise ValueError(
+                        f"Collection '{alias}' already exists in Elasticsearch, "
+                        f"but it is configured with index options '{current_index_options}'. "
+                        f"If you want to use that collection, but with different "
+                        f"index options, please set `recreate_index=True` argument."
+                    )
+
+            # Chunks of an index with another mapping are still searchable, but filters may miss them
+            drift = get_mapping_drift(CHUNK_PROPERTIES, properties)
+            if drift:
+                logger.warning(
+                    f"The mapping of index '{alias}' differs from the chunk mapping: {'; '.join(drift)}. "
+                    f"Rebuild the index with `reindex(copy_documents=True)` to apply the chunk mapping."
+                )
         except elasticsearch.exceptions.NotFoundError:
-            self._recreate_index(similarity, vector_size, replicas, shards)
+            self._recreate_index(alias)
 
-    def _recreate_index(
-        self, similarity: str, vector_size: int, replicas: int, shards: int
-    ) -> None:
+        if is_in_bulk_load_mode(self.client, alias):
+            # Either a load is running, or one crashed and the next bulk_load restores the settings
+            logger.warning(
+                f"Index '{alias}' is in bulk-load mode, "
+                f"searches may not see the latest documents until the load ends."
+            )
+
+    @asynccontextmanager
+    async def bulk_load(
+        self, force_merge: bool = False, bu: Optional[str] = None
+    ) -> AsyncIterator[None]:
+        """
+        Turns off the refresh and the replicas of the live index during a large load, see bulk_load_mode.
+        Prefer reindex to rebuild the whole index, it keeps the live index searchable.
+        The settings requests and the force merge are blocking calls of the sync client shared with the
+        data pipelines, they run in worker threads so the event loop keeps serving other requests.
+
+        Args:
+            force_merge: Merge the segments of the index at the end of the load.
+            bu: Only switch the index of this business unit, defaults to every index.
+
+        Example:
+            async with datastore.bulk_load(force_merge=True):
+                await datastore.upsert(documents)
+        """
+        aliases = [self.get_alias(bu)] if bu else self.aliases
+        async with AsyncExitStack() as stack:
+            for alias in aliases:
+                await asyncio.to_thread(enter_bulk_load_mode, self.client, alias)
+                # Every index entered is restored, even if restoring another one fails
+                stack.push_async_callback(
+                    asyncio.to_thread,
+                    exit_bulk_load_mode,
+                    self.client,
+                    alias,
+                    force_merge,
+                )
+            yield
+        self._invalidate_query_cache()
+
+    def _recreate_index(self, alias: str) -> None:
+        """
+        Deletes the indices behind the alias and points the alias to a new empty index.
+        """
+        live_indices = self._get_live_indices(alias)
+        if live_indices:
+            self.client.indices.delete(index=live_indices)
+        index = self._create_index(alias)
+        self.client.indices.put_alias(index=index, name=alias, is_write_index=True)
+
+    def _get_live_indices(self, alias: str) -> List[str]:
+        """
+        Returns the indices behind the alias.
+        An index created before the alias was introduced is returned as is, the next reindex replaces it by the alias.
+        """
+        if self.client.indices.exists_alias(name=alias):
+            return list(self.client.indices.get_alias(name=alias).keys())
+        if self.client.indices.exists(index=alias):
+            return [alias]
+        return []
+
+    def _create_index(self, alias: str, bulk_load: bool = False) -> str:
+        """
+        Creates a new versioned index, named after the alias and the creation time in milliseconds,
+        with the shards and replicas of the alias.
+        With bulk_load, the index has no replicas and no refresh, the settings of a search index are restored
+        by _activate_index.
+        """
+        index = f"{alias}_v{int(time.time() * 1000)}"
         settings = {
             "index": {
-                "number_of_shards": shards,
-                "number_of_replicas": replicas,
-                "refresh_interval": "1s",
+                "number_of_shards": self.index_settings[alias]["shards"],
+                "number_of_replicas": self.index_settings[alias]["replicas"],
+                "refresh_interval": REFRESH_INTERVAL,
+                # The texts and the stored-only metadata dominate the _source, deflate them
+                "codec": "best_compression",
+                **(BULK_LOAD_SETTINGS if bulk_load else {}),
             }
         }
-        mappings = {
+        self.client.indices.create(
+            index=index, mappings=self._get_mappings(), settings=settings
+        )
+        return index
+
+    def _get_mappings(self) -> Dict[str, Any]:
+        return {
+            "dynamic": False,
             "properties": {
+                **CHUNK_PROPERTIES,
                 "embedding": {
                     "type": "dense_vector",
-                    "dims": vector_size,
+                    "dims": self.vector_size,
                     "index": True,
-                    "similarity": similarity,
-                }
-            }
+                    "similarity": self.similarity,
+                    "index_options": self.index_options,
+                },
+            },
         }
 
-        self.client.indices.delete(
-            index=self.index_name, ignore_unavailable=True, allow_no_indices=True
+    @asynccontextmanager
+    async def reindex(
+        self,
+        copy_documents: bool = False,
+        keep_old_indices: bool = False,
+        bu: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Rebuilds the index without downtime (blue/green).
+        A new versioned index is created with bulk-load settings (no replicas, no refresh) and every upsert
+        and delete inside the context writes to it, while queries keep running on the live index behind the alias.
+        On exit the settings are restored, the new index is force merged and the alias is swapped to it
+        in one atomic request. If the context raises, the new index is deleted and the live index is untouched.
+
+        Args:
+            copy_documents: Fill the new index with the documents of the live index first (Elasticsearch _reindex),
+                e.g. to apply new index options without re-embedding.
+            keep_old_indices: Only remove the old indices from the alias instead of deleting them, so they can be
+                swapped back.
+            bu: Rebuild the index of this business unit, defaults to index_name, the index of the business units
+                without their own index. Upserts of chunks of other business units still go to their live index.
+
+        Yields:
+            The name of the new index.
+
+        Example:
+            async with datastore.reindex():
+                # The new index starts empty and is not refreshed, so there is nothing to delete before upserting
+                await datastore.upsert(documents, skip_delete=True)
+        """
+        alias = self.get_alias(bu)
+        assert self.write_indices[alias] == alias, "A reindex is already running."
+        old_indices = self._get_live_indices(alias)
+        new_index = self._create_index(alias, bulk_load=True)
+        logger.info(f"Reindexing '{alias}' from {old_indices} to '{new_index}'")
+
+        self.write_indices[alias] = new_index
+        try:
+            if copy_documents and old_indices:
+                response = await self.async_client.reindex(
+                    source={"index": alias},
+                    dest={"index": new_index},
+                    slices="auto",
+                    wait_for_completion=False,
+                )
+                await self._wait_for_task(response["task"])
+            yield new_index
+        except BaseException:
+            logger.error(f"Reindex failed, deleting '{new_index}'")
+            await self.async_client.indices.delete(index=new_index)
+            raise
+        finally:
+            self.write_indices[alias] = alias
+
+        await self._activate_index(alias, new_index, old_indices, keep_old_indices)
+        self._invalidate_query_cache()
+        logger.info(f"Swapped '{alias}' to '{new_index}'")
+
+    async def _activate_index(
+        self,
+        alias: str,
+        new_index: str,
+        old_indices: List[str],
+        keep_old_indices: bool,
+    ) -> None:
+        """
+        Restores the search settings of a bulk-loaded index, then moves the alias from the old indices to it.
+        """
+        await self.async_client.indices.put_settings(
+            index=new_index, settings={"index": {"refresh_interval": REFRESH_INTERVAL}}
         )
-        self.client.indices.create(
-            index=self.index_name, mappings=mappings, settings=settings
+        await self.async_client.indices.refresh(index=new_index)
+        # Merge before adding the replicas, so they copy the merged segments instead of merging on every copy
+        response = await self.async_client.indices.forcemerge(
+            index=new_index, max_num_segments=1, wait_for_completion=False
+        )
+        await self._wait_for_task(response["task"])
+        await self.async_client.indices.put_settings(
+            index=new_index,
+            settings={
+                "index": {"number_of_replicas": self.index_settings[alias]["replicas"]}
+            },
         )
 
+        actions = [
+            {
+                "add": {
+                    "index": new_index,
+                    "alias": alias,
+                    "is_write_index": True,
+                }
+            }
+        ]
+        for index in old_indices:
+            # An index named like the alias has to be deleted in the same request for the alias to be added
+            if keep_old_indices and index != alias:
+                actions.append({"remove": {"index": index, "alias": alias}})
+            else:
+                actions.append({"remove_index": {"index": index}})
+        await self.async_client.indices.update_aliases(actions=actions)
 
-def connect_to_elasticsearch(
+    async def get_index_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the statistics of the indices behind each alias, e.g. to decide which business units need
+        their own index or more shards: the number of chunks, the size in bytes, and the shards and replicas.
+        """
+
+        async def get_stats(alias: str) -> Dict[str, Any]:
+            response = await self.async_client.indices.stats(
+                index=alias, metric=["docs", "store"]
+            )
+            primaries = response["_all"]["primaries"]
+            return {
+                "bu": next(
+                    (
+                        bu
+                        for bu, bu_alias in self.bu_aliases.items()
+                        if bu_alias == alias
+                    ),
+                    None,
+                ),
+                "indices": list(response["indices"].keys()),
+                "chunks": primaries["docs"]["count"],
+                "deleted_chunks": primaries["docs"]["deleted"],
+                "primary_size_in_bytes": primaries["store"]["size_in_bytes"],
+                "size_in_bytes": response["_all"]["total"]["store"]["size_in_bytes"],
+                **self.index_settings[alias],
+            }
+
+        stats = await asyncio.gather(*[get_stats(alias) for alias in self.aliases])
+        return dict(zip(self.aliases, stats))
+
+    async def _wait_for_task(self, task_id: str) -> None:
+        """
+        Polls a background task (reindex, force merge) until it completes, long tasks would time out the request.
+        """
+        while True:
+            task = await self.async_client.tasks.get(task_id=task_id)
+            if task["completed"]:
+                break
+            await asyncio.sleep(TASK_POLL_INTERVAL)
+        failures = task.get("error") or task.get("response", {}).get("failures")
+        if failures:
+            raise RuntimeError(f"Task {task_id} failed: {failures}")
+
+
+def get_mapping_drift(
+    expected: Dict[str, Any], actual: Dict[str, Any], path: str = ""
+) -> List[str]:
+    """
+    Compares the properties of an index mapping to the expected ones.
+    Returns a description of each field mapped differently, missing, or mapped dynamically.
+
+    Args:
+        expected: The expected properties, e.g. CHUNK_PROPERTIES.
+        actual: The properties of the index mapping.
+        path: The path of the object holding the properties, for the descriptions.
+    """
+    drift = []
+    for field, mapping in expected.items():
+        name = f"{path}{field}"
+        if field not in actual:
+            drift.append(f"{name} is not mapped")
+        elif "properties" in mapping:
+            drift.extend(
+                get_mapping_drift(
+                    mapping["properties"],
+                    actual[field].get("properties", {}),
+                    f"{name}.",
+                )
+            )
+        else:
+            # Elasticsearch leaves out the parameters set to their default, they are absent from the expected mapping
+            differences = {
+                param: actual[field].get(param)
+                for param, value in mapping.items()
+                if actual[field].get(param) != value
+            }
+            if differences:
+                drift.append(
+                    f"{name} is mapped with {differences} instead of {mapping}"
+                )
+    for field in actual.keys() - expected.keys() - {"embedding"}:
+        drift.append(f"{path}{field} is not in the chunk mapping")
+    return drift
+
+
+def get_inner_hits(hit: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Returns the inner hits of a collapsed hit, the best chunks of its document.
+    """
+    return (
+        hit.get("inner_hits", {})
+        .get(INNER_HITS_NAME, {})
+        .get("hits", {})
+        .get("hits", [])
+    )
+
+
+def get_connection_params(
     elasticsearch_url=None, cloud_id=None, api_key=None, username=None, password=None
-):
+) -> Dict[str, Any]:
     # Check if both elasticsearch_url and cloud_id are defined
     if elasticsearch_url and cloud_id:
         raise ValueError(
@@ -406,6 +1214,19 @@ def connect_to_elasticsearch(
             "No authentication details provided. Please consider using an api_key or username and password to secure your connection."
         )
 
+    # orjson writes the float32 embeddings straight from their arrays, without converting them to lists of floats
+    connection_params["serializer"] = OrjsonSerializer()
+
+    return connection_params
+
+
+def connect_to_elasticsearch(
+    elasticsearch_url=None, cloud_id=None, api_key=None, username=None, password=None
+):
+    connection_params = get_connection_params(
+        elasticsearch_url, cloud_id, api_key, username, password
+    )
+
     # Establish the Elasticsearch client connection
     es_client = Elasticsearch(**connection_params)
     try:
@@ -415,3 +1236,13 @@ def connect_to_elasticsearch(
         raise e
 
     return es_client
+
+
+def connect_to_async_elasticsearch(
+    elasticsearch_url=None, cloud_id=None, api_key=None, username=None, password=None
+):
+    # The connection is checked by the sync client, an async client only connects on first use
+    connection_params = get_connection_params(
+        elasticsearch_url, cloud_id, api_key, username, password
+    )
+    return AsyncElasticsearch(**connection_params)
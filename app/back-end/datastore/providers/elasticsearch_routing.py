@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from typing import Dict, Iterable, Optional
+
+# Built-in normalizer of the metadata.bu keyword field: business units are stored, filtered and routed lowercase
+BU_NORMALIZER = "lowercase"
+
+
+def get_bu_aliases(index_name: str, bu_indices: Iterable[str]) -> Dict[str, str]:
+    """
+    Returns the alias of the index of each business unit with its own index, named f"{index_name}-{bu}" (lowercase),
+    keyed by the lowercase name of the business unit.
+
+    This module has no dependencies, so the data pipelines can share it.
+
+    Args:
+        index_name: The alias of the index of the other business units
+        bu_indices: The business units with their own index, e.g. the keys of ELASTICSEARCH_BU_INDICES
+    """
+    return {bu.lower(): f"{index_name}-{bu}".lower() for bu in bu_indices}
+
+
+def get_bu_alias(
+    index_name: str, bu_aliases: Dict[str, str], bu: Optional[str] = None
+) -> str:
+    """
+    Returns the alias of the index holding the chunks of a business unit, whatever the case of its name.
+
+    Args:
+        index_name: The alias of the index of the business units without their own index
+        bu_aliases: The aliases returned by get_bu_aliases
+        bu: The business unit of the chunks
+    """
+    return bu_aliases.get(bu.lower(), index_name) if bu else index_name
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import hnswlib
+import numpy as np
+from config import HNSW_INDEX_OPTIONS, LOCAL_DATASTORE_PATH
+from datastore.datastore import VECTOR_SIZE, get_num_candidates
+from datastore.providers.local_datastore import COPY_BATCH_SIZE, LocalDataStore
+from loguru import logger
+
+# hnswlib space of each similarity
+HNSW_SPACES = {"cosine": "cosine", "dot_product": "ip", "l2_norm": "l2"}
+GRAPH_FILE = "hnsw.bin"
+# Number of added or deleted chunks after which the graph is saved, it is always saved on close
+GRAPH_SAVE_INTERVAL = 10000
+
+
+class HnswDataStore(LocalDataStore):
+    """
+    In-process datastore searching an HNSW graph (hnswlib) built over the embedding matrix of LocalDataStore,
+    for single-node installs with millions of chunks.
+
+    Chunks are added to and deleted from the graph incrementally. The graph is saved next to the matrix and
+    loaded at start-up: chunks written since the last save are added or deleted again, and a graph saved against
+    another layout of the matrix (e.g. before a compaction) is rebuilt. Like the Elasticsearch kNN search, the graph
+    is searched for NUM_CANDIDATES candidates, and filters matching fewer chunks than that are searched exactly.
+    """
+
+    def __init__(
+        self,
+        path: str = LOCAL_DATASTORE_PATH,
+        vector_size: int = VECTOR_SIZE,
+        similarity: str = "cosine",
+        index_options: Dict[str, Any] = HNSW_INDEX_OPTIONS,
+        recreate_index: bool = False,
+        search_type: Optional[str] = None,
+    ):
+        """
+        Args:
+            path: Directory of the embedding matrix, the chunk table and the graph
+            vector_size: Size of the embedding stored in a collection
+            similarity:
+                Any of "cosine" / "l2_norm" / "dot_product".
+            index_options: Index options of the graph, e.g. {"m": 16, "ef_construction": 100}
+            recreate_index: Delete the documents and create an empty index
+            search_type: Any of "hybrid" / "keyword" / "semantic", defaults to SEARCH_TYPE in config.py
+        """
+        assert index_options.get("m", 16) > 0, "HNSW m must be greater than 0."
+        assert (
+            index_options.get("ef_construction", 100) > 0
+        ), "HNSW ef_construction must be greater than 0."
+        self.index_options = {
+            "m": index_options.get("m", 16),
+            "ef_construction": index_options.get("ef_construction", 100),
+        }
+        self._changes = 0
+        super().__init__(path, vector_size, similarity, recreate_index, search_type)
+
+    def _set_up_index(self, recreate_index: bool) -> None:
+        super()._set_up_index(recreate_index)
+        self._load_graph()
+
+    def _load_graph(self) -> None:
+        """
+        Loads the saved graph and brings it up to date with the chunk table, or builds it if it cannot be used.
+        """
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        graph_path = os.path.join(self.path, GRAPH_FILE)
+        if (
+            not os.path.exists(graph_path)
+            or meta.get("graph_matrix") != os.path.basename(self._matrix_path)
+            or meta.get("graph_index_options") != json.dumps(self.index_options)
+        ):
+            self._build_graph()
+            return
+
+        self._graph = hnswlib.Index(
+            space=HNSW_SPACES[self.similarity], dim=self.vector_size
+        )
+        self._graph.load_index(graph_path, max_elements=len(self._matrix))
+        # Chunks written after the graph was saved
+        graph_rows = set(self._graph.get_ids_list())
+        live_rows = set(self._row_of.values())
+        added = np.asarray(sorted(live_rows - graph_rows), dtype=np.int64)
+        deleted = np.asarray(sorted(graph_rows - live_rows), dtype=np.int64)
+        if len(added) or len(deleted):
+            logger.info(
+                f"Updating the HNSW graph with {len(added)} added and {len(deleted)} deleted chunks"
+            )
+            self._add_to_graph(added)
+            self._unindex_rows(deleted)
+            self._save_graph()
+
+    def _build_graph(self) -> None:
+        """
+        Builds the graph from the live rows of the embedding matrix.
+        """
+        rows = np.flatnonzero(self._alive[: self._num_rows])
+        logger.info(f"Building the HNSW graph of {len(rows)} chunks")
+        self._graph = hnswlib.Index(
+            space=HNSW_SPACES[self.similarity], dim=self.vector_size
+        )
+        self._graph.init_index(
+            max_elements=len(self._matrix),
+            M=self.index_options["m"],
+            ef_construction=self.index_options["ef_construction"],
+        )
+        self._add_to_graph(rows)
+        self._save_graph()
+
+    def _add_to_graph(self, rows: np.ndarray) -> None:
+        for i in range(0, len(rows), COPY_BATCH_SIZE):
+            batch = rows[i : i + COPY_BATCH_SIZE]
+            self._graph.add_items(self._matrix[batch], batch)
+
+    def _save_graph(self) -> None:
+        """
+        Saves the graph, then records the matrix file and index options it was built against.
+        """
+        graph_path = os.path.join(self.path, GRAPH_FILE)
+        self._graph.save_index(f"{graph_path}.tmp")
+        os.replace(f"{graph_path}.tmp", graph_path)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [
+                    ("graph_matrix", os.path.basename(self._matrix_path)),
+                    ("graph_index_options", json.dumps(self.index_options)),
+                ],
+            )
+        self._changes = 0
+
+    def _index_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        if self._graph.get_max_elements() < len(self._matrix):
+            self._graph.resize_index(len(self._matrix))
+        self._graph.add_items(vectors, rows)
+        self._record_changes(len(rows))
+
+    def _unindex_rows(self, rows: np.ndarray) -> None:
+        for row in rows.tolist():
+            try:
+                self._graph.mark_deleted(row)
+            except RuntimeError:
+                # The chunk was deleted from the graph already
+                pass
+        self._record_changes(len(rows))
+
+    def _record_changes(self, count: int) -> None:
+        self._changes += count
+        if self._changes >= GRAPH_SAVE_INTERVAL:
+            self._save_graph()
+
+    def _compact(self) -> None:
+        # The rows are renumbered, the graph labels have to be rebuilt
+        super()._compact()
+        self._build_graph()
+
+    def _search_vectors(
+        self, embedding: np.ndarray, k: int, mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows of the k chunks nearest to the embedding among the rows selected by mask,
+        and their scores, best first.
+        """
+        num_matches = int(np.count_nonzero(mask))
+        k = min(k, num_matches)
+        num_candidates = get_num_candidates(k)
+        if k == 0 or num_matches <= num_candidates:
+            # Few matches: an exact search over them is cheaper than the graph search, as in Elasticsearch
+            return super()._search_vectors(embedding, k, mask)
+
+        self._graph.set_ef(num_candidates)
+        try:
+            if num_matches == len(self._row_of):
+                labels, distances = self._graph.knn_query(
+                    np.asarray(embedding, dtype=np.float32), k=k
+                )
+            else:
+                labels, distances = self._graph.knn_query(
+                    np.asarray(embedding, dtype=np.float32),
+                    k=k,
+                    # The filter is called for each visited node, it is not thread-safe
+                    num_threads=1,
+                    filter=lambda label: bool(mask[label]),
+                )
+        except RuntimeError:
+            # The graph search reached fewer than k matching chunks
+            return super()._search_vectors(embedding, k, mask)
+        return labels[0].astype(np.int64), self._convert_distances(distances[0])
+
+    def _convert_distances(self, distances: np.ndarray) -> np.ndarray:
+        """
+        Converts hnswlib distances to the scores of the exact search, which are the Elasticsearch scores.
+        """
+        if self.similarity == "l2_norm":
+            # The l2 space returns squared distances
+            return 1 / (1 + distances)
+        # The cosine and ip spaces return 1 - similarity
+        return (2 - distances) / 2
+
+    async def close(self) -> None:
+        """
+        Saves the graph, flushes the embedding matrix and closes the chunk table.
+        """
+        with self._lock:
+            self._save_graph()
+        await super().close()
@@ -0,0 +1,828 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from config import LOCAL_DATASTORE_PATH, WINDOW_SIZE, K
+from datastore.datastore import VECTOR_SIZE, DataStore
+from loguru import logger
+from pydantic_schemas.document import (
+    DocumentChunk,
+    DocumentChunkWithScore,
+    DocumentMetadataFilter,
+    QueryResult,
+    QueryWithEmbedding,
+)
+from services.date import to_unix_timestamp
+
+# Metadata fields kept in memory as columns, so metadata filters are evaluated with numpy
+FILTER_FIELDS = ["document_id", "source", "source_id", "author", "bu"]
+INITIAL_CAPACITY = 1024  # number of rows of a new embedding matrix
+COMPACT_RATIO = 0.5  # share of deleted rows above which the embedding matrix is rewritten without them
+# Filters matching less than 1 / SPARSE_FILTER_RATIO of the rows only score the matching rows
+SPARSE_FILTER_RATIO = 4
+COPY_BATCH_SIZE = (
+    10000  # number of rows copied at once when the embedding matrix is rewritten
+)
+# SQLite limits the number of host parameters of a statement
+MAX_LOOKUP_SIZE = 500
+# Columns of the chunk table, in the order of the rows written by _add_chunks
+CHUNK_COLUMNS = ["id", "row", *FILTER_FIELDS, "created_at", "norm", "text", "metadata"]
+
+
+class LocalDataStore(DataStore):
+    """
+    In-process datastore, for tests, benchmarks and small deployments without an Elasticsearch cluster.
+
+    The embeddings are the rows of a float32 matrix persisted as a memory-mapped .npy file, the chunk texts and
+    metadata are kept in a SQLite side table. The filterable metadata fields are loaded into numpy columns, so a
+    search is a vectorized filter, a matrix-vector product and an argpartition top-k, with the same scores as
+    Elasticsearch. Deleted chunks leave a hole in the matrix until the holes exceed COMPACT_RATIO of the rows.
+    """
+
+    # Other search types fall back to semantic search
+    search_types = ["semantic"]
+
+    def __init__(
+        self,
+        path: str = LOCAL_DATASTORE_PATH,
+        vector_size: int = VECTOR_SIZE,
+        similarity: str = "cosine",
+        recreate_index: bool = False,
+        search_type: Optional[str] = None,
+    ):
+        """
+        Args:
+            path: Directory of the embedding matrix and the chunk table
+            vector_size: Size of the embedding stored in a collection
+            similarity:
+                Any of "cosine" / "l2_norm" / "dot_product".
+            recreate_index: Delete the documents and create an empty index
+            search_type: Any of "hybrid" / "keyword" / "semantic", defaults to SEARCH_TYPE in config.py
+        """
+        super().__init__(search_type=search_type)
+
+        assert similarity in [
+            "cosine",
+            "l2_norm",
+            "dot_product",
+        ], "Similarity must be one of 'cosine' / 'l2_norm' / 'dot_product'."
+        assert vector_size > 0, "Vector size must be greater than 0."
+        assert path != "", "Please provide a datastore path."
+
+        if self.search_type not in self.search_types:
+            logger.warning(
+                f"{type(self).__name__} does not support search type '{self.search_type}', "
+                f"queries fall back to semantic search."
+            )
+
+        self.path = path
+        self.vector_size = vector_size
+        self.similarity = similarity
+        # Searches and writes run in worker threads, the lock keeps them from seeing a half-written matrix
+        self._lock = threading.RLock()
+
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(path, "chunks.sqlite"), check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Replacing a chunk fires the delete triggers of the chunk table, e.g. of a full-text index
+        self.conn.execute("PRAGMA recursive_triggers=ON")
+
+        # Set up the collection so the documents might be inserted or queried
+        self._set_up_index(recreate_index)
+
+    async def _upsert(self, chunks: Dict[str, List[DocumentChunk]]) -> List[str]:
+        """
+        Takes in a list of document chunks and inserts them into the database.
+        Return a list of document ids.
+        """
+        await asyncio.to_thread(
+            self._add_chunks,
+            [chunk for chunk_list in chunks.values() for chunk in chunk_list],
+        )
+        return list(chunks.keys())
+
+    def _add_chunks(self, chunks: List[DocumentChunk]) -> None:
+        """
+        Appends the chunks to the embedding matrix and the chunk table.
+        Chunks that are indexed already are replaced, like an Elasticsearch index operation.
+        """
+        if not chunks:
+            return
+        vectors = np.asarray([chunk.embedding for chunk in chunks], dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.vector_size:
+            raise ValueError(
+                f"Expected embeddings of size {self.vector_size}, got {vectors.shape[1:]}."
+            )
+        norms = np.linalg.norm(vectors, axis=1)
+        # The last chunk wins when a chunk id is upserted twice in one call
+        latest = {chunk.id: i for i, chunk in enumerate(chunks)}
+
+        with self._lock:
+            self._reserve(len(chunks))
+            start = self._num_rows
+            end = start + len(chunks)
+
+            # The vectors are written first: rows that are not in the chunk table are never searched,
+            # so a crash before the commit below leaves the datastore consistent
+            self._matrix[start:end] = vectors
+            self._matrix.flush()
+            rows = []
+            for i, chunk in enumerate(chunks):
+                if latest[chunk.id] != i:
+                    continue
+                metadata = chunk.metadata
+                rows.append(
+                    (
+                        chunk.id,
+                        start + i,
+                        *[
+                            self._get_column_value(getattr(metadata, field))
+                            for field in FILTER_FIELDS
+                        ],
+                        to_unix_timestamp(metadata.created_at)
+                        if metadata.created_at is not None
+                        else None,
+                        float(norms[i]),
+                        chunk.text,
+                        metadata.json(),
+                    )
+                )
+            with self.conn:
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO chunks ({', '.join(CHUNK_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(CHUNK_COLUMNS))})",
+                    rows,
+                )
+
+            replaced = []
+            for chunk_id, row, *columns, created_at, norm, _, _ in rows:
+                old_row = self._row_of.get(chunk_id)
+                if old_row is not None:
+                    replaced.append(old_row)
+                    self._alive[old_row] = False
+                    self._ids[old_row] = None
+                self._row_of[chunk_id] = row
+                self._alive[row] = True
+                self._ids[row] = chunk_id
+                for field, value in zip(FILTER_FIELDS, columns):
+                    self._columns[field][row] = value
+                self._created_at[row] = np.nan if created_at is None else created_at
+                self._norms[row] = norm
+            self._num_rows = end
+
+            added = np.asarray([row for _, row, *_ in rows], dtype=np.int64)
+            self._unindex_rows(np.asarray(replaced, dtype=np.int64))
+            self._index_rows(added, vectors[added - start])
+
+    def _index_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        Called with the rows and vectors of new chunks, for providers that keep a search structure over the matrix.
+        The exact search reads the matrix directly, there is nothing to do.
+        """
+
+    def _unindex_rows(self, rows: np.ndarray) -> None:
+        """
+        Called with the rows of deleted or replaced chunks, see _index_rows.
+        """
+
+    async def _query(
+        self,
+        queries: List[QueryWithEmbedding],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> List[QueryResult]:
+        """
+        Takes in a list of queries with embeddings and filters and returns a list of query results with matching document chunks and scores.
+        """
+        return await asyncio.to_thread(
+            self._search_queries, queries, includes, excludes
+        )
+
+    def _search_queries(
+        self,
+        queries: List[QueryWithEmbedding],
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> List[QueryResult]:
+        searched = []
+        with self._lock:
+            for query in queries:
+                if query.unique_documents:
+                    searched.append(self._search_unique_documents(query))
+                else:
+                    searched.append((*self._search_query(query), None))
+
+            # Fetch phase: the texts and metadata of all the results are read at once
+            start = time.perf_counter()
+            sources = self._get_sources(
+                np.concatenate(
+                    [
+                        rows
+                        for result_rows, _, _, inner_hits in searched
+                        for rows in [
+                            result_rows,
+                            *(inner_rows for inner_rows, _ in (inner_hits or [])),
+                        ]
+                    ]
+                ),
+                includes,
+                excludes,
+            )
+            fetch_time = (time.perf_counter() - start) * 1000
+
+        def get_chunks(
+            rows: np.ndarray, scores: np.ndarray
+        ) -> List[DocumentChunkWithScore]:
+            return [
+                self._convert_source_to_document_chunk_with_score(sources[row], score)
+                for row, score in zip(rows.tolist(), scores.tolist())
+            ]
+
+        results = []
+        for query, (rows, scores, timings, inner_hits) in zip(queries, searched):
+            chunks = get_chunks(rows, scores)
+            if inner_hits is not None:
+                for chunk, (inner_rows, inner_scores) in zip(chunks, inner_hits):
+                    chunk.inner_hits = get_chunks(inner_rows, inner_scores)
+            results.append(
+                QueryResult(
+                    query=query.query,
+                    results=chunks,
+                    timings={**timings, "fetch": fetch_time},
+                )
+            )
+        return results
+
+    def _search_unique_documents(
+        self, query: QueryWithEmbedding
+    ) -> Tuple[
+        np.ndarray,
+        np.ndarray,
+        Dict[str, float],
+        Optional[List[Tuple[np.ndarray, np.ndarray]]],
+    ]:
+        """
+        Searches the best chunk of top_k distinct documents, like an Elasticsearch search collapsed on document_id.
+        The query is searched for WINDOW_SIZE chunks, doubled until they cover top_k documents or every match.
+        With inner_hits_size, the best chunks of each document are searched among the chunks of the document.
+        Returns the rows and scores of the best chunks, the milliseconds spent in each search stage,
+        and the rows and scores of the inner hits of each of them.
+        """
+        size = self._get_size(query)
+        window = max(WINDOW_SIZE, size)
+        while True:
+            rows, scores, timings = self._search_query(
+                query.copy(update={"top_k": window})
+            )
+            kept = []
+            document_ids = set()
+            for position, (row, document_id) in enumerate(
+                zip(rows.tolist(), self._columns["document_id"][rows].tolist())
+            ):
+                # Chunks without a document_id are documents of their own
+                key = row if document_id is None else document_id
+                if key not in document_ids:
+                    document_ids.add(key)
+                    kept.append(position)
+                    if len(kept) == size:
+                        break
+            if len(kept) == size or len(rows) < window:
+                break
+            window *= 2
+        rows, scores = rows[kept], scores[kept]
+
+        if not query.inner_hits_size:
+            return rows, scores, timings, None
+        start = time.perf_counter()
+        inner_hits = []
+        for i, document_id in enumerate(self._columns["document_id"][rows].tolist()):
+            if document_id is None:
+                # The chunk is the only chunk of its document
+                inner_hits.append((rows[i : i + 1], scores[i : i + 1]))
+                continue
+            filter = (query.filter or DocumentMetadataFilter()).copy(
+                update={"document_id": document_id}
+            )
+            inner_rows, inner_scores, _ = self._search_query(
+                query.copy(update={"filter": filter, "top_k": query.inner_hits_size})
+            )
+            inner_hits.append((inner_rows, inner_scores))
+        timings["inner_hits"] = (time.perf_counter() - start) * 1000
+        return rows, scores, timings, inner_hits
+
+    def _get_size(self, query: QueryWithEmbedding) -> int:
+        """
+        Returns the number of results of a query.
+        """
+        return query.top_k or K
+
+    def _search_query(
+        self, query: QueryWithEmbedding
+    ) -> Tuple[np.ndarray, np.ndarray, Dict[str, float]]:
+        """
+        Searches the rows of the chunks matching one query.
+        Returns their rows and scores, best first, and the milliseconds spent in each search stage.
+        """
+        start = time.perf_counter()
+        rows, scores = self._search_vectors(
+            query.embedding, self._get_size(query), self._get_filter_mask(query.filter)
+        )
+        return rows, scores, {"semantic": (time.perf_counter() - start) * 1000}
+
+    def _search_vectors(
+        self, embedding: np.ndarray, k: int, mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows of the k chunks nearest to the embedding among the rows selected by mask,
+        and their scores, best first.
+        """
+        candidates = np.flatnonzero(mask)
+        k = min(k, len(candidates))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        query = np.asarray(embedding, dtype=np.float32)
+        if len(candidates) * SPARSE_FILTER_RATIO < self._num_rows:
+            # Selective filter: gathering the matching rows is cheaper than scoring all of them
+            scores = self._score(self._matrix[candidates], candidates, query)
+        else:
+            rows = np.arange(self._num_rows)
+            scores = self._score(self._matrix[: self._num_rows], rows, query)[
+                candidates
+            ]
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+    def _score(
+        self, vectors: np.ndarray, rows: np.ndarray, query: np.ndarray
+    ) -> np.ndarray:
+        """
+        Scores vectors against the query like the Elasticsearch kNN search does, so scores are comparable.
+        """
+        dot = vectors @ query
+        if self.similarity == "cosine":
+            norms = self._norms[rows] * np.linalg.norm(query)
+            cosine = np.divide(dot, norms, out=np.zeros_like(dot), where=norms > 0)
+            return (1 + cosine) / 2
+        if self.similarity == "dot_product":
+            return (1 + dot) / 2
+        # ||v - q||^2 = ||v||^2 - 2 v.q + ||q||^2
+        squared_distance = np.square(self._norms[rows]) - 2 * dot + query @ query
+        return 1 / (1 + np.maximum(squared_distance, 0))
+
+    def _get_filter_mask(
+        self, filter: Optional[DocumentMetadataFilter] = None
+    ) -> np.ndarray:
+        """
+        Returns the mask of the rows of live chunks matching the filter, with the semantics of _get_es_filters:
+        a term query per metadata field and a range query on created_at for the start and end dates.
+        """
+        n = self._num_rows
+        mask = self._alive[:n].copy()
+        if filter is None:
+            return mask
+        for field, value in filter.dict().items():
+            if value is None:
+                continue
+            # Chunks without created_at never match a date range, NaN comparisons are False
+            if field == "start_date":
+                mask &= self._created_at[:n] >= to_unix_timestamp(value)
+            elif field == "end_date":
+                mask &= self._created_at[:n] <= to_unix_timestamp(value)
+            else:
+                mask &= self._columns[field][:n] == self._get_column_value(value)
+        return mask
+
+    @staticmethod
+    def _get_column_value(value: Any) -> Any:
+        return value.value if isinstance(value, Enum) else value
+
+    def _get_sources(
+        self,
+        rows: np.ndarray,
+        includes: Optional[List[str]] = None,
+        excludes: Optional[List[str]] = None,
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Reads the chunks at the given rows, projected on includes and excludes like an Elasticsearch _source filter.
+        Returns a dictionary from row to chunk source.
+        """
+        rows = np.unique(rows)
+        texts: Dict[int, Tuple[str, str]] = {}
+        row_list = rows.tolist()
+        for i in range(0, len(row_list), MAX_LOOKUP_SIZE):
+            batch = row_list[i : i + MAX_LOOKUP_SIZE]
+            for row, text, metadata in self.conn.execute(
+                "SELECT row, text, metadata FROM chunks "
+                f"WHERE row IN ({', '.join('?' * len(batch))})",
+                batch,
+            ):
+                texts[row] = (text, metadata)
+
+        with_embedding = is_field_selected("embedding", includes, excludes)
+        sources = {}
+        for row in row_list:
+            if row not in texts:
+                continue
+            text, metadata = texts[row]
+            # The id is always returned, like the _id of an Elasticsearch hit
+            source = {
+                "id": self._ids[row],
+                **project_source(
+                    {"text": text, "metadata": json.loads(metadata)},
+                    includes,
+                    excludes,
+                ),
+            }
+            if with_embedding:
+                # Copied out of the matrix, which is replaced when it grows or is compacted
+                source["embedding"] = np.array(self._matrix[row])
+            sources[row] = source
+        return sources
+
+    def _convert_source_to_document_chunk(
+        self, source: Dict[str, Any]
+    ) -> DocumentChunk:
+        return DocumentChunk(
+            id=source.get("id"),
+            text=source.get("text", ""),
+            metadata=source.get("metadata", {}),
+            embedding=source.get("embedding"),
+        )
+
+    def _convert_source_to_document_chunk_with_score(
+        self, source: Dict[str, Any], score: float
+    ) -> DocumentChunkWithScore:
+        # Fields left out by the projection are not set on the chunk
+        return DocumentChunkWithScore(
+            id=source.get("id"),
+            text=source.get("text", ""),
+            metadata=source.get("metadata", {}),
+            embedding=source.get("embedding"),
+            score=score,
+        )
+
+    async def _get_content_hashes(
+        self, document_ids: List[str]
+    ) -> Dict[str, Optional[str]]:
+        """
+        Returns the content hash of every chunk of the documents, by chunk id.
+        """
+
+        def get_content_hashes() -> Dict[str, Optional[str]]:
+            hashes = {}
+            with self._lock:
+                for i in range(0, len(document_ids), MAX_LOOKUP_SIZE):
+                    batch = document_ids[i : i + MAX_LOOKUP_SIZE]
+                    hashes.update(
+                        self.conn.execute(
+                            "SELECT id, json_extract(metadata, '$.content_hash') FROM chunks "
+                            f"WHERE document_id IN ({', '.join('?' * len(batch))})",
+                            batch,
+                        )
+                    )
+            return hashes
+
+        return await asyncio.to_thread(get_content_hashes)
+
+    async def get_chunks(
+        self, ids: List[str], includes: Optional[List[str]] = None
+    ) -> List[DocumentChunk]:
+        """
+        Fetches document chunks by chunk id.
+        """
+
+        def get_chunks() -> List[DocumentChunk]:
+            with self._lock:
+                rows = [self._row_of[id] for id in ids if id in self._row_of]
+                sources = self._get_sources(np.asarray(rows, dtype=np.int64), includes)
+            return [
+                self._convert_source_to_document_chunk(sources[row])
+                for row in rows
+                if row in sources
+            ]
+
+        return await asyncio.to_thread(get_chunks)
+
+    async def close(self) -> None:
+        """
+        Flushes the embedding matrix and closes the chunk table.
+        """
+        with self._lock:
+            self._matrix.flush()
+            self.conn.close()
+
+    async def _delete(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        """
+        Removes vectors by ids, filter, or everything in the datastore.
+        Returns whether the operation was successful.
+        """
+        await asyncio.to_thread(self._delete_chunks, ids, filter, delete_all)
+        return True
+
+    def _delete_chunks(
+        self,
+        ids: Optional[List[str]] = None,
+        filter: Optional[DocumentMetadataFilter] = None,
+        delete_all: Optional[bool] = None,
+    ) -> None:
+        with self._lock:
+            n = self._num_rows
+            if delete_all:
+                logger.info(f"Deleting all vectors from index")
+                mask = self._alive[:n].copy()
+            else:
+                mask = np.zeros(n, dtype=bool)
+                # An empty filter deletes nothing, as in the Elasticsearch provider
+                if filter is not None and any(
+                    value is not None for value in filter.dict().values()
+                ):
+                    mask |= self._get_filter_mask(filter)
+                if ids:
+                    for i in range(0, len(ids), MAX_LOOKUP_SIZE):
+                        batch = ids[i : i + MAX_LOOKUP_SIZE]
+                        rows = self.conn.execute(
+                            "SELECT row FROM chunks "
+                            f"WHERE document_id IN ({', '.join('?' * len(batch))})",
+                            batch,
+                        ).fetchall()
+                        mask[[row for (row,) in rows]] = True
+
+            self._remove_rows(np.flatnonzero(mask))
+
+    async def _delete_chunk_ids(self, ids: List[str]) -> None:
+        """
+        Removes the chunks with the given chunk ids.
+        """
+
+        def delete_chunk_ids() -> None:
+            with self._lock:
+                self._remove_rows(
+                    np.asarray(
+                        [self._row_of[id] for id in ids if id in self._row_of],
+                        dtype=np.int64,
+                    )
+                )
+
+        await asyncio.to_thread(delete_chunk_ids)
+
+    def _remove_rows(self, rows: np.ndarray) -> None:
+        """
+        Removes the chunks at the given rows from the chunk table and the search structures, called with the lock held.
+        """
+        n = self._num_rows
+        if len(rows) == 0:
+            return
+        logger.info(f"Deleting {len(rows)} chunks")
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM chunks WHERE row = ?",
+                [(row,) for row in rows.tolist()],
+            )
+        for chunk_id in self._ids[rows]:
+            self._row_of.pop(chunk_id, None)
+        self._alive[rows] = False
+        self._ids[rows] = None
+        self._unindex_rows(rows)
+
+        if n - len(self._row_of) > COMPACT_RATIO * n:
+            self._compact()
+
+    def _set_up_index(self, recreate_index: bool) -> None:
+        if recreate_index:
+            self._recreate_index()
+
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, row INTEGER UNIQUE, "
+            f"{', '.join(f'{field} TEXT' for field in FILTER_FIELDS)}, "
+            "created_at REAL, norm REAL, text TEXT, metadata TEXT)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (document_id)"
+        )
+        self.conn.commit()
+        self._add_filter_columns()
+
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if not meta:
+            meta = {
+                "similarity": self.similarity,
+                "vector_size": str(self.vector_size),
+                "matrix": self._create_matrix(INITIAL_CAPACITY),
+            }
+            with self.conn:
+                self.conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+
+        if meta["similarity"] != self.similarity:
+            raise ValueError(
+                f"Collection '{self.path}' already exists, "
+                f"but it is configured with a similarity '{meta['similarity']}'. "
+                f"If you want to use that collection, but with a different "
+                f"similarity, please set `recreate_index=True` argument."
+            )
+
+        if int(meta["vector_size"]) != self.vector_size:
+            raise ValueError(
+                f"Collection '{self.path}' already exists, "
+                f"but it is configured with a vector size '{meta['vector_size']}'. "
+                f"If you want to use that collection, but with a different "
+                f"vector size, please set `recreate_index=True` argument."
+            )
+
+        self._load()
+
+    def _add_filter_columns(self) -> None:
+        """
+        Adds the filter fields missing from a chunk table created by an earlier version, read from the metadata.
+        """
+        columns = {
+            name for _, name, *_ in self.conn.execute("PRAGMA table_info(chunks)")
+        }
+        with self.conn:
+            for field in FILTER_FIELDS:
+                if field not in columns:
+                    logger.info(f"Adding the filter field {field} to '{self.path}'")
+                    self.conn.execute(f"ALTER TABLE chunks ADD COLUMN {field} TEXT")
+                    self.conn.execute(
+                        f"UPDATE chunks SET {field} = json_extract(metadata, '$.{field}')"
+                    )
+
+    def _recreate_index(self) -> None:
+        """
+        Drops the chunk table and deletes the embedding matrices.
+        """
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS chunks")
+            self.conn.execute("DROP TABLE IF EXISTS meta")
+        for name in os.listdir(self.path):
+            if name.startswith("embeddings_") and name.endswith(".npy"):
+                os.remove(os.path.join(self.path, name))
+
+    def _load(self) -> None:
+        """
+        Memory-maps the embedding matrix and loads the filterable columns of the chunk table.
+        """
+        (matrix,) = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'matrix'"
+        ).fetchone()
+        self._matrix_path = os.path.join(self.path, matrix)
+        self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+
+        capacity = len(self._matrix)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._ids = np.empty(capacity, dtype=object)
+        self._columns = {
+            field: np.empty(capacity, dtype=object) for field in FILTER_FIELDS
+        }
+        self._created_at = np.full(capacity, np.nan)
+        self._norms = np.zeros(capacity, dtype=np.float32)
+
+        rows = self.conn.execute(
+            f"SELECT row, id, {', '.join(FILTER_FIELDS)}, created_at, norm FROM chunks"
+        ).fetchall()
+        self._num_rows = max(row for row, *_ in rows) + 1 if rows else 0
+        self._row_of: Dict[str, int] = {}
+        if rows:
+            row_numbers, ids, *columns, created_at, norms = zip(*rows)
+            index = np.asarray(row_numbers, dtype=np.int64)
+            self._alive[index] = True
+            self._ids[index] = np.asarray(ids, dtype=object)
+            for field, values in zip(FILTER_FIELDS, columns):
+                self._columns[field][index] = np.asarray(values, dtype=object)
+            self._created_at[index] = np.asarray(created_at, dtype=np.float64)
+            self._norms[index] = np.asarray(norms, dtype=np.float32)
+            self._row_of = dict(zip(ids, row_numbers))
+
+    def _create_matrix(self, capacity: int) -> str:
+        """
+        Creates an empty embedding matrix file, named after the creation time so it never replaces a live one.
+        Returns the file name.
+        """
+        name = f"embeddings_{time.time_ns()}.npy"
+        matrix = np.lib.format.open_memmap(
+            os.path.join(self.path, name),
+            mode="w+",
+            dtype=np.float32,
+            shape=(capacity, self.vector_size),
+        )
+        matrix.flush()
+        return name
+
+    def _reserve(self, count: int) -> None:
+        """
+        Makes room for count more rows at the end of the embedding matrix, doubling its capacity when it is full.
+        The rows keep their numbers.
+        """
+        if self._num_rows + count <= len(self._matrix):
+            return
+        capacity = max(INITIAL_CAPACITY, 2 * (self._num_rows + count))
+        self._replace_matrix(np.arange(self._num_rows), capacity, renumber=False)
+
+    def _compact(self) -> None:
+        """
+        Copies the rows of the live chunks to a new embedding matrix, leaving out the rows of deleted chunks.
+        The rows are renumbered.
+        """
+        rows = np.flatnonzero(self._alive[: self._num_rows])
+        capacity = max(INITIAL_CAPACITY, 2 * len(rows))
+        self._replace_matrix(rows, capacity, renumber=True)
+
+    def _replace_matrix(self, rows: np.ndarray, capacity: int, renumber: bool) -> None:
+        """
+        Copies the given rows to a new embedding matrix, then points the chunk table to it in one transaction.
+        With renumber, the rows are numbered by their position in the new matrix, otherwise they keep their number.
+        """
+        name = self._create_matrix(capacity)
+        matrix = np.load(os.path.join(self.path, name), mmap_mode="r+")
+        for i in range(0, len(rows), COPY_BATCH_SIZE):
+            batch = rows[i : i + COPY_BATCH_SIZE]
+            target = slice(i, i + len(batch)) if renumber else batch
+            matrix[target] = self._matrix[batch]
+        matrix.flush()
+        del matrix
+
+        with self.conn:
+            if renumber:
+                # Rows only move down and are renumbered in ascending order, so the new numbers never collide
+                self.conn.executemany(
+                    "UPDATE chunks SET row = ? WHERE row = ?",
+                    zip(range(len(rows)), rows.tolist()),
+                )
+            self.conn.execute("UPDATE meta SET value = ? WHERE key = 'matrix'", (name,))
+        logger.info(
+            f"Rewrote the embedding matrix with {len(rows)} rows and a capacity of {capacity}"
+        )
+
+        old_matrix_path = self._matrix_path
+        self._load()
+        os.remove(old_matrix_path)
+
+
+def is_field_selected(
+    path: str,
+    includes: Optional[List[str]] = None,
+    excludes: Optional[List[str]] = None,
+) -> bool:
+    """
+    Returns whether a field (e.g. "metadata.title") is returned by a projection on includes and excludes.
+    """
+    return (not includes or _matches_field(path, includes)) and not (
+        excludes and _matches_field(path, excludes)
+    )
+
+
+def project_source(
+    source: Dict[str, Any],
+    includes: Optional[List[str]] = None,
+    excludes: Optional[List[str]] = None,
+    prefix: str = "",
+) -> Dict[str, Any]:
+    """
+    Projects a chunk source on dotted field paths, like an Elasticsearch _source filter without wildcards.
+    A field is kept if it or one of its parents is in includes (or includes is empty),
+    and neither it nor one of its parents is in excludes.
+    """
+    projected = {}
+    for key, value in source.items():
+        path = f"{prefix}{key}"
+        if excludes and _matches_field(path, excludes):
+            continue
+        nested_includes = includes
+        if includes and not _matches_field(path, includes):
+            # Keep the parents of included fields, with only the included fields in them
+            if not isinstance(value, dict) or not any(
+                field.startswith(f"{path}.") for field in includes
+            ):
+                continue
+        elif includes:
+            # The whole field is included, only excludes apply below it
+            nested_includes = None
+        if isinstance(value, dict):
+            value = project_source(value, nested_includes, excludes, f"{path}.")
+        projected[key] = value
+    return projected
+
+
+def _matches_field(path: str, fields: List[str]) -> bool:
+    return any(path == field or path.startswith(f"{field}.") for field in fields)
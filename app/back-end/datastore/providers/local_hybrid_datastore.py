@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from config import (
+    FUSION_METHOD,
+    FUSION_WEIGHTS,
+    RANK_CONSTANT,
+    SIZE,
+    WINDOW_SIZE,
+)
+from datastore.fusion import fuse_rankings
+from datastore.providers.local_datastore import LocalDataStore
+from pydantic_schemas.document import (
+    DocumentMetadataFilter,
+    Fusion,
+    QueryWithEmbedding,
+)
+from services.date import to_unix_timestamp
+
+# Terms of a query, every other character is FTS5 query syntax or punctuation
+TERM_PATTERN = re.compile(r"\w+")
+
+
+class LocalHybridDataStore(LocalDataStore):
+    """
+    In-process datastore serving every search type, for laptop demos and CI without an Elasticsearch cluster.
+
+    The semantic search is the exact search of LocalDataStore. The keyword search is a BM25 search of a SQLite FTS5
+    index kept in sync with the chunk table by triggers. Hybrid search runs both and fuses them like the
+    Elasticsearch provider, with fuse_rankings over WINDOW_SIZE results of each search.
+    """
+
+    search_types = ["hybrid", "keyword", "semantic"]
+
+    def _set_up_index(self, recreate_index: bool) -> None:
+        super()._set_up_index(recreate_index)
+
+        (exists,) = self.conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'chunks_fts'"
+        ).fetchone()
+        with self.conn:
+            # External content table: the texts are only stored in the chunk table
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5"
+                "(text, content='chunks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')"
+            )
+            self.conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+                "INSERT INTO chunks_fts (rowid, text) VALUES (new.rowid, new.text); END"
+            )
+            self.conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+                "INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text); END"
+            )
+            if not exists:
+                # The chunks may have been written by LocalDataStore, index them
+                self.conn.execute(
+                    "INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')"
+                )
+
+    def _recreate_index(self) -> None:
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS chunks_fts")
+        super()._recreate_index()
+
+    def _get_size(self, query: QueryWithEmbedding) -> int:
+        if self.search_type == "semantic":
+            return super()._get_size(query)
+        return query.top_k or SIZE
+
+    def _search_query(
+        self, query: QueryWithEmbedding
+    ) -> Tuple[np.ndarray, np.ndarray, Dict[str, float]]:
+        size = self._get_size(query)
+        if self.search_type == "keyword":
+            start = time.perf_counter()
+            rows, scores = self._search_text(
+                query.query, size, query.filter, match_all_terms=True
+            )
+            return rows, scores, {"keyword": (time.perf_counter() - start) * 1000}
+        if self.search_type != "hybrid":
+            return super()._search_query(query)
+
+        # The keyword and semantic searches return WINDOW_SIZE results each, the fused top_k are returned
+        window_size = max(WINDOW_SIZE, size)
+        start = time.perf_counter()
+        keyword_rows, keyword_scores = self._search_text(
+            query.query, window_size, query.filter
+        )
+        keyword_time = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        semantic_rows, semantic_scores = self._search_vectors(
+            query.embedding, window_size, self._get_filter_mask(query.filter)
+        )
+        semantic_time = (time.perf_counter() - start) * 1000
+
+        fusion = query.fusion or Fusion()
+        start = time.perf_counter()
+        rows, scores = fuse_rankings(
+            ids=[keyword_rows.tolist(), semantic_rows.tolist()],
+            scores=[keyword_scores, semantic_scores],
+            weights=fusion.weights or FUSION_WEIGHTS,
+            method=fusion.method or FUSION_METHOD,
+            rank_constant=RANK_CONSTANT,
+            size=size,
+        )
+        timings = {
+            "keyword": keyword_time,
+            "semantic": semantic_time,
+            "fusion": (time.perf_counter() - start) * 1000,
+        }
+        return np.asarray(rows, dtype=np.int64), scores, timings
+
+    def _search_text(
+        self,
+        text: str,
+        size: int,
+        filter: Optional[DocumentMetadataFilter] = None,
+        match_all_terms: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows of the size chunks best matching the text by BM25 among the chunks matching the filter,
+        and their scores, best first.
+        Like the multi_match queries of the Elasticsearch provider, chunks match any term of the text,
+        or all of them with match_all_terms.
+        """
+        terms = TERM_PATTERN.findall(text)
+        if not terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        # Quoted terms are matched as strings, they cannot be read as FTS5 operators
+        match = f" {'AND' if match_all_terms else 'OR'} ".join(
+            f'"{term}"' for term in terms
+        )
+        clauses, params = self._get_sql_filters(filter)
+        results = self.conn.execute(
+            "SELECT chunks.row, -chunks_fts.rank FROM chunks_fts "
+            "JOIN chunks ON chunks.rowid = chunks_fts.rowid "
+            f"WHERE chunks_fts MATCH ?{clauses} ORDER BY chunks_fts.rank LIMIT ?",
+            (match, *params, size),
+        ).fetchall()
+        if not results:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        rows, scores = zip(*results)
+        return np.asarray(rows, dtype=np.int64), np.asarray(scores)
+
+    def _get_sql_filters(
+        self, filter: Optional[DocumentMetadataFilter] = None
+    ) -> Tuple[str, List[Any]]:
+        """
+        Returns the SQL conditions on the chunk table matching the filter, with the semantics of _get_filter_mask,
+        and their parameters.
+        """
+        if filter is None:
+            return "", []
+        clauses = []
+        params = []
+        for field, value in filter.dict().items():
+            if value is None:
+                continue
+            if field == "start_date":
+                clauses.append(" AND chunks.created_at >= ?")
+                params.append(to_unix_timestamp(value))
+            elif field == "end_date":
+                clauses.append(" AND chunks.created_at <= ?")
+                params.append(to_unix_timestamp(value))
+            else:
+                clauses.append(f" AND chunks.{field} = ?")
+                params.append(self._get_column_value(value))
+        return "".join(clauses), params
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+from config import (
+    EMBEDDING_PROVIDER,
+    HASHING_EMBEDDING_DIMENSION,
+    LOCAL_EMBEDDING_DIMENSION,
+)
+from embedding.provider import EmbeddingProvider
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    assert EMBEDDING_PROVIDER is not None
+
+    match EMBEDDING_PROVIDER:
+        case "openai":
+            from embedding.providers.openai_provider import OpenAIEmbeddingProvider
+
+            return OpenAIEmbeddingProvider()
+        case "local":
+            from embedding.providers.local_provider import LocalEmbeddingProvider
+
+            return LocalEmbeddingProvider()
+        case "hashing":
+            from embedding.providers.hashing_provider import HashingEmbeddingProvider
+
+            return HashingEmbeddingProvider()
+        case _:
+            raise ValueError(
+                f"Unsupported embedding provider: {EMBEDDING_PROVIDER}. "
+                f"Try one of the following: openai, local, hashing"
+            )
+
+
+def get_embedding_dimension() -> int:
+    """
+    Returns the dimension of the embeddings of the configured provider, without loading its model.
+    """
+    match EMBEDDING_PROVIDER:
+        case "openai":
+            from embedding.providers.openai_provider import OPENAI_EMBEDDING_DIMENSION
+
+            return OPENAI_EMBEDDING_DIMENSION
+        case "local":
+            return LOCAL_EMBEDDING_DIMENSION
+        case "hashing":
+            return HASHING_EMBEDDING_DIMENSION
+        case _:
+            raise ValueError(
+                f"Unsupported embedding provider: {EMBEDDING_PROVIDER}. "
+                f"Try one of the following: openai, local, hashing"
+            )
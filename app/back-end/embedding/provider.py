@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import List
+
+import numpy as np
+
+
+class EmbeddingProvider(ABC):
+    # Whether the provider is a remote API with request and token quotas, they are enforced by the EmbeddingExecutor
+    rate_limited = False
+
+    def __init__(self, model: str, dimension: int, batch_size: int):
+        """
+        Args:
+            model: Name of the model the embeddings come from, it keys the embedding store
+            dimension: Dimension of the embeddings, the vector size of the datastore
+            batch_size: Maximum number of texts embedded in one call
+        """
+        assert dimension > 0, "Dimension must be greater than 0."
+        assert batch_size > 0, "Batch size must be greater than 0."
+        self.model = model
+        self.dimension = dimension
+        self.batch_size = batch_size
+
+    @abstractmethod
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds a batch of texts.
+        Returns a float32 matrix with the embedding of each text as a row, in the order of the texts.
+        """
+        raise NotImplementedError
+
+    async def aget_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds a batch of texts without blocking the event loop, in a worker thread unless the provider is async.
+        """
+        return await asyncio.to_thread(self.get_embeddings, texts)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import re
+import zlib
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from config import HASHING_EMBEDDING_DIMENSION
+from embedding.provider import EmbeddingProvider
+
+TERM_PATTERN = re.compile(r"\w+")
+WORD_CACHE_SIZE = 100000  # number of word vectors kept in memory
+BATCH_SIZE = 1024  # the embeddings are computed in-process, batches only bound the memory of a call
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic embeddings without a model, for tests and benchmarks: the normalized sum of a pseudo-random
+    vector per word, seeded by the crc32 of the word. Texts sharing words get similar embeddings,
+    so semantic search finds the texts sharing the most words with a query.
+    """
+
+    def __init__(self, dimension: int = HASHING_EMBEDDING_DIMENSION):
+        """
+        Args:
+            dimension: Dimension of the embeddings
+        """
+        super().__init__(f"hashing-{dimension}", dimension, BATCH_SIZE)
+        self._get_word_vector = lru_cache(maxsize=WORD_CACHE_SIZE)(
+            self._get_word_vector
+        )
+
+    def _get_word_vector(self, word: str) -> np.ndarray:
+        return (
+            np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            .standard_normal(self.dimension)
+            .astype(np.float32)
+        )
+
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in TERM_PATTERN.findall(text.lower()):
+                embeddings[i] += self._get_word_vector(word)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+        return embeddings
+
+    async def aget_embeddings(self, texts: List[str]) -> np.ndarray:
+        # Cheaper than a hop to a worker thread
+        return self.get_embeddings(texts)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import threading
+from typing import List
+
+import numpy as np
+import torch
+from config import (
+    LOCAL_EMBEDDING_BATCH_SIZE,
+    LOCAL_EMBEDDING_DIMENSION,
+    LOCAL_EMBEDDING_MODEL,
+    LOCAL_EMBEDDING_THREADS,
+)
+from embedding.provider import EmbeddingProvider
+from loguru import logger
+from sentence_transformers import SentenceTransformer
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings of a sentence-transformers model run on the CPU of the API server, without any network round-trip.
+
+    The texts of a call are encoded in batches of batch_size, with the model using threads CPU threads.
+    Calls are serialized, so concurrent callers share the threads instead of oversubscribing the CPU.
+    """
+
+    def __init__(
+        self,
+        model: str = LOCAL_EMBEDDING_MODEL,
+        dimension: int = LOCAL_EMBEDDING_DIMENSION,
+        batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+        threads: int = LOCAL_EMBEDDING_THREADS,
+    ):
+        """
+        Args:
+            model: Name or path of the sentence-transformers model
+            dimension: Dimension of the embeddings of the model
+            batch_size: Number of texts encoded at once
+            threads: Number of CPU threads of the model, 0 for the torch default
+        """
+        super().__init__(model, dimension, batch_size)
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.encoder = SentenceTransformer(model, device="cpu")
+        model_dimension = self.encoder.get_sentence_embedding_dimension()
+        if model_dimension != dimension:
+            raise ValueError(
+                f"Model '{model}' embeds texts in {model_dimension} dimensions, "
+                f"but it is configured with a dimension of {dimension}. "
+                f"Please set LOCAL_EMBEDDING_DIMENSION = {model_dimension}."
+            )
+        self._lock = threading.Lock()
+        logger.info(
+            f"Loaded the embedding model '{model}' with {torch.get_num_threads()} threads"
+        )
+
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        with self._lock:
+            embeddings = self.encoder.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+        # The model outputs float32 already, this does not copy
+        return embeddings.astype(np.float32, copy=False)
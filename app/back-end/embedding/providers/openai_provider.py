@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from typing import List
+
+import numpy as np
+from config import OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME
+from const import EMBEDDINGS_BATCH_SIZE
+from embedding.provider import EmbeddingProvider
+from services.openai import aget_embeddings, get_embeddings
+
+OPENAI_EMBEDDING_DIMENSION = 1536  # dimension of the text-embedding-ada-002 embeddings
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeddings of text-embedding-ada-002, from Azure OpenAI (OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME) or OpenAI.
+    """
+
+    rate_limited = True
+
+    def __init__(self):
+        super().__init__(
+            model=OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME or "text-embedding-ada-002",
+            dimension=OPENAI_EMBEDDING_DIMENSION,
+            batch_size=EMBEDDINGS_BATCH_SIZE,
+        )
+
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        return get_embeddings(texts)
+
+    async def aget_embeddings(self, texts: List[str]) -> np.ndarray:
+        return await aget_embeddings(texts)
@@ -21,13 +21,14 @@ from config import INIT_DB
 
 # from pydantic_schemas.user import UserCreate, UserUpdate
 # from pydantic_schemas.feedback import FeedbackCreate
+from datastore.datastore import DataStore
 from datastore.factory import get_datastore
 
 # from api.feedback import create_a_feedback
 from error import ParameterException, Success
 from fastapi import Body, FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from langchain.document_loaders import WebBaseLoader
 from loguru import logger
 from pydantic_schemas.api import (
@@ -37,9 +38,12 @@ from pydantic_schemas.api import (
     UpsertResponse,
 )
 from pydantic_schemas.document import Document, DocumentMetadata, Source
+from services.chunks import asset_store, embedding_store
+from services.embeddings import embedding_executor, query_embedding_batcher
 from services.file import extract_text_from_filepath, get_document_from_file
 
 app = FastAPI()
+datastore: Optional[DataStore] = None  # Initialized on startup
 
 app.add_middleware(
     CORSMiddleware,
@@ -55,6 +59,44 @@ def index():
     return "Hello, RAG!"
 
 
+@app.get("/assets/{asset_id}")
+def get_asset(asset_id: str):
+    """
+    Serves an image or table of a chunk, chunks only hold the asset ids.
+    Assets are content addressed, so they never change and can be cached for good.
+    """
+    if asset_store is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    try:
+        path = asset_store.get_path(asset_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return FileResponse(
+        path,
+        media_type=asset_store.get_media_type(asset_id),
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+@app.get("/stats")
+def get_stats():
+    """
+    Usage counters of the caches and of the embedding requests since startup, to size the caches.
+    """
+    query_cache = datastore.query_cache if datastore is not None else None
+    return {
+        "query_cache": query_cache.stats() if query_cache is not None else None,
+        "embedding_store": (
+            embedding_store.stats() if embedding_store is not None else None
+        ),
+        "asset_store": asset_store.stats() if asset_store is not None else None,
+        "embedding_requests": embedding_executor.stats(),
+        "query_embedding_batches": query_embedding_batcher.stats(),
+    }
+
+
 # @app.post("/summary/")
 # async def get_result_summary(sp: SearchPara):
 #     if not sp.query:
@@ -305,15 +347,24 @@ def index():
 # #         raise HTTPException(status_code=400, detail=str(e))
 
 
-# @app.on_event("startup")
-# async def startup():
-#     """
-#     Initializes the global datastore variable when api startup.
-#     """
-#     global datastore
-#     datastore = await get_datastore()
-#     if INIT_DB:
-#         await init_data("../../data/")
+@app.on_event("startup")
+async def startup():
+    """
+    Initializes the global datastore variable when api startup.
+    """
+    global datastore
+    datastore = await get_datastore()
+    # if INIT_DB:
+    #     await init_data("../../data/")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Closes the connections of the global datastore when api shutdown.
+    """
+    if datastore is not None:
+        await datastore.close()
 
 
 # # only for development
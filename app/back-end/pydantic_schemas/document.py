@@ -1,8 +1,10 @@
 from enum import Enum
-from typing import List, Optional, Sequence
+from typing import Dict, List, Optional
 
 import fitz
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from .embedding import Embedding
 
 
 class Source(str, Enum):
@@ -18,24 +20,29 @@ class DocumentMetadata(BaseModel):
     author: Optional[str] = None
     summary: Optional[str] = None
     title: Optional[str] = None
+    bu: Optional[str] = None  # business unit, see ELASTICSEARCH_BU_INDICES in config.py
 
 
 class DocumentChunkMetadata(DocumentMetadata):
     document_id: Optional[str] = None
-    images: Optional[List[Sequence[bytes]]] = None
-    tables: Optional[List[str]] = None
+    images: Optional[List[str]] = None  # asset ids, see services/asset_store.py
+    tables: Optional[List[str]] = None  # asset ids of the HTML tables
     page: Optional[str] = None
+    # Hash of the text and metadata of the chunk, incremental upserts skip the chunks whose hash is unchanged
+    content_hash: Optional[str] = None
 
 
 class DocumentChunk(BaseModel):
     id: Optional[str] = None
     text: str
     metadata: DocumentChunkMetadata
-    embedding: Optional[List[float]] = None
+    embedding: Optional[Embedding] = None
 
 
 class DocumentChunkWithScore(DocumentChunk):
     score: float
+    # Best chunks of the document of the chunk, only set by unique_documents queries with inner_hits_size
+    inner_hits: Optional[List["DocumentChunkWithScore"]] = None
 
 
 class Document(BaseModel):
@@ -57,20 +64,52 @@ class DocumentMetadataFilter(BaseModel):
     source: Optional[Source] = None
     source_id: Optional[str] = None
     author: Optional[str] = None
+    bu: Optional[str] = None
     start_date: Optional[str] = None  # any date string format
     end_date: Optional[str] = None  # any date string format
 
 
+class FusionMethod(str, Enum):
+    rrf = "rrf"
+    linear = "linear"
+
+
+class Fusion(BaseModel):
+    # Defaults to FUSION_METHOD and FUSION_WEIGHTS in config.py
+    method: Optional[FusionMethod] = None
+    weights: Optional[List[float]] = None  # [keyword, semantic]
+
+    @field_validator("weights")
+    @classmethod
+    def check_weights(cls, weights: Optional[List[float]]) -> Optional[List[float]]:
+        # Weights come from the request body, a wrong count is a 422 instead of failing in the datastore
+        if weights is not None and (
+            len(weights) != 2 or any(weight < 0 for weight in weights)
+        ):
+            raise ValueError(
+                "Fusion weights must be two non-negative numbers: [keyword, semantic]."
+            )
+        return weights
+
+
 class Query(BaseModel):
     query: str
     filter: Optional[DocumentMetadataFilter] = None
-    top_k: Optional[int] = 3
+    top_k: Optional[int] = None  # defaults to SIZE (K for semantic search) in config.py
+    fusion: Optional[Fusion] = None  # only used by hybrid search
+    # Return the best chunk of top_k distinct documents instead of the top_k best chunks
+    unique_documents: bool = False
+    inner_hits_size: Optional[
+        int
+    ] = None  # number of best chunks of each document, with unique_documents
 
 
 class QueryWithEmbedding(Query):
-    embedding: List[float]
+    embedding: Embedding
 
 
 class QueryResult(BaseModel):
     query: str
     results: List[DocumentChunkWithScore]
+    # Milliseconds spent in each search stage
+    timings: Optional[Dict[str, float]] = None
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from typing import Annotated, Any, List
+
+import numpy as np
+from pydantic import PlainSerializer, PlainValidator, WithJsonSchema
+
+
+def to_embedding(value: Any) -> np.ndarray:
+    """
+    Returns the value as a float32 vector. Float32 arrays, e.g. the rows of the embedding matrices, are not copied.
+    """
+    embedding = np.asarray(value, dtype=np.float32)
+    if embedding.ndim != 1:
+        raise ValueError(f"Expected an embedding vector, got shape {embedding.shape}.")
+    return embedding
+
+
+# Embeddings are float32 arrays from the embedding provider to the datastores, 4 bytes per value instead of
+# a boxed Python float in a list. They are converted to lists of floats only in JSON, e.g. API responses.
+# This module only depends on numpy and pydantic, so the data pipelines can share it.
+Embedding = Annotated[
+    np.ndarray,
+    PlainValidator(to_embedding),
+    PlainSerializer(
+        lambda embedding: embedding.tolist(), return_type=List[float], when_used="json"
+    ),
+    WithJsonSchema({"type": "array", "items": {"type": "number"}}),
+]
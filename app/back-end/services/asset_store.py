@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+# An asset id is the sha256 of the content and an extension, anything else is rejected before touching the disk
+ASSET_ID_PATTERN = re.compile(r"^[0-9a-f]{64}\.[0-9a-z]{1,8}$")
+
+
+class AssetStore:
+    """
+    Content addressed store of the images and tables extracted from documents, as files under a directory.
+    An asset is keyed by the hash of its content, so an image repeated on several pages or in several documents
+    is stored once. Chunks only keep the asset ids, the API serves the assets when a client renders a source.
+
+    This module only depends on the standard library, so the data pipelines can share it.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Directory of the assets, created if needed
+        """
+        self.path = path
+        self.stored = 0
+        self.reused = 0
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def get_asset_id(content: bytes, extension: str) -> str:
+        return f"{hashlib.sha256(content).hexdigest()}.{extension.lower()}"
+
+    def get_path(self, asset_id: str) -> str:
+        """
+        Returns the path of an asset, in a sub-directory named after the first characters of its hash,
+        so no directory holds too many files.
+        """
+        if not ASSET_ID_PATTERN.match(asset_id):
+            raise ValueError(f"Invalid asset id: {asset_id}")
+        return os.path.join(self.path, asset_id[:2], asset_id)
+
+    def put(self, content: bytes, extension: str) -> str:
+        """
+        Stores an asset unless it is stored already, and returns its id.
+
+        Args:
+            content: The bytes of the asset.
+            extension: The file extension of the asset, e.g. "png" or "html", it gives its media type.
+
+        Returns:
+            The id of the asset.
+        """
+        asset_id = self.get_asset_id(content, extension)
+        path = self.get_path(asset_id)
+        if os.path.exists(path):
+            self.reused += 1
+            return asset_id
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file first, so a reader never sees a partial asset
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.stored += 1
+        return asset_id
+
+    def get(self, asset_id: str) -> Optional[bytes]:
+        """
+        Returns the content of an asset, or None if it is not stored.
+        """
+        try:
+            with open(self.get_path(asset_id), "rb") as f:
+                return f.read()
+        except (ValueError, FileNotFoundError):
+            return None
+
+    @staticmethod
+    def get_media_type(asset_id: str) -> str:
+        media_type, _ = mimetypes.guess_type(asset_id)
+        return media_type or "application/octet-stream"
+
+    def stats(self) -> Dict[str, int]:
+        return {"stored": self.stored, "reused": self.reused}
@@ -1,18 +1,22 @@
+import hashlib
+import json
 import uuid
 from typing import Dict, List, Optional, Tuple
 
 import fitz
 import tiktoken
+from config import ASSET_STORE_PATH, EMBEDDING_STORE_PATH
 from const import (
     CHUNK_SIZE,
-    EMBEDDINGS_BATCH_SIZE,
     MAX_NUM_CHUNKS,
     MIN_CHUNK_LENGTH_TO_EMBED,
     MIN_CHUNK_SIZE_CHARS,
     PAGE_SPLITTER,
 )
 from pydantic_schemas.document import Document, DocumentChunk, DocumentChunkMetadata
-from services.openai import get_embeddings
+from services.asset_store import AssetStore
+from services.embedding_store import EmbeddingStore
+from services.embeddings import embedding_executor, embedding_provider
 
 from .preprocess import clean_data
 
@@ -20,6 +24,17 @@ from .preprocess import clean_data
 tokenizer = tiktoken.get_encoding(
     "cl100k_base"
 )  # The encoding scheme to use for tokenization
+embedding_store = (
+    EmbeddingStore(
+        EMBEDDING_STORE_PATH,
+        embedding_provider.model,
+    )
+    if EMBEDDING_STORE_PATH
+    else None
+)  # The store of already computed embeddings, keyed by text hash and model
+asset_store = (
+    AssetStore(ASSET_STORE_PATH) if ASSET_STORE_PATH else None
+)  # The store of the images and tables of the pages, keyed by content hash
 
 
 def get_text_chunks(text: str, chunk_token_size: Optional[int]) -> List[str]:
@@ -110,6 +125,9 @@ def get_chunks(
     where each dictionary contains the text of a chunk and its associated metadata,
     such as images and tables.
 
+    The images and tables are written to the asset store, the metadata only holds their asset ids,
+    so the chunks stay small in the datastore and the assets are fetched when a source is rendered.
+
     Args:
       doc (Document): The Document to be split into chunks.
       chunk_token_size (Optional[int]): The number of tokens to include in each chunk.
@@ -119,32 +137,38 @@ def get_chunks(
 
     Returns:
       List[dict]: A list of dictionaries, where each dictionary contains the text of a chunk
-        and its associated metadata, such as images and tables.
+        and its associated metadata, such as the asset ids of its images and tables.
     """
     chunks = []
     begin_page = 1
     text = ""
     chunk_size = chunk_token_size or CHUNK_SIZE
+    # Without an asset store there is nowhere to keep the images and tables
+    return_image = return_image and asset_store is not None
+    return_table = return_table and asset_store is not None
+    # Asset ids of the images already extracted, by xref, as the same image can be shown on several pages
+    image_ids: Dict[int, str] = {}
     for index, page in enumerate(doc):
         text += page.get_text(sort=True)
         tokens = tokenizer.encode(text)
         num_tokens = len(tokens)
+        images = []
         if return_image:
-            images = [
-                doc.extract_image(img[0])["image"]
-                for img in page.get_images(full=True)
-                if img[0] is not None
-            ]
-        else:
-            images = []
-
+            for img in page.get_images(full=True):
+                xref = img[0]
+                if not xref:
+                    continue
+                if xref not in image_ids:
+                    image = doc.extract_image(xref)
+                    image_ids[xref] = asset_store.put(image["image"], image["ext"])
+                images.append(image_ids[xref])
+
+        tables = []
         if return_table:
-            tbs = page.find_tables()
-            tables = (
-                [tb.to_pandas().to_html() for tb in tbs] if len(tbs.tables) > 0 else []
-            )
-        else:
-            tables = []
+            tables = [
+                asset_store.put(tb.to_pandas().to_html().encode("utf-8"), "html")
+                for tb in page.find_tables()
+            ]
 
         while num_tokens >= chunk_size:
             chunk_text = tokenizer.decode(tokens[:chunk_size])
@@ -195,14 +219,16 @@ def create_document_chunks(
     # Generate a document id if not provided
 
     if isinstance(doc.doc, fitz.fitz.Document):
-        chunks = get_chunks(doc, chunk_token_size, True, True)
+        chunks = get_chunks(doc.doc, chunk_token_size, True, True)
     else:
         # Check if the document text is empty or whitespace
         if not doc.text or doc.text.isspace():
             return [], doc.id or str(uuid.uuid4())
 
-        # Split the document text into chunks
-        chunks = get_text_chunks(doc.text, chunk_token_size)
+        # Split the document text into chunks, shaped like the chunks of get_chunks
+        chunks = [
+            {"text": text} for text in get_text_chunks(doc.text, chunk_token_size)
+        ]
 
     doc_id = doc.id or str(uuid.uuid4())
     metadata = (
@@ -219,13 +245,19 @@ def create_document_chunks(
     # Assign each chunk a sequential number and create a DocumentChunk object
     for i, chunk in enumerate(chunks):
         chunk_id = f"{doc_id}_{i}"
-        metadata.images = chunk.get("metadata", {}).get("images", [])
-        metadata.tables = chunk.get("metadata", {}).get("tables", [])
-        metadata.page = chunk.get("metadata", {}).get("page", [])
+        # Each chunk gets its own copy of the metadata, with the images, tables and pages of the chunk
+        chunk_metadata = metadata.copy(
+            update={
+                "images": chunk.get("metadata", {}).get("images", []),
+                "tables": chunk.get("metadata", {}).get("tables", []),
+                "page": chunk.get("metadata", {}).get("page"),
+            }
+        )
+        chunk_metadata.content_hash = get_content_hash(chunk["text"], chunk_metadata)
         doc_chunk = DocumentChunk(
             id=chunk_id,
             text=chunk["text"],
-            metadata=metadata,
+            metadata=chunk_metadata,
         )
         # Append the chunk object to the list of chunks for this document
         doc_chunks.append(doc_chunk)
@@ -234,9 +266,23 @@ def create_document_chunks(
     return doc_chunks, doc_id
 
 
+def get_content_hash(text: str, metadata: DocumentChunkMetadata) -> str:
+    """
+    Returns the hash of the text and metadata of a chunk, a chunk whose hash is unchanged does not need to be written again.
+    """
+    content = {
+        "text": text,
+        "metadata": metadata.dict(exclude={"content_hash"}),
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
 def get_document_chunks(
     documents: List[Document],
     chunk_token_size: Optional[int],
+    embed: bool = True,
 ) -> Dict[str, List[DocumentChunk]]:
     """
     Convert a list of documents into a dictionary from document id to list of document chunks.
@@ -244,6 +290,7 @@ def get_document_chunks(
     Args:
         documents: The list of documents to convert.
         chunk_token_size: The target size of each chunk in tokens, or None to use the default CHUNK_SIZE.
+        embed: Whether to embed the chunks, otherwise it is left to the caller with embed_document_chunks.
 
     Returns:
         A dictionary mapping each document id to a list of document chunks, each of which is a DocumentChunk object
@@ -271,23 +318,32 @@ def get_document_chunks(
     if not all_chunks:
         return {}
 
-    # Get all the embeddings for the document chunks in batches, using get_embeddings
-    embeddings: List[List[float]] = []
-    for i in range(0, len(all_chunks), EMBEDDINGS_BATCH_SIZE):
-        # Get the text of the chunks in the current batch
-        batch_texts = [
-            chunk.text for chunk in all_chunks[i : i + EMBEDDINGS_BATCH_SIZE]
-        ]
+    if embed:
+        embed_document_chunks(all_chunks)
+
+    return chunks
+
 
-        # Get the embeddings for the batch texts
-        batch_embeddings = get_embeddings(batch_texts)
+def embed_document_chunks(all_chunks: List[DocumentChunk]) -> None:
+    """
+    Sets the embedding of each document chunk.
 
-        # Append the batch embeddings to the embeddings list
-        embeddings.extend(batch_embeddings)
+    Args:
+        all_chunks: The document chunks to embed.
+    """
+    if not all_chunks:
+        return
+
+    # Get all the embeddings for the document chunks, in concurrent batches of the embedding executor
+    # Texts that were embedded before are read from the embedding store instead
+    texts = [chunk.text for chunk in all_chunks]
+    if embedding_store is not None:
+        # The missing texts are handed to the executor at once, so its batches all run concurrently
+        embeddings = embedding_store.embed(texts, embedding_executor.embed, len(texts))
+    else:
+        embeddings = embedding_executor.embed(texts)
 
     # Update the document chunk objects with the embeddings
     for i, chunk in enumerate(all_chunks):
-        # Assign the embedding from the embeddings list to the chunk object
+        # Assign the row of the embedding matrix to the chunk object, a view sharing the memory of the matrix
         chunk.embedding = embeddings[i]
-
-    return chunks
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class EmbeddingMicroBatcher:
+    """
+    Collects the texts embedded by concurrent callers into shared embedding requests.
+
+    The first text waiting opens a batch, which is sent after max_wait_ms or as soon as it holds max_batch_size texts,
+    so a text waits at most max_wait_ms for other texts, plus the delay of a busy event loop in firing the timer.
+    The max_wait_ms of stats() shows the actual waits. Batches are sent without waiting for the
+    previous ones to complete. Identical texts in a batch are embedded once, and each caller gets the embeddings of
+    its own texts, in order, as rows of the float32 matrix of the request.
+    """
+
+    def __init__(
+        self,
+        aget_embeddings: Callable[[List[str]], Awaitable[np.ndarray]],
+        max_wait_ms: float,
+        max_batch_size: int,
+    ):
+        """
+        Args:
+            aget_embeddings: The coroutine function calling the embedding API for a batch of texts
+            max_wait_ms: The maximum number of milliseconds a text waits for other texts, 0 to send every call directly
+            max_batch_size: The maximum number of texts sent in one request
+        """
+        assert max_wait_ms >= 0, "Wait must not be negative."
+        assert max_batch_size > 0, "Batch size must be greater than 0."
+        self.aget_embeddings = aget_embeddings
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max_batch_size
+        # Texts waiting for the next request, with the time they arrived and the future of their embedding
+        self._pending: List[Tuple[str, float, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.batches = 0
+        self.texts = 0
+        self.unique_texts = 0
+        self.max_batch_seen = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_seen_ms = 0.0
+
+    async def embed(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Embeds texts along with the texts of the other callers.
+
+        Args:
+            texts: The list of texts to embed.
+
+        Returns:
+            A list of float32 embeddings, in the order of the texts.
+        """
+        if self.max_wait_ms == 0:
+            return list(await self.aget_embeddings(texts))
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._pending.append((text, time.perf_counter(), future))
+            futures.append(future)
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self) -> None:
+        """
+        Sends the pending texts in one request, in a task of its own.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+
+        now = time.perf_counter()
+        waits_ms = [(now - arrived) * 1000 for _, arrived, _ in batch]
+        unique_texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.batches += 1
+        self.texts += len(batch)
+        self.unique_texts += len(unique_texts)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        self.total_wait_ms += sum(waits_ms)
+        self.max_wait_seen_ms = max(self.max_wait_seen_ms, max(waits_ms))
+
+        # The task is referenced until it completes, so it is not garbage collected while in flight
+        task = asyncio.get_running_loop().create_task(self._send(batch, unique_texts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(
+        self, batch: List[Tuple[str, float, asyncio.Future]], unique_texts: List[str]
+    ) -> None:
+        try:
+            embeddings = await self.aget_embeddings(unique_texts)
+        except Exception as e:
+            logger.error(f"Embedding of a batch of {len(batch)} texts failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        embedding_of = dict(zip(unique_texts, embeddings))
+        for text, _, future in batch:
+            # A caller cancelled while waiting does not get a result
+            if not future.done():
+                future.set_result(embedding_of[text])
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "unique_texts": self.unique_texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "mean_wait_ms": self.total_wait_ms / self.texts if self.texts else 0.0,
+            "max_wait_ms": self.max_wait_seen_ms,
+        }
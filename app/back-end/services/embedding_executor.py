@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import email.utils
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+MAX_RETRIES = 5  # number of times a rate limited batch is sent again
+# Wait before retrying a rate limited batch when the response has no retry-after header, doubled on each retry
+DEFAULT_RETRY_AFTER = 2.0
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate_per_minute, holding at most a minute of tokens, like the Azure OpenAI quotas.
+    """
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float) -> float:
+        """
+        Blocks until amount tokens are available and takes them.
+        An amount larger than the capacity waits for a full bucket, so a single huge request is still sent.
+        Returns the number of seconds waited.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class EmbeddingExecutor:
+    """
+    Embeds texts in batches sent concurrently, within the requests per minute and tokens per minute of the deployment.
+    Consecutive texts are packed into a batch up to batch_size texts and batch_tokens tokens,
+    so many small chunks share a request and large chunks do not exceed the token limit of a request.
+    A rate limited batch (HTTP 429) pauses every request for the retry-after of the response, then is sent again.
+    The embeddings are returned as the rows of one float32 matrix, in the order of the texts,
+    whatever the order the batches complete in.
+
+    This module only depends on the standard library, numpy and loguru, so the data pipelines can share it.
+    """
+
+    def __init__(
+        self,
+        get_embeddings: Callable[[List[str]], np.ndarray],
+        batch_size: int,
+        batch_tokens: int = 0,
+        max_concurrency: int = 1,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        max_retries: int = MAX_RETRIES,
+    ):
+        """
+        Args:
+            get_embeddings: The function calling the embedding API for a batch of texts
+            batch_size: The maximum number of texts sent in one request
+            batch_tokens: The maximum number of tokens sent in one request, 0 for no limit
+            max_concurrency: The number of requests in flight at the same time
+            requests_per_minute: The requests per minute quota of the deployment, 0 for no limit
+            tokens_per_minute: The tokens per minute quota of the deployment, 0 for no limit
+            count_tokens: Returns the number of tokens of a text, defaults to an estimate of 4 characters per token
+            max_retries: The number of times a rate limited batch is sent again before giving up
+        """
+        assert batch_size > 0, "Batch size must be greater than 0."
+        assert max_concurrency > 0, "Concurrency must be greater than 0."
+        self.get_embeddings = get_embeddings
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.max_concurrency = max_concurrency
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+        self.max_retries = max_retries
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        )
+        self.requests = 0
+        self.tokens = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        # Monotonic time before which no request is sent, set by a rate limited request
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embeds texts with up to max_concurrency requests in flight.
+
+        Args:
+            texts: The list of texts to embed.
+
+        Returns:
+            A float32 matrix with the embedding of each text as a row, in the order of the texts.
+        """
+        token_counts = [self.count_tokens(text) for text in texts]
+        batches = [
+            (list(texts[start:end]), sum(token_counts[start:end]))
+            for start, end in pack_batches(
+                token_counts, self.batch_size, self.batch_tokens
+            )
+        ]
+        if len(batches) <= 1 or self.max_concurrency == 1:
+            results = [self._embed_batch(*batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(batches)),
+                thread_name_prefix="embedding",
+            ) as pool:
+                # map yields the results in the order of the batches
+                results = list(
+                    pool.map(lambda batch: self._embed_batch(*batch), batches)
+                )
+        if batches:
+            logger.info(
+                f"Embedded {len(texts)} texts in {len(batches)} requests, "
+                f"{sum(token_counts) / len(batches):.0f} tokens per request"
+            )
+        if not results:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(
+            [np.asarray(embeddings, dtype=np.float32) for embeddings in results]
+        )
+
+    def _embed_batch(self, texts: List[str], num_tokens: int) -> np.ndarray:
+        attempt = 0
+        while True:
+            self._wait_for_quota(num_tokens)
+            try:
+                embeddings = self.get_embeddings(texts)
+            except Exception as e:
+                retry_after = get_retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                attempt += 1
+                retry_after = retry_after or DEFAULT_RETRY_AFTER * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Embedding request rate limited, retrying in {retry_after:.1f}s"
+                )
+                with self._lock:
+                    self.retries += 1
+                    self._resume_at = max(
+                        self._resume_at, time.monotonic() + retry_after
+                    )
+                continue
+            if len(embeddings) != len(texts):
+                raise ValueError(
+                    f"Expected {len(texts)} embeddings, got {len(embeddings)}."
+                )
+            with self._lock:
+                self.requests += 1
+                self.tokens += num_tokens
+            return embeddings
+
+    def _wait_for_quota(self, num_tokens: int) -> None:
+        """
+        Blocks until a rate limit pause is over and the request fits in the quotas.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                pause = self._resume_at - time.monotonic()
+            if pause <= 0:
+                break
+            time.sleep(pause)
+            waited += pause
+        if self.request_bucket is not None:
+            waited += self.request_bucket.acquire(1)
+        if self.token_bucket is not None:
+            waited += self.token_bucket.acquire(num_tokens)
+        if waited:
+            with self._lock:
+                self.throttled_seconds += waited
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "tokens_per_request": self.tokens / self.requests if self.requests else 0.0,
+            "retries": self.retries,
+            "throttled_seconds": self.throttled_seconds,
+        }
+
+
+def pack_batches(
+    token_counts: Sequence[int], max_items: int, max_tokens: int = 0
+) -> List[Tuple[int, int]]:
+    """
+    Packs consecutive texts into batches of at most max_items texts and max_tokens tokens (0 for no limit).
+    A text larger than max_tokens gets a batch of its own.
+
+    Args:
+        token_counts: The number of tokens of each text.
+        max_items: The maximum number of texts of a batch.
+        max_tokens: The maximum number of tokens of a batch.
+
+    Returns:
+        The (start, end) range of the texts of each batch, in order.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (
+            i - start >= max_items or (max_tokens and tokens + count > max_tokens)
+        ):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the number of seconds to wait before retrying a rate limited request (HTTP 429),
+    0 when the response does not say, or None when the error is not a rate limit.
+    """
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if status != 429:
+        return None
+    headers = getattr(error, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                # An HTTP date
+                return max(
+                    email.utils.parsedate_to_datetime(value).timestamp() - time.time(),
+                    0.0,
+                )
+    except (TypeError, ValueError):
+        pass
+    return 0.0
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+# SQLite limits the number of host parameters of a statement
+MAX_LOOKUP_SIZE = 500
+
+
+class EmbeddingStore:
+    """
+    Content addressed store of embeddings, persisted in SQLite.
+    Vectors are stored as float32 and keyed by the hash of the text and the embedding model (or Azure deployment),
+    so a text is only sent to the embedding API once per model.
+
+    This module only depends on the standard library and numpy, so the data pipelines can share it.
+    """
+
+    def __init__(self, path: str, model: str):
+        """
+        Args:
+            path: Path of the SQLite database file, its directory is created if needed
+            model: Name of the embedding model or deployment the vectors come from
+        """
+        self.model = model
+        self.reused = 0
+        self.computed = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(model TEXT, text_hash TEXT, vector BLOB, PRIMARY KEY (model, text_hash)) "
+            "WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def get_text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Returns the stored embedding of each text, or None for the texts that were never embedded.
+        The embeddings are read-only float32 views of the stored bytes.
+        """
+        hashes = [self.get_text_hash(text) for text in texts]
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            for i in range(0, len(hashes), MAX_LOOKUP_SIZE):
+                batch = hashes[i : i + MAX_LOOKUP_SIZE]
+                rows = self.conn.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({', '.join('?' * len(batch))})",
+                    (self.model, *batch),
+                )
+                found.update(rows)
+        return [
+            np.frombuffer(found[text_hash], dtype=np.float32)
+            if text_hash in found
+            else None
+            for text_hash in hashes
+        ]
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[np.ndarray]) -> None:
+        rows = [
+            (
+                self.model,
+                self.get_text_hash(text),
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+            )
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows
+            )
+            self.conn.commit()
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        get_embeddings: Callable[[List[str]], np.ndarray],
+        batch_size: int,
+    ) -> np.ndarray:
+        """
+        Embeds texts, only calling get_embeddings for the texts that are not in the store yet.
+
+        Args:
+            texts: The list of texts to embed.
+            get_embeddings: The function calling the embedding API for a batch of texts.
+            batch_size: The number of texts to send to get_embeddings at once.
+
+        Returns:
+            A float32 matrix with the embedding of each text as a row, in the order of the texts.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        embeddings = self.get_many(texts)
+
+        # Identical texts are embedded once
+        missing: Dict[str, List[int]] = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(texts[i], []).append(i)
+        missing_texts = list(missing)
+
+        for i in range(0, len(missing_texts), batch_size):
+            batch_texts = missing_texts[i : i + batch_size]
+            batch_embeddings = get_embeddings(batch_texts)
+            self.put_many(batch_texts, batch_embeddings)
+            for text, embedding in zip(batch_texts, batch_embeddings):
+                for j in missing[text]:
+                    embeddings[j] = embedding
+
+        reused = len(texts) - sum(len(indexes) for indexes in missing.values())
+        self.reused += reused
+        self.computed += len(missing_texts)
+        logger.info(
+            f"Embeddings for {len(texts)} texts: {reused} reused, {len(missing_texts)} computed"
+        )
+        return np.stack(embeddings)
+
+    def stats(self) -> Dict[str, int]:
+        return {"reused": self.reused, "computed": self.computed}
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import tiktoken
+from config import (
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    QUERY_EMBEDDING_BATCH_SIZE,
+    QUERY_EMBEDDING_BATCH_WAIT_MS,
+)
+from const import EMBEDDINGS_BATCH_TOKENS
+from embedding.factory import get_embedding_provider
+from services.embedding_batcher import EmbeddingMicroBatcher
+from services.embedding_executor import EmbeddingExecutor
+
+# Global variables
+embedding_provider = (
+    get_embedding_provider()
+)  # The model embedding the chunks and the queries
+
+if embedding_provider.rate_limited:
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    embedding_executor = EmbeddingExecutor(
+        embedding_provider.get_embeddings,
+        batch_size=embedding_provider.batch_size,
+        batch_tokens=EMBEDDINGS_BATCH_TOKENS,
+        max_concurrency=EMBEDDING_CONCURRENCY,
+        requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+        count_tokens=lambda text: len(tokenizer.encode(text, disallowed_special=())),
+    )  # Shared by every embedding of document chunks, so the quotas hold across uploads
+else:
+    # A local provider has no quotas, and its batches already use every thread it is given
+    embedding_executor = EmbeddingExecutor(
+        embedding_provider.get_embeddings, batch_size=embedding_provider.batch_size
+    )
+
+query_embedding_batcher = EmbeddingMicroBatcher(
+    embedding_provider.aget_embeddings,
+    max_wait_ms=QUERY_EMBEDDING_BATCH_WAIT_MS,
+    max_batch_size=QUERY_EMBEDDING_BATCH_SIZE,
+)  # Shared by every query, so the queries of concurrent requests are embedded together
@@ -2,8 +2,10 @@
 # -*- encoding: utf-8 -*-
 
 
-from typing import List, Optional
+import base64
+from typing import Any, Dict, List, Optional
 
+import numpy as np
 import openai
 from config import (
     OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME,
@@ -15,7 +17,12 @@ from config import (
 from langchain.callbacks import AsyncIteratorCallbackHandler
 from langchain.chat_models import AzureChatOpenAI
 from langchain.embeddings.openai import OpenAIEmbeddings
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 openai.api_base = OPENAI_API_BASE
 openai.api_key = OPENAI_API_KEY
@@ -23,16 +30,39 @@ openai.api_version = OPENAI_API_VERSION
 openai.api_type = OPENAI_API_TYPE
 
 
-@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
-def get_embeddings(texts: List[str]) -> List[List[float]]:
+def decode_embeddings(data: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Decodes the embeddings of an embedding response into a float32 matrix, one row per input.
+
+    The embeddings are requested base64 encoded, so their values go from the response to the matrix
+    without being parsed into Python floats. Deployments ignoring the encoding format return lists of floats.
+    """
+    return np.stack(
+        [
+            np.frombuffer(base64.b64decode(result["embedding"]), dtype=np.float32)
+            if isinstance(result["embedding"], str)
+            else np.asarray(result["embedding"], dtype=np.float32)
+            for result in data
+        ]
+    )
+
+
+# Rate limit errors are retried by the embedding executor, after the retry-after of the response
+@retry(
+    wait=wait_random_exponential(min=1, max=20),
+    stop=stop_after_attempt(3),
+    retry=retry_if_not_exception_type(openai.error.RateLimitError),
+)
+def get_embeddings(texts: List[str]) -> np.ndarray:
     """
     Embed texts using OpenAI's ada model.
+    Prefer services.embeddings.embedding_executor.embed to embed more than one batch.
 
     Args:
         texts: The list of texts to embed.
 
     Returns:
-        A list of embeddings, each of which is a list of floats.
+        A float32 matrix with the embedding of each text as a row.
 
     Raises:
         Exception: If the OpenAI API call fails.
@@ -43,15 +73,53 @@ def get_embeddings(texts: List[str]) -> List[List[float]]:
 
     response = {}
     if deployment == None:
-        response = openai.Embedding.create(input=texts, model="text-embedding-ada-002")
+        response = openai.Embedding.create(
+            input=texts, model="text-embedding-ada-002", encoding_format="base64"
+        )
     else:
-        response = openai.Embedding.create(input=texts, deployment_id=deployment)
+        response = openai.Embedding.create(
+            input=texts, deployment_id=deployment, encoding_format="base64"
+        )
 
     # Extract the embedding data from the response
     data = response["data"]  # type: ignore
 
-    # Return the embeddings as a list of lists of floats
-    return [result["embedding"] for result in data]
+    # Return the embeddings as a float32 matrix
+    return decode_embeddings(data)
+
+
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+async def aget_embeddings(texts: List[str]) -> np.ndarray:
+    """
+    Embed texts using OpenAI's ada model without blocking the event loop.
+
+    The retry backoff sleeps with asyncio, so other requests keep being served while a call is retried.
+
+    Args:
+        texts: The list of texts to embed.
+
+    Returns:
+        A float32 matrix with the embedding of each text as a row.
+
+    Raises:
+        Exception: If the OpenAI API call fails.
+    """
+    # NOTE: Azure Open AI requires deployment id
+    deployment = OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME
+
+    response = {}
+    if deployment == None:
+        response = await openai.Embedding.acreate(
+            input=texts, model="text-embedding-ada-002", encoding_format="base64"
+        )
+    else:
+        response = await openai.Embedding.acreate(
+            input=texts, deployment_id=deployment, encoding_format="base64"
+        )
+
+    data = response["data"]  # type: ignore
+
+    return decode_embeddings(data)
 
 
 from typing import List
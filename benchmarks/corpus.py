@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+from pydantic_schemas.document import Document, DocumentMetadata, Source
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+AUTHORS = [f"author_{i}" for i in range(10)]
+TOPIC_WORDS = 20  # number of words each document is about
+TOPIC_PROBABILITY = 0.3  # share of the words of a document drawn from its topic words
+COMMON_WORDS = 200  # most frequent words, left out of the queries
+QUERY_WORDS = 6  # maximum number of words of a query
+
+
+@dataclass
+class SyntheticQuery:
+    text: str
+    document_id: str  # the document the query was sampled from
+
+
+def generate_corpus(
+    num_documents: int,
+    sentences_per_document: int = 40,
+    num_queries: int = 200,
+    vocabulary_size: int = 20000,
+    seed: int = 0,
+) -> Tuple[List[Document], List[SyntheticQuery]]:
+    """
+    Generates a deterministic corpus of documents made of pseudo-words, and queries sampled from them.
+
+    Words are drawn from a Zipf distribution over the vocabulary, and each document favours a few topic words,
+    so a query made of the rarer words of one of its sentences identifies the document.
+
+    Args:
+        num_documents: The number of documents to generate.
+        sentences_per_document: The number of sentences of each document, about 15 tokens each.
+        num_queries: The number of queries to sample.
+        vocabulary_size: The number of distinct words.
+        seed: The seed of the generator, the same seed generates the same corpus.
+
+    Returns:
+        A tuple of (documents, queries).
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = generate_vocabulary(vocabulary_size, rng)
+    probabilities = 1 / np.arange(1, vocabulary_size + 1) ** 1.1
+    probabilities /= probabilities.sum()
+
+    documents = []
+    sentences: List[List[List[str]]] = []
+    for i in range(num_documents):
+        topic = rng.choice(
+            np.arange(COMMON_WORDS, vocabulary_size), TOPIC_WORDS, replace=False
+        )
+        document_sentences = []
+        for _ in range(sentences_per_document):
+            length = rng.integers(8, 21)
+            words = rng.choice(vocabulary_size, length, p=probabilities)
+            from_topic = rng.random(length) < TOPIC_PROBABILITY
+            words[from_topic] = rng.choice(topic, from_topic.sum())
+            document_sentences.append([vocabulary[word] for word in words])
+        sentences.append(document_sentences)
+        documents.append(
+            Document(
+                id=f"doc-{i}",
+                text=" ".join(
+                    f"{' '.join(words).capitalize()}." for words in document_sentences
+                ),
+                metadata=DocumentMetadata(
+                    source=Source.file,
+                    source_id=f"doc-{i}.txt",
+                    author=AUTHORS[i % len(AUTHORS)],
+                    created_at=f"{2020 + i % 5}-{1 + i % 12:02d}-{1 + i % 28:02d}",
+                    title=f"Document {i}",
+                ),
+            )
+        )
+
+    common = set(vocabulary[:COMMON_WORDS])
+    queries = []
+    for _ in range(num_queries):
+        i = int(rng.integers(num_documents))
+        words = sentences[i][rng.integers(sentences_per_document)]
+        rare_words = [word for word in words if word not in common] or words
+        queries.append(
+            SyntheticQuery(
+                text=" ".join(rare_words[:QUERY_WORDS]), document_id=documents[i].id
+            )
+        )
+    return documents, queries
+
+
+def generate_vocabulary(size: int, rng: np.random.Generator) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(LETTERS, rng.integers(3, 10))))
+    # Sorted, so the rank of a word does not depend on the iteration order of the set
+    return sorted(words)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Retrieval benchmark of the datastore providers, on a synthetic corpus with stand-in embeddings.
+
+For each provider it measures the ingestion throughput of DataStore.upsert, then for each search type:
+- the p50 / p95 / p99 latency of DataStore.query, one query at a time
+- the queries per second with --concurrency queries in flight
+- hit_rate@k, the share of the queries whose source document is in the top k results
+- for semantic search, recall@k, the share of the exact top k chunks in the top k results, the exact ones
+  being those of a brute-force search over the same embeddings (LocalDataStore)
+It also reports the sizes and waits of the query embedding micro-batches over the run.
+
+The results are written as JSON, so runs can be compared over time.
+
+Example:
+    python benchmarks/run_benchmark.py --documents 2000 --providers local hnsw local_hybrid
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import numpy as np
+from loguru import logger
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app", "back-end"))
+import datastore.datastore
+import services.chunks
+from config import QUERY_EMBEDDING_BATCH_SIZE, QUERY_EMBEDDING_BATCH_WAIT_MS, SIZE
+from corpus import SyntheticQuery, generate_corpus
+from datastore.datastore import VECTOR_SIZE, DataStore
+from embedding.provider import EmbeddingProvider
+from embedding.providers.hashing_provider import HashingEmbeddingProvider
+from pydantic_schemas.document import Document, Query
+from services.chunks import get_text_chunks
+from services.embedding_batcher import EmbeddingMicroBatcher
+from services.embedding_executor import EmbeddingExecutor
+
+PROVIDERS = ["elasticsearch", "local", "hnsw", "local_hybrid"]
+SEARCH_TYPES = ["hybrid", "keyword", "semantic"]
+BENCHMARK_INDEX = (
+    "benchmark"  # Elasticsearch index of the benchmark, recreated on every run
+)
+
+
+@contextmanager
+def stand_in_embeddings(
+    provider: EmbeddingProvider, query_batch_wait_ms: float
+) -> Iterator[None]:
+    """
+    Routes the embedding calls of DataStore.upsert and DataStore.query to the stand-in provider,
+    and keeps the stand-in vectors out of the embedding store.
+    The queries are micro-batched like in the API, with batches of up to query_batch_wait_ms.
+    """
+    patched = [
+        (
+            services.chunks,
+            "embedding_executor",
+            EmbeddingExecutor(provider.get_embeddings, provider.batch_size),
+        ),
+        (services.chunks, "embedding_store", None),
+        (
+            datastore.datastore,
+            "query_embedding_batcher",
+            EmbeddingMicroBatcher(
+                provider.aget_embeddings,
+                query_batch_wait_ms,
+                QUERY_EMBEDDING_BATCH_SIZE,
+            ),
+        ),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patched]
+    for module, name, value in patched:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+
+def create_datastore(provider: str, workdir: str, dims: int) -> DataStore:
+    match provider:
+        case "elasticsearch":
+            from datastore.providers.elasticsearch_datastore import (
+                ElasticsearchDataStore,
+            )
+
+            return ElasticsearchDataStore(
+                index_name=BENCHMARK_INDEX, vector_size=dims, recreate_index=True
+            )
+        case "local":
+            from datastore.providers.local_datastore import LocalDataStore
+
+            return LocalDataStore(
+                path=os.path.join(workdir, provider),
+                vector_size=dims,
+                recreate_index=True,
+            )
+        case "hnsw":
+            from datastore.providers.hnsw_datastore import HnswDataStore
+
+            return HnswDataStore(
+                path=os.path.join(workdir, provider),
+                vector_size=dims,
+                recreate_index=True,
+            )
+        case "local_hybrid":
+            from datastore.providers.local_hybrid_datastore import (
+                LocalHybridDataStore,
+            )
+
+            return LocalHybridDataStore(
+                path=os.path.join(workdir, provider),
+                vector_size=dims,
+                recreate_index=True,
+            )
+        case _:
+            raise ValueError(
+                f"Unsupported vector database: {provider}. "
+                f"Try one of the following: {', '.join(PROVIDERS)}"
+            )
+
+
+async def benchmark_ingestion(
+    datastore: DataStore, documents: List[Document], batch_size: int, num_chunks: int
+) -> Dict[str, Any]:
+    """
+    Upserts the documents in batches of batch_size documents.
+    The time includes chunking and the stand-in embeddings, like a real upload.
+    """
+    start = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        await datastore.upsert(documents[i : i + batch_size], skip_delete=True)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "documents_per_second": len(documents) / seconds,
+        "chunks_per_second": num_chunks / seconds,
+    }
+
+
+async def get_exact_results(
+    documents: List[Document], queries: List[SyntheticQuery], args: argparse.Namespace
+) -> List[Set[str]]:
+    """
+    Returns the ids of the top k chunks of each query by exact semantic search, the reference of recall@k:
+    LocalDataStore scores every chunk, where the approximate kNN searches of the other providers may miss some.
+    """
+    from datastore.providers.local_datastore import LocalDataStore
+
+    datastore = LocalDataStore(
+        path=os.path.join(args.workdir, "exact"),
+        vector_size=args.dims,
+        recreate_index=True,
+        search_type="semantic",
+    )
+    datastore.query_cache = None
+    for i in range(0, len(documents), args.batch_size):
+        await datastore.upsert(documents[i : i + args.batch_size], skip_delete=True)
+    exact_results = []
+    for query in queries:
+        results = await datastore.query([Query(query=query.text, top_k=args.top_k)])
+        exact_results.append({chunk.id for chunk in results[0].results})
+    await datastore.close()
+    return exact_results
+
+
+async def benchmark_search(
+    datastore: DataStore,
+    queries: List[SyntheticQuery],
+    top_k: int,
+    concurrency: int,
+    warmup: int,
+    exact_results: Optional[List[Set[str]]] = None,
+) -> Dict[str, Any]:
+    """
+    Measures the latency, throughput and hit rate of the queries,
+    and their recall against exact_results when it is given.
+    """
+    for query in queries[:warmup]:
+        await datastore.query([Query(query=query.text, top_k=top_k)])
+
+    # Latency, hit rate and recall, one query at a time
+    latencies = []
+    hits = 0
+    found = 0
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        results = await datastore.query([Query(query=query.text, top_k=top_k)])
+        latencies.append((time.perf_counter() - start) * 1000)
+        document_ids = {chunk.metadata.document_id for chunk in results[0].results}
+        hits += query.document_id in document_ids
+        if exact_results is not None:
+            found += len(exact_results[i] & {chunk.id for chunk in results[0].results})
+
+    # Throughput, with up to concurrency queries in flight
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def send(query: SyntheticQuery) -> None:
+        async with in_flight:
+            await datastore.query([Query(query=query.text, top_k=top_k)])
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send(query) for query in queries])
+    seconds = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+    return {
+        "latency_ms": {
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+            "mean": float(np.mean(latencies)),
+        },
+        "qps": len(queries) / seconds,
+        "concurrency": concurrency,
+        f"hit_rate@{top_k}": hits / len(queries),
+        **(
+            {f"recall@{top_k}": found / max(sum(map(len, exact_results)), 1)}
+            if exact_results is not None
+            else {}
+        ),
+    }
+
+
+async def benchmark_provider(
+    provider: str,
+    documents: List[Document],
+    queries: List[SyntheticQuery],
+    num_chunks: int,
+    args: argparse.Namespace,
+    exact_results: Optional[List[Set[str]]],
+) -> Dict[str, Any]:
+    datastore = create_datastore(provider, args.workdir, args.dims)
+    # Every query has to reach the provider
+    datastore.query_cache = None
+
+    logger.info(f"[{provider}] Upserting {len(documents)} documents")
+    result = {
+        "ingestion": await benchmark_ingestion(
+            datastore, documents, args.batch_size, num_chunks
+        ),
+        "search": {},
+    }
+    if provider == "elasticsearch":
+        # Make the documents searchable without waiting for the refresh interval
+        await datastore.async_client.indices.refresh(index=",".join(datastore.aliases))
+
+    for search_type in args.search_types:
+        if search_type not in datastore.search_types:
+            logger.info(f"[{provider}] Skipping unsupported search type {search_type}")
+            continue
+        datastore.search_type = search_type
+        logger.info(f"[{provider}] Running {len(queries)} {search_type} queries")
+        result["search"][search_type] = await benchmark_search(
+            datastore,
+            queries,
+            args.top_k,
+            args.concurrency,
+            args.warmup,
+            exact_results if search_type == "semantic" else None,
+        )
+
+    await datastore.close()
+    return result
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    documents, queries = generate_corpus(
+        args.documents, args.sentences, args.queries, seed=args.seed
+    )
+    num_chunks = sum(
+        len(get_text_chunks(document.text, None)) for document in documents
+    )
+    logger.info(
+        f"Generated {len(documents)} documents ({num_chunks} chunks) and {len(queries)} queries"
+    )
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "parameters": {
+            name: value for name, value in vars(args).items() if name != "workdir"
+        },
+        "corpus": {
+            "documents": len(documents),
+            "chunks": num_chunks,
+            "queries": len(queries),
+        },
+        "results": {},
+    }
+    with stand_in_embeddings(
+        HashingEmbeddingProvider(args.dims), args.query_batch_wait_ms
+    ):
+        exact_results = None
+        if "semantic" in args.search_types:
+            logger.info("Searching the exact top k chunks of the queries")
+            exact_results = await get_exact_results(documents, queries, args)
+        for provider in args.providers:
+            try:
+                report["results"][provider] = await benchmark_provider(
+                    provider, documents, queries, num_chunks, args, exact_results
+                )
+            except Exception as e:
+                # e.g. no Elasticsearch cluster or hnswlib is not installed, the other providers still run
+                logger.error(f"[{provider}] Benchmark failed: {e}")
+                report["results"][provider] = {"error": str(e)}
+        report[
+            "query_embedding_batches"
+        ] = datastore.datastore.query_embedding_batcher.stats()
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--sentences", type=int, default=40, help="per document")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dims", type=int, default=VECTOR_SIZE)
+    parser.add_argument("--top-k", type=int, default=SIZE)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10, help="untimed queries")
+    parser.add_argument(
+        "--batch-size", type=int, default=100, help="documents per upsert"
+    )
+    parser.add_argument("--providers", nargs="+", choices=PROVIDERS, default=PROVIDERS)
+    parser.add_argument(
+        "--search-types", nargs="+", choices=SEARCH_TYPES, default=SEARCH_TYPES
+    )
+    parser.add_argument(
+        "--query-batch-wait-ms",
+        type=float,
+        default=QUERY_EMBEDDING_BATCH_WAIT_MS,
+        help="0 to leave the micro-batching wait out of the query latencies",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workdir", default=None, help="directory of the local datastores"
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            os.path.dirname(__file__),
+            "results",
+            f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        ),
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = args.workdir or workdir
+        report = asyncio.run(main(args))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote the results to {args.output}")
@@ -3,15 +3,24 @@
 
 
 import os
+import sys
 import tempfile
 import tiktoken
 import openai
 import uuid
 import fitz
+import numpy as np
 from azure.storage.blob import BlobServiceClient
 from typing import List, Optional, Tuple
 from elasticsearch import Elasticsearch
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from elasticsearch.serializer import OrjsonSerializer
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from loguru import logger
 from langchain.document_loaders import (
     TextLoader,
     Docx2txtLoader,
@@ -26,11 +35,17 @@ from config import (
     ELASTICSEARCH_CLOUD_ID,
     ELASTICSEARCH_API_KEY,
     ELASTICSEARCH_INDEX_NAME,
+    ELASTICSEARCH_BU_INDICES,
     DEFAULT_CHUNK_SIZE,
     MIN_CHUNK_SIZE_CHARS,
     MIN_LINE_CHARS,
     PAGE_SPLITTER,
     EMBEDDINGS_BATCH_SIZE,
+    EMBEDDINGS_BATCH_TOKENS,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    EMBEDDING_STORE_PATH,
     OPENAI_API_BASE,
     OPENAI_API_VERSION,
     OPENAI_API_KEY,
@@ -42,6 +57,17 @@ from config import (
 from prompt import SUMMARY_SYSTEM_PROMPT, SUMMARY_USER_PROMPT
 
 
+# Share the embedding store, the embedding executor, the bulk-load mode and the BU routing with the back-end,
+# see Data pipelines in the README.
+# The back-end directory comes after this one on the path: `config` and `document` are the ones of the pipelines,
+# so the shared modules must not import the back-end config.
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app", "back-end"))
+from services.embedding_executor import EmbeddingExecutor
+from services.embedding_store import EmbeddingStore
+from datastore.providers.elasticsearch_bulk_load import bulk_load_mode
+from datastore.providers.elasticsearch_routing import get_bu_alias, get_bu_aliases
+
+
 openai.api_base = OPENAI_API_BASE
 openai.api_version = OPENAI_API_VERSION
 openai.api_key = OPENAI_API_KEY
@@ -61,7 +87,28 @@ class FileBatchPipeline:
         self.es_client = self.get_es_conn(
             cloud_id=ELASTICSEARCH_CLOUD_ID, api_key=ELASTICSEARCH_API_KEY
         )
+        # The chunks of a business unit with its own index are routed to it, so its queries only search its index
+        self.index_name = get_bu_alias(
+            ELASTICSEARCH_INDEX_NAME,
+            get_bu_aliases(ELASTICSEARCH_INDEX_NAME, ELASTICSEARCH_BU_INDICES),
+            bu_name,
+        )
         self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.embedding_store = EmbeddingStore(
+            EMBEDDING_STORE_PATH,
+            OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME or "text-embedding-ada-002",
+        )
+        self.embedding_executor = EmbeddingExecutor(
+            self.get_embeddings,
+            batch_size=EMBEDDINGS_BATCH_SIZE,
+            batch_tokens=EMBEDDINGS_BATCH_TOKENS,
+            max_concurrency=EMBEDDING_CONCURRENCY,
+            requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+            tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+            count_tokens=lambda text: len(
+                self.tokenizer.encode(text, disallowed_special=())
+            ),
+        )
         self.summary_dict = self.__get_all_summary("rd_expert")
 
     def get_es_conn(
@@ -93,6 +140,8 @@ class FileBatchPipeline:
             connection_params["basic_auth"] = (username, password)
         else:
             pass
+        # orjson writes the float32 embeddings of the chunks straight from their arrays
+        connection_params["serializer"] = OrjsonSerializer()
         # Establish the Elasticsearch client connection
         es_client = Elasticsearch(**connection_params)
         try:
@@ -221,7 +270,12 @@ class FileBatchPipeline:
             print("Get summary failed.", e)
             return ""
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+    # Rate limit errors are retried by the embedding executor, after the retry-after of the response
+    @retry(
+        wait=wait_random_exponential(min=1, max=20),
+        stop=stop_after_attempt(3),
+        retry=retry_if_not_exception_type(openai.error.RateLimitError),
+    )
     def get_embeddings(self, texts):
         deployment = OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME
         response = {}
@@ -232,7 +286,8 @@ class FileBatchPipeline:
         else:
             response = openai.Embedding.create(input=texts, deployment_id=deployment)
         data = response["data"]
-        return [result["embedding"] for result in data]
+        # The chunks keep float32 embeddings, a quarter of the memory of lists of floats
+        return np.array([result["embedding"] for result in data], dtype=np.float32)
 
     def __get_text_chunks(self, text: str, chunk_token_size: int) -> List[str]:
         if not text or text.isspace():
@@ -314,15 +369,13 @@ class FileBatchPipeline:
         if not doc_chunks:
             return []
 
-        # Get all the embeddings for the document chunks in batches, using get_embeddings
-        embeddings: List[List[float]] = []
-        for i in range(0, len(doc_chunks), EMBEDDINGS_BATCH_SIZE):
-            # Get the text of the chunks in the current batch
-            batch_texts = [
-                chunk.content for chunk in doc_chunks[i : i + EMBEDDINGS_BATCH_SIZE]
-            ]
-            batch_embeddings = self.get_embeddings(batch_texts)
-            embeddings.extend(batch_embeddings)
+        # Get all the embeddings for the document chunks in concurrent batches, using the embedding executor
+        # Chunks whose text was embedded in a previous run are read from the embedding store
+        embeddings = self.embedding_store.embed(
+            [chunk.content for chunk in doc_chunks],
+            self.embedding_executor.embed,
+            len(doc_chunks),
+        )
 
         # Update the document chunk objects with the embeddings
         for i, chunk in enumerate(doc_chunks):
@@ -331,22 +384,27 @@ class FileBatchPipeline:
 
     def run_pipeline(self):
         blob_name_list = self.get_blob_name_list()
-        for blob_name in blob_name_list:
-            # Get file content from blob
-            doc_content = self.get_file_content_from_blob(blob_name)
+        # No refresh and no replicas during the load, restored (even after a crash) and merged at the end
+        with bulk_load_mode(self.es_client, self.index_name, force_merge=True):
+            for blob_name in blob_name_list:
+                # Get file content from blob
+                doc_content = self.get_file_content_from_blob(blob_name)
+
+                # Generate file summary
+                if doc_content.uuid in self.summary_dict.keys():
+                    doc_content.summary = self.summary_dict[doc_content.uuid]
+                else:
+                    doc_content.summary = self.get_file_summary(doc_content.content)
 
-            # Generate file summary
-            if doc_content.uuid in self.summary_dict.keys():
-                doc_content.summary = self.summary_dict[doc_content.uuid]
-            else:
-                doc_content.summary = self.get_file_summary(doc_content.content)
+                # Get file vector
+                doc_chunks = self.get_document_vector(doc_content, DEFAULT_CHUNK_SIZE)
 
-            # Get file vector
-            doc_chunks = self.get_document_vector(doc_content, DEFAULT_CHUNK_SIZE)
+                # Index into Elasticsearch
+                for chunk in doc_chunks:
+                    self.index_into_es(self.index_name, chunk.model_dump())
 
-            # Index into Elasticsearch
-            for chunk in doc_chunks:
-                self.index_into_es(ELASTICSEARCH_INDEX_NAME, chunk.model_dump())
+        logger.info(f"Embedding store usage: {self.embedding_store.stats()}")
+        logger.info(f"Embedding requests: {self.embedding_executor.stats()}")
 
 
 if __name__ == "__main__":
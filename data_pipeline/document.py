@@ -1,16 +1,22 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
 
+import os
+import sys
 
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Optional
+
+# Share the float32 embedding type with the back-end
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app", "back-end"))
+from pydantic_schemas.embedding import Embedding
 
 
 class Document(BaseModel):
     uuid: Optional[str] = None
     chunk_id: Optional[str] = None
     content: Optional[str] = None
-    embedding: Optional[List[float]] = None
+    embedding: Optional[Embedding] = None
     filename: Optional[str] = None
     contact_person: Optional[str] = None
     blob_url: Optional[str] = None
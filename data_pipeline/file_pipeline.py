@@ -3,6 +3,7 @@
 
 
 import os
+import sys
 import tempfile
 import psycopg2
 import urllib.parse
@@ -11,10 +12,17 @@ import json
 import uuid
 import openai
 import pypdf
+import numpy as np
 from typing import List, Optional, Tuple
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from tenacity import (
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 from azure.storage.blob import BlobServiceClient
 from elasticsearch import Elasticsearch
+from elasticsearch.serializer import OrjsonSerializer
 from kafka import KafkaConsumer
 from langchain.document_loaders import (
     TextLoader,
@@ -32,12 +40,18 @@ from config import (
     ELASTICSEARCH_CLOUD_ID,
     ELASTICSEARCH_API_KEY,
     ELASTICSEARCH_INDEX_NAME,
+    ELASTICSEARCH_BU_INDICES,
     POSTGRE_CONNECT_URL,
     DEFAULT_CHUNK_SIZE,
     MIN_CHUNK_SIZE_CHARS,
     MIN_LINE_CHARS,
     PAGE_SPLITTER,
     EMBEDDINGS_BATCH_SIZE,
+    EMBEDDINGS_BATCH_TOKENS,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    EMBEDDING_STORE_PATH,
     OPENAI_API_BASE,
     OPENAI_API_VERSION,
     OPENAI_API_KEY,
@@ -46,6 +60,15 @@ from config import (
     BU_CIPS,
 )
 
+# Share the embedding store, the embedding executor and the BU routing with the back-end, see Data pipelines in the README.
+# The back-end directory comes after this one on the path: `config` and `document` are the ones of the pipelines,
+# so the shared modules must not import the back-end config.
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "app", "back-end"))
+from services.embedding_executor import EmbeddingExecutor
+from services.embedding_store import EmbeddingStore
+from datastore.providers.elasticsearch_routing import get_bu_alias, get_bu_aliases
+
+
 openai.api_base = OPENAI_API_BASE
 openai.api_version = OPENAI_API_VERSION
 openai.api_key = OPENAI_API_KEY
@@ -65,7 +88,28 @@ class FileIngestionPipeline:
         self.es_client = self.get_es_conn(
             cloud_id=ELASTICSEARCH_CLOUD_ID, api_key=ELASTICSEARCH_API_KEY
         )
+        # The chunks of a business unit with its own index are routed to it, so its queries only search its index
+        self.index_name = get_bu_alias(
+            ELASTICSEARCH_INDEX_NAME,
+            get_bu_aliases(ELASTICSEARCH_INDEX_NAME, ELASTICSEARCH_BU_INDICES),
+            bu_name,
+        )
         self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.embedding_store = EmbeddingStore(
+            EMBEDDING_STORE_PATH,
+            OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME or "text-embedding-ada-002",
+        )
+        self.embedding_executor = EmbeddingExecutor(
+            self.get_embeddings,
+            batch_size=EMBEDDINGS_BATCH_SIZE,
+            batch_tokens=EMBEDDINGS_BATCH_TOKENS,
+            max_concurrency=EMBEDDING_CONCURRENCY,
+            requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+            tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+            count_tokens=lambda text: len(
+                self.tokenizer.encode(text, disallowed_special=())
+            ),
+        )
 
     def get_es_conn(
         self,
@@ -96,6 +140,8 @@ class FileIngestionPipeline:
             connection_params["basic_auth"] = (username, password)
         else:
             pass
+        # orjson writes the float32 embeddings of the chunks straight from their arrays
+        connection_params["serializer"] = OrjsonSerializer()
         # Establish the Elasticsearch client connection
         es_client = Elasticsearch(**connection_params)
         try:
@@ -201,7 +247,12 @@ class FileIngestionPipeline:
                 summary = file_record[3]
         return summary
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
+    # Rate limit errors are retried by the embedding executor, after the retry-after of the response
+    @retry(
+        wait=wait_random_exponential(min=1, max=20),
+        stop=stop_after_attempt(3),
+        retry=retry_if_not_exception_type(openai.error.RateLimitError),
+    )
     def get_embeddings(self, texts):
         deployment = OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME
         response = {}
@@ -212,7 +263,8 @@ class FileIngestionPipeline:
         else:
             response = openai.Embedding.create(input=texts, deployment_id=deployment)
         data = response["data"]
-        return [result["embedding"] for result in data]
+        # The chunks keep float32 embeddings, a quarter of the memory of lists of floats
+        return np.array([result["embedding"] for result in data], dtype=np.float32)
 
     def __get_text_chunks(self, text: str, chunk_token_size: int) -> List[str]:
         if not text or text.isspace():
@@ -294,15 +346,13 @@ class FileIngestionPipeline:
         if not doc_chunks:
             return []
 
-        # Get all the embeddings for the document chunks in batches, using get_embeddings
-        embeddings: List[List[float]] = []
-        for i in range(0, len(doc_chunks), EMBEDDINGS_BATCH_SIZE):
-            # Get the text of the chunks in the current batch
-            batch_texts = [
-                chunk.content for chunk in doc_chunks[i : i + EMBEDDINGS_BATCH_SIZE]
-            ]
-            batch_embeddings = self.get_embeddings(batch_texts)
-            embeddings.extend(batch_embeddings)
+        # Get all the embeddings for the document chunks in concurrent batches, using the embedding executor
+        # Chunks whose text was embedded in a previous run are read from the embedding store
+        embeddings = self.embedding_store.embed(
+            [chunk.content for chunk in doc_chunks],
+            self.embedding_executor.embed,
+            len(doc_chunks),
+        )
 
         # Update the document chunk objects with the embeddings
         for i, chunk in enumerate(doc_chunks):
@@ -321,7 +371,7 @@ class FileIngestionPipeline:
         doc_chunks = self.get_document_vector(doc_content, DEFAULT_CHUNK_SIZE)
         # Index into Elasticsearch
         for chunk in doc_chunks:
-            self.index_into_es(ELASTICSEARCH_INDEX_NAME, chunk.model_dump())
+            self.index_into_es(self.index_name, chunk.model_dump())
 
 
 def consumer_from_kafka():
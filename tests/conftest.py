@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Unit tests of the back-end, without network access: embeddings come from the hashing provider,
+token counts from a byte-level tokenizer, and the embedding and asset stores are disabled.
+"""
+
+import asyncio
+import os
+import sys
+from unittest import mock
+
+import pytest
+import tiktoken
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app", "back-end"))
+
+
+class ByteTokenizer:
+    """
+    Stand-in for the tiktoken encodings, whose files are downloaded on first use.
+    """
+
+    def encode(self, text, **kwargs):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", errors="ignore")
+
+
+tiktoken.get_encoding = lambda name: ByteTokenizer()
+
+# The modules of the back-end read config.py when they are imported, so it is set up before any of them
+import config  # noqa: E402
+
+config.EMBEDDING_PROVIDER = "hashing"
+config.EMBEDDING_STORE_PATH = ""
+config.ASSET_STORE_PATH = ""
+config.QUERY_CACHE = "none"
+config.QUERY_EMBEDDING_BATCH_WAIT_MS = 0
+
+
+@pytest.fixture
+def embeddings():
+    from embedding.providers.hashing_provider import HashingEmbeddingProvider
+
+    return HashingEmbeddingProvider(config.HASHING_EMBEDDING_DIMENSION)
+
+
+@pytest.fixture
+def make_elasticsearch_datastore():
+    """
+    Returns a factory of ElasticsearchDataStore built by its __init__ without a cluster:
+    the clients are mocks, the async one with the JSON serializer of a real client, and the indices are not set up.
+    """
+    from datastore.providers import elasticsearch_datastore
+    from datastore.providers.elasticsearch_datastore import ElasticsearchDataStore
+    from elastic_transport import SerializerCollection
+    from elasticsearch.serializer import OrjsonSerializer
+
+    def make_datastore(**kwargs):
+        async_client = mock.AsyncMock()
+        async_client.transport = mock.Mock(
+            serializers=SerializerCollection({"application/json": OrjsonSerializer()})
+        )
+        with mock.patch.object(
+            elasticsearch_datastore, "connect_to_elasticsearch"
+        ), mock.patch.object(
+            elasticsearch_datastore,
+            "connect_to_async_elasticsearch",
+            return_value=async_client,
+        ), mock.patch.object(
+            ElasticsearchDataStore, "_set_up_index"
+        ):
+            return ElasticsearchDataStore(**{"index_name": "rag", **kwargs})
+
+    return make_datastore
+
+
+# Vector size of the in-process datastores of the tests, the tests choose the vectors of the chunks
+LOCAL_VECTOR_SIZE = 8
+
+
+@pytest.fixture(params=["local", "hnsw", "local_hybrid"])
+def local_datastore_class(request):
+    """
+    The in-process datastore providers, a test using this fixture runs against each of them.
+    """
+    if request.param == "hnsw":
+        pytest.importorskip("hnswlib")
+        from datastore.providers.hnsw_datastore import HnswDataStore
+
+        return HnswDataStore
+    if request.param == "local_hybrid":
+        from datastore.providers.local_hybrid_datastore import LocalHybridDataStore
+
+        return LocalHybridDataStore
+    from datastore.providers.local_datastore import LocalDataStore
+
+    return LocalDataStore
+
+
+@pytest.fixture
+def make_local_datastore(tmp_path):
+    """
+    Returns a factory of in-process datastores of LOCAL_VECTOR_SIZE vectors, under tmp_path by default.
+    """
+
+    def make_datastore(
+        datastore_class,
+        path=None,
+        vector_size=LOCAL_VECTOR_SIZE,
+        search_type="semantic",
+        **kwargs,
+    ):
+        return datastore_class(
+            path=str(path or tmp_path / "datastore"),
+            vector_size=vector_size,
+            search_type=search_type,
+            **kwargs,
+        )
+
+    return make_datastore
+
+
+@pytest.fixture
+def make_chunks():
+    """
+    Returns a factory of the chunks of a document, f"{document_id}_{i}" with the i-th vector and text.
+    """
+    from pydantic_schemas.document import DocumentChunk, DocumentChunkMetadata
+
+    def make_chunks(document_id, vectors, texts=None, **metadata):
+        return [
+            DocumentChunk(
+                id=f"{document_id}_{i}",
+                text=texts[i] if texts else f"chunk {i} of {document_id}",
+                metadata=DocumentChunkMetadata(document_id=document_id, **metadata),
+                embedding=vector,
+            )
+            for i, vector in enumerate(vectors)
+        ]
+
+    return make_chunks
+
+
+@pytest.fixture
+def upsert_chunks():
+    """
+    Returns a function writing lists of chunks to a datastore, without embedding them.
+    """
+
+    def upsert_chunks(datastore, *chunk_lists):
+        chunks = {}
+        for chunk_list in chunk_lists:
+            for chunk in chunk_list:
+                chunks.setdefault(chunk.metadata.document_id, []).append(chunk)
+        asyncio.run(datastore._upsert(chunks))
+
+    return upsert_chunks
+
+
+@pytest.fixture
+def search_chunks():
+    """
+    Returns a function searching a datastore for the chunks of one query with its embedding, best first.
+    """
+    from pydantic_schemas.document import DocumentMetadataFilter, QueryWithEmbedding
+
+    def search_chunks(datastore, embedding, top_k=5, text="query", **filter):
+        query = QueryWithEmbedding(
+            query=text,
+            embedding=embedding,
+            top_k=top_k,
+            filter=DocumentMetadataFilter(**filter) if filter else None,
+        )
+        (result,) = asyncio.run(datastore._query([query]))
+        return result.results
+
+    return search_chunks
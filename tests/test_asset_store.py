@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import pytest
+from services.asset_store import AssetStore
+
+
+def test_identical_assets_are_stored_once(tmp_path):
+    store = AssetStore(str(tmp_path / "assets"))
+
+    first = store.put(b"image", "PNG")
+    again = store.put(b"image", "png")
+    other = store.put(b"<table></table>", "html")
+
+    assert first == again != other
+    assert first.endswith(".png")
+    assert store.get(first) == b"image"
+    assert store.get(other) == b"<table></table>"
+    assert store.stats() == {"stored": 2, "reused": 1}
+    assert len(list((tmp_path / "assets").rglob("*.png"))) == 1
+    assert list((tmp_path / "assets").rglob("*.tmp")) == []
+
+
+def test_assets_are_read_by_other_instances(tmp_path):
+    asset_id = AssetStore(str(tmp_path)).put(b"image", "png")
+
+    store = AssetStore(str(tmp_path))
+
+    assert store.get(asset_id) == b"image"
+    assert store.put(b"image", "png") == asset_id
+    assert store.stats() == {"stored": 0, "reused": 1}
+
+
+@pytest.mark.parametrize(
+    "asset_id",
+    [
+        "../../etc/passwd",
+        f"{'0' * 64}.png/../../secret",
+        f"{'0' * 63}.png",
+        f"{'A' * 64}.png",
+        f"{'0' * 64}",
+        f"{'0' * 64}.verylongext",
+    ],
+)
+def test_invalid_asset_ids_are_rejected(tmp_path, asset_id):
+    store = AssetStore(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        store.get_path(asset_id)
+    assert store.get(asset_id) is None
+
+
+def test_missing_assets(tmp_path):
+    assert AssetStore(str(tmp_path)).get(f"{'0' * 64}.png") is None
+
+
+def test_media_types():
+    assert AssetStore.get_media_type(f"{'0' * 64}.png") == "image/png"
+    assert AssetStore.get_media_type(f"{'0' * 64}.html") == "text/html"
+    assert AssetStore.get_media_type(f"{'0' * 64}.qqq") == "application/octet-stream"
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+
+import pytest
+from datastore.providers.elasticsearch_bulk_load import (
+    BULK_LOAD_META_KEY,
+    bulk_load_mode,
+    exit_bulk_load_mode,
+    is_in_bulk_load_mode,
+)
+
+
+class FakeIndices:
+    """
+    The index settings and mapping _meta of a cluster, with the requests made to them.
+    """
+
+    def __init__(self, settings, force_merge_seconds=0.0):
+        self.settings = settings
+        self.meta = {name: {"owner": "rag"} for name in settings}
+        self.force_merge_seconds = force_merge_seconds
+        self.requests = []
+
+    def get_settings(self, index, flat_settings=False):
+        return {index: {"settings": dict(self.settings[index])}}
+
+    def get_mapping(self, index):
+        return {index: {"mappings": {"_meta": dict(self.meta[index])}}}
+
+    def put_mapping(self, index, meta):
+        self.meta[index] = meta
+
+    def put_settings(self, index, settings):
+        self.requests.append(("put_settings", threading.get_ident()))
+        for key, value in settings["index"].items():
+            if value is None:
+                self.settings[index].pop(f"index.{key}", None)
+            else:
+                self.settings[index][f"index.{key}"] = str(value)
+
+    def refresh(self, index):
+        self.requests.append(("refresh", threading.get_ident()))
+
+    def forcemerge(self, index, max_num_segments):
+        self.requests.append(("forcemerge", threading.get_ident()))
+        time.sleep(self.force_merge_seconds)
+
+
+class FakeClient:
+    def __init__(self, settings, force_merge_seconds=0.0):
+        self.indices = FakeIndices(settings, force_merge_seconds)
+
+    def options(self, request_timeout):
+        return self
+
+
+ORIGINAL_SETTINGS = {"index.number_of_replicas": "1", "index.refresh_interval": "1s"}
+
+
+def test_the_original_settings_are_restored_on_exit():
+    client = FakeClient({"rag": dict(ORIGINAL_SETTINGS)})
+
+    with bulk_load_mode(client, "rag", force_merge=True):
+        assert client.indices.settings["rag"] == {
+            "index.number_of_replicas": "0",
+            "index.refresh_interval": "-1",
+        }
+        assert client.indices.meta["rag"][BULK_LOAD_META_KEY] == {
+            "number_of_replicas": "1",
+            "refresh_interval": "1s",
+        }
+        assert is_in_bulk_load_mode(client, "rag")
+
+    assert client.indices.settings["rag"] == ORIGINAL_SETTINGS
+    # The other keys of the _meta are kept
+    assert client.indices.meta["rag"] == {"owner": "rag"}
+    assert not is_in_bulk_load_mode(client, "rag")
+    # Merged before the replicas are added back
+    assert [request for request, _ in client.indices.requests][-3:] == [
+        "refresh",
+        "forcemerge",
+        "put_settings",
+    ]
+
+
+def test_settings_that_were_never_set_are_reset_to_the_defaults():
+    client = FakeClient({"rag": {}})
+
+    with bulk_load_mode(client, "rag"):
+        pass
+
+    assert client.indices.settings["rag"] == {}
+
+
+def crash_in_bulk_load_mode(client):
+    # A process killed during a load never restores the settings set on entry
+    client.indices.settings["rag"] = {
+        "index.number_of_replicas": "0",
+        "index.refresh_interval": "-1",
+    }
+    client.indices.meta["rag"][BULK_LOAD_META_KEY] = {
+        "number_of_replicas": "1",
+        "refresh_interval": "1s",
+    }
+
+
+def test_a_crashed_load_keeps_its_original_settings_for_the_next_load():
+    client = FakeClient({"rag": dict(ORIGINAL_SETTINGS)})
+    crash_in_bulk_load_mode(client)
+
+    with bulk_load_mode(client, "rag"):
+        # The bulk-load settings in effect are not taken for the original ones
+        assert client.indices.meta["rag"][BULK_LOAD_META_KEY] == {
+            "number_of_replicas": "1",
+            "refresh_interval": "1s",
+        }
+
+    assert client.indices.settings["rag"] == ORIGINAL_SETTINGS
+    assert not is_in_bulk_load_mode(client, "rag")
+
+
+def test_exit_recovers_an_index_left_in_bulk_load_mode():
+    client = FakeClient({"rag": dict(ORIGINAL_SETTINGS)})
+    crash_in_bulk_load_mode(client)
+    assert is_in_bulk_load_mode(client, "rag")
+
+    exit_bulk_load_mode(client, "rag")
+
+    assert client.indices.settings["rag"] == ORIGINAL_SETTINGS
+    assert client.indices.meta["rag"] == {"owner": "rag"}
+
+
+def test_exit_leaves_an_index_not_in_bulk_load_mode_alone():
+    client = FakeClient({"rag": dict(ORIGINAL_SETTINGS)})
+
+    exit_bulk_load_mode(client, "rag", force_merge=True)
+
+    assert client.indices.requests == []
+
+
+def test_the_datastore_bulk_load_does_not_block_the_event_loop(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore(bu_indices={"CIPS": {}})
+    datastore.client = FakeClient(
+        {"rag": dict(ORIGINAL_SETTINGS), "rag-cips": dict(ORIGINAL_SETTINGS)},
+        force_merge_seconds=0.2,
+    )
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ticker = asyncio.create_task(tick())
+        async with datastore.bulk_load(force_merge=True):
+            assert is_in_bulk_load_mode(datastore.client, "rag")
+            assert is_in_bulk_load_mode(datastore.client, "rag-cips")
+        ticker.cancel()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+
+    for alias in ["rag", "rag-cips"]:
+        assert datastore.client.indices.settings[alias] == ORIGINAL_SETTINGS
+    # Other coroutines kept running during the force merges
+    assert len(ticks) > 10
+    assert all(thread != loop_thread for _, thread in datastore.client.indices.requests)
+
+
+def test_the_datastore_bulk_load_restores_the_settings_when_the_load_fails(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore(bu_indices={"CIPS": {}})
+    datastore.client = FakeClient({"rag": dict(ORIGINAL_SETTINGS)})
+
+    async def run():
+        async with datastore.bulk_load(bu="other"):
+            raise RuntimeError("Upsert failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+    assert datastore.client.indices.settings["rag"] == ORIGINAL_SETTINGS
+    assert not is_in_bulk_load_mode(datastore.client, "rag")
@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import copy
+import json
+from unittest import mock
+
+import numpy as np
+import pytest
+from datastore.providers import elasticsearch_datastore
+from datastore.providers.elasticsearch_datastore import (
+    CHUNK_PROPERTIES,
+    INNER_HITS_NAME,
+    get_mapping_drift,
+)
+from datastore.providers.elasticsearch_routing import get_bu_alias, get_bu_aliases
+from elasticsearch.helpers import BulkIndexError
+from pydantic_schemas.document import (
+    DocumentChunk,
+    DocumentChunkMetadata,
+    DocumentMetadataFilter,
+    QueryWithEmbedding,
+)
+
+
+def test_business_units_are_routed_whatever_their_case(make_elasticsearch_datastore):
+    datastore = make_elasticsearch_datastore(bu_indices={"CIPS": {"shards": 3}})
+
+    assert datastore.aliases == ["rag", "rag-cips"]
+    assert datastore.index_settings["rag-cips"]["shards"] == 3
+    for bu in ["CIPS", "cips", "Cips"]:
+        assert datastore.get_alias(bu) == "rag-cips"
+    assert datastore.get_alias("other") == "rag"
+    assert datastore.get_alias(None) == "rag"
+
+
+def test_chunks_are_written_to_the_index_of_their_business_unit(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore(bu_indices={"CIPS": {}})
+    datastore.write_indices["rag-cips"] = "rag-cips_v2"
+
+    def get_index(bu):
+        chunk = DocumentChunk(
+            id="d_0", text="text", metadata=DocumentChunkMetadata(bu=bu)
+        )
+        action, _ = datastore._convert_document_chunk_to_es_document_operation(chunk)
+        return action["index"]["_index"]
+
+    assert get_index("cips") == "rag-cips_v2"
+    assert get_index("CIPS") == "rag-cips_v2"
+    assert get_index("other") == "rag"
+
+
+def make_client(index_options, default_index_options):
+    embedding = {"type": "dense_vector", "dims": 256, "similarity": "cosine"}
+    if index_options is not None:
+        embedding["index_options"] = index_options
+    client = mock.Mock()
+    client.indices.get_mapping.return_value = {
+        "rag_v1": {"mappings": {"properties": {"embedding": embedding}}}
+    }
+    client.indices.get_field_mapping.return_value = {
+        "rag_v1": {
+            "mappings": {
+                "embedding": {
+                    "full_name": "embedding",
+                    "mapping": {
+                        "embedding": {
+                            **embedding,
+                            "index_options": index_options or default_index_options,
+                        }
+                    },
+                }
+            }
+        }
+    }
+    return client
+
+
+def set_up_alias(make_datastore, client, index_options):
+    datastore = make_datastore(vector_size=256, index_options=index_options)
+    datastore.client = client
+    with mock.patch.object(elasticsearch_datastore, "is_in_bulk_load_mode"):
+        datastore._set_up_alias("rag", recreate_index=False)
+
+
+def test_index_options_are_checked_against_the_cluster_defaults(
+    make_elasticsearch_datastore,
+):
+    # Since Elasticsearch 8.14, a dense_vector field without index_options is an int8_hnsw field
+    int8_hnsw = {"type": "int8_hnsw", "m": 16, "ef_construction": 100}
+    client = make_client(None, int8_hnsw)
+
+    set_up_alias(make_elasticsearch_datastore, client, int8_hnsw)
+    client.indices.get_field_mapping.assert_called_with(
+        index="rag", fields="embedding", include_defaults=True
+    )
+    with pytest.raises(ValueError, match="index options"):
+        set_up_alias(
+            make_elasticsearch_datastore,
+            client,
+            {"type": "hnsw", "m": 16, "ef_construction": 100},
+        )
+
+
+def test_explicit_index_options_are_checked(make_elasticsearch_datastore):
+    hnsw = {"type": "hnsw", "m": 32, "ef_construction": 100}
+    client = make_client(hnsw, None)
+
+    set_up_alias(make_elasticsearch_datastore, client, hnsw)
+    with pytest.raises(ValueError, match="index options"):
+        set_up_alias(
+            make_elasticsearch_datastore,
+            client,
+            {"type": "hnsw", "m": 16, "ef_construction": 100},
+        )
+
+
+def test_business_units_are_filtered_whatever_their_case(make_elasticsearch_datastore):
+    datastore = make_elasticsearch_datastore(
+        bu_indices={"CIPS": {}}, search_type="keyword"
+    )
+    query = QueryWithEmbedding(
+        query="emi", embedding=[0.0], filter=DocumentMetadataFilter(bu="hr")
+    )
+
+    header, body = datastore._convert_queries_to_msearch_query([query])
+
+    # The BU has no index of its own: the filter is sent to the shared index, the normalizer lowercases both sides
+    assert header == {"index": "rag"}
+    assert {"term": {"metadata.bu": "hr"}} in body["query"]["bool"]["filter"]
+    assert CHUNK_PROPERTIES["metadata"]["properties"]["bu"]["normalizer"] == "lowercase"
+
+
+def test_the_pipelines_route_business_units_like_the_datastore(
+    make_elasticsearch_datastore,
+):
+    bu_indices = {"CIPS": {}, "Gbs": {}}
+    datastore = make_elasticsearch_datastore(bu_indices=bu_indices)
+    bu_aliases = get_bu_aliases("rag", bu_indices)
+
+    for bu in ["CIPS", "cips", "gbs", "GBS", "hr", None]:
+        assert get_bu_alias("rag", bu_aliases, bu) == datastore.get_alias(bu)
+    assert datastore.aliases == ["rag", "rag-cips", "rag-gbs"]
+
+
+def make_chunks(document_id, num_chunks, text="text"):
+    return [
+        DocumentChunk(
+            id=f"{document_id}_{i}",
+            text=text,
+            metadata=DocumentChunkMetadata(document_id=document_id),
+        )
+        for i in range(num_chunks)
+    ]
+
+
+def get_chunk_ids(body):
+    """
+    Returns the ids of the chunks of an NDJSON bulk body, one action and one source line per chunk.
+    """
+    lines = body.decode().splitlines()
+    assert body.endswith(b"\n") and len(lines) % 2 == 0
+    actions = [json.loads(line) for line in lines[::2]]
+    return [action["index"]["_id"] for action in actions]
+
+
+def test_bulk_bodies_hold_at_most_upsert_batch_size_chunks(
+    make_elasticsearch_datastore, monkeypatch
+):
+    monkeypatch.setattr(elasticsearch_datastore, "UPSERT_BATCH_SIZE", 3)
+    datastore = make_elasticsearch_datastore()
+    chunks = {"a": make_chunks("a", 4), "b": make_chunks("b", 3)}
+
+    bodies = list(datastore._iter_bulk_bodies(chunks))
+
+    # Batches span documents
+    assert [get_chunk_ids(body) for body in bodies] == [
+        ["a_0", "a_1", "a_2"],
+        ["a_3", "b_0", "b_1"],
+        ["b_2"],
+    ]
+
+
+def test_bulk_bodies_hold_at_most_upsert_batch_bytes(
+    make_elasticsearch_datastore, monkeypatch
+):
+    datastore = make_elasticsearch_datastore()
+    chunks = {"a": make_chunks("a", 5)}
+    (body,) = datastore._iter_bulk_bodies({"a": chunks["a"][:1]})
+    # Room for two chunks and a half
+    max_bytes = len(body) * 5 // 2
+    monkeypatch.setattr(elasticsearch_datastore, "UPSERT_BATCH_BYTES", max_bytes)
+
+    bodies = list(datastore._iter_bulk_bodies(chunks))
+
+    assert [len(get_chunk_ids(body)) for body in bodies] == [2, 2, 1]
+    assert all(len(body) <= max_bytes for body in bodies)
+
+
+def test_a_chunk_larger_than_upsert_batch_bytes_is_sent_alone(
+    make_elasticsearch_datastore, monkeypatch
+):
+    monkeypatch.setattr(elasticsearch_datastore, "UPSERT_BATCH_BYTES", 1000)
+    datastore = make_elasticsearch_datastore()
+    chunks = {
+        "a": make_chunks("a", 1),
+        "b": make_chunks("b", 1, text="x" * 2000),
+        "c": make_chunks("c", 1),
+    }
+
+    bodies = list(datastore._iter_bulk_bodies(chunks))
+
+    assert [get_chunk_ids(body) for body in bodies] == [["a_0"], ["b_0"], ["c_0"]]
+    assert len(bodies[1]) > 2000
+
+
+def test_upsert_sends_every_bulk_body(make_elasticsearch_datastore, monkeypatch):
+    monkeypatch.setattr(elasticsearch_datastore, "UPSERT_BATCH_SIZE", 2)
+    datastore = make_elasticsearch_datastore()
+    datastore.async_client.bulk.return_value = {"errors": False, "items": []}
+
+    document_ids = asyncio.run(
+        datastore._upsert({"a": make_chunks("a", 3), "b": make_chunks("b", 2)})
+    )
+
+    assert document_ids == ["a", "b"]
+    sent = [
+        chunk_id
+        for call in datastore.async_client.bulk.await_args_list
+        for chunk_id in get_chunk_ids(call.kwargs["operations"])
+    ]
+    assert sorted(sent) == ["a_0", "a_1", "a_2", "b_0", "b_1"]
+    assert datastore.async_client.bulk.await_count == 3
+
+
+def test_upsert_raises_the_partial_bulk_errors(
+    make_elasticsearch_datastore, monkeypatch
+):
+    monkeypatch.setattr(elasticsearch_datastore, "UPSERT_BATCH_SIZE", 2)
+    datastore = make_elasticsearch_datastore()
+    error = {"type": "mapper_parsing_exception", "reason": "failed to parse"}
+
+    async def bulk(operations):
+        # Only a_1 fails, the other chunks of its request and of the other requests are indexed
+        items = [
+            {"index": {"_id": chunk_id, "status": 400, "error": error}}
+            if chunk_id == "a_1"
+            else {"index": {"_id": chunk_id, "status": 201}}
+            for chunk_id in get_chunk_ids(operations)
+        ]
+        return {
+            "errors": any("error" in item["index"] for item in items),
+            "items": items,
+        }
+
+    datastore.async_client.bulk.side_effect = bulk
+
+    with pytest.raises(BulkIndexError) as exc_info:
+        asyncio.run(datastore._upsert({"a": make_chunks("a", 4)}))
+
+    assert exc_info.value.errors == [{"id": "a_1", "status": 400, "error": error}]
+    assert datastore.async_client.bulk.await_count == 2
+
+
+def make_hit(chunk_id, score=1.0, inner_hits=None):
+    """
+    Returns a hit of a search collapsed on the document_id, the document of chunk d_0 is d.
+    """
+    hit = {
+        "_id": chunk_id,
+        "_index": "rag",
+        "_score": score,
+        "fields": {"metadata.document_id": [chunk_id.split("_")[0]]},
+    }
+    if inner_hits is not None:
+        hit["inner_hits"] = {
+            INNER_HITS_NAME: {
+                "hits": {"hits": [make_hit(inner_id) for inner_id in inner_hits]}
+            }
+        }
+    return hit
+
+
+def make_response(*hits):
+    return {"took": 1, "hits": {"hits": list(hits)}}
+
+
+async def mget(docs, **kwargs):
+    return {
+        "docs": [
+            {
+                **doc,
+                "found": True,
+                "_source": {
+                    "text": doc["_id"],
+                    "metadata": {"document_id": doc["_id"].split("_")[0]},
+                },
+            }
+            for doc in docs
+        ]
+    }
+
+
+def test_fused_hits_are_collapsed_to_the_best_chunk_of_each_document(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore()
+    # a has a different best chunk in each leg
+    legs = [
+        [make_hit("a_0", inner_hits=["a_0", "a_2"]), make_hit("b_0")],
+        [make_hit("a_1", inner_hits=["a_1"]), make_hit("c_0"), {"_id": "e"}],
+    ]
+    ids = ["a_1", "b_0", "a_0", "e", "c_0"]
+
+    kept, scores, inner_hits = datastore._collapse_fused_hits(
+        legs, ids, np.array([5.0, 4.0, 3.0, 2.0, 1.0]), size=3
+    )
+
+    # Chunks without a document_id are documents of their own, size counts documents
+    assert kept == ["a_1", "b_0", "e"]
+    assert scores.tolist() == [5.0, 4.0, 2.0]
+    assert {
+        chunk_id: [hit["_id"] for hit in hits] for chunk_id, hits in inner_hits.items()
+    } == {"a_1": ["a_1"]}
+
+
+def test_hybrid_unique_documents_queries_return_top_k_documents(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore(search_type="hybrid")
+    # Fused by rrf: b_0, d_0, a_0, a_1, c_0
+    datastore.async_client.msearch.return_value = {
+        "responses": [
+            make_response(
+                make_hit("a_0", inner_hits=["a_0", "a_2"]),
+                make_hit("b_0", inner_hits=["b_0"]),
+                make_hit("d_0", inner_hits=["d_0"]),
+                make_hit("c_0", inner_hits=["c_0"]),
+            ),
+            make_response(
+                make_hit("b_0", inner_hits=["b_0"]),
+                make_hit("a_1", inner_hits=["a_1", "a_0"]),
+                make_hit("d_0", inner_hits=["d_0"]),
+            ),
+        ]
+    }
+    datastore.async_client.mget.side_effect = mget
+    query = QueryWithEmbedding(
+        query="emi",
+        embedding=[0.0],
+        top_k=4,
+        unique_documents=True,
+        inner_hits_size=2,
+    )
+
+    (result,) = asyncio.run(datastore._query([query]))
+
+    assert [chunk.id for chunk in result.results] == ["b_0", "d_0", "a_0", "c_0"]
+    # The inner hits are the ones of the hit of the first leg returning the chunk
+    a_0 = result.results[2]
+    assert [chunk.id for chunk in a_0.inner_hits] == ["a_0", "a_2"]
+    assert a_0.inner_hits[1].text == "a_2"
+    fetched = [
+        doc["_id"] for doc in datastore.async_client.mget.await_args.kwargs["docs"]
+    ]
+    assert sorted(fetched) == ["a_0", "a_2", "b_0", "c_0", "d_0"]
+    searches = datastore.async_client.msearch.await_args.kwargs["searches"]
+    for body in searches[1::2]:
+        assert body["collapse"] == {
+            "field": "metadata.document_id",
+            "inner_hits": {"name": INNER_HITS_NAME, "size": 2, "_source": False},
+        }
+
+
+@pytest.mark.parametrize("search_type", ["keyword", "semantic"])
+def test_unique_documents_queries_return_the_inner_hits(
+    make_elasticsearch_datastore, search_type
+):
+    datastore = make_elasticsearch_datastore(search_type=search_type)
+    hit = make_hit("a_0", inner_hits=["a_0", "a_1", "a_2"])
+    for inner_hit in [hit, *hit["inner_hits"][INNER_HITS_NAME]["hits"]["hits"]]:
+        inner_hit["_source"] = {"text": inner_hit["_id"]}
+    datastore.async_client.msearch.return_value = {"responses": [make_response(hit)]}
+    query = QueryWithEmbedding(
+        query="emi", embedding=[0.0], unique_documents=True, inner_hits_size=3
+    )
+
+    (result,) = asyncio.run(datastore._query([query], includes=["text"]))
+
+    assert [chunk.text for chunk in result.results[0].inner_hits] == [
+        "a_0",
+        "a_1",
+        "a_2",
+    ]
+    _, body = datastore.async_client.msearch.await_args.kwargs["searches"]
+    assert body["collapse"]["inner_hits"] == {
+        "name": INNER_HITS_NAME,
+        "size": 3,
+        "_source": {"includes": ["text"]},
+    }
+
+
+@pytest.fixture
+def properties():
+    """
+    Returns the properties of an index created with the chunk mapping.
+    """
+    properties = copy.deepcopy(CHUNK_PROPERTIES)
+    properties["embedding"] = {"type": "dense_vector", "dims": 256}
+    return properties
+
+
+def test_a_mapping_matching_the_chunk_mapping_has_no_drift(properties):
+    # Elasticsearch reports the parameters set to their default, e.g. the index of the keyword fields
+    properties["metadata"]["properties"]["source"]["index"] = True
+
+    assert get_mapping_drift(CHUNK_PROPERTIES, properties) == []
+
+
+def test_a_missing_field_is_a_drift(properties):
+    del properties["created_at"]
+    del properties["metadata"]["properties"]["bu"]
+
+    assert get_mapping_drift(CHUNK_PROPERTIES, properties) == [
+        "created_at is not mapped",
+        "metadata.bu is not mapped",
+    ]
+
+
+def test_a_field_mapped_with_another_type_is_a_drift(properties):
+    # Mapped dynamically before the field was in the chunk mapping
+    properties["metadata"]["properties"]["bu"] = {
+        "type": "text",
+        "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+    }
+
+    assert get_mapping_drift(CHUNK_PROPERTIES, properties) == [
+        "metadata.bu is mapped with {'type': 'text', 'normalizer': None} "
+        "instead of {'type': 'keyword', 'normalizer': 'lowercase'}"
+    ]
+
+
+def test_a_dynamic_field_is_a_drift(properties):
+    properties["metadata"]["properties"]["language"] = {"type": "keyword"}
+    properties["category"] = {"type": "text"}
+
+    assert get_mapping_drift(CHUNK_PROPERTIES, properties) == [
+        "metadata.language is not in the chunk mapping",
+        "category is not in the chunk mapping",
+    ]
+
+
+AUTHOR_FILTER = {"bool": {"filter": [{"term": {"metadata.author": "alice"}}]}}
+# Searches without and with a metadata filter, and the filter clause expected in them
+FILTERS = [(None, None), (DocumentMetadataFilter(author="alice"), AUTHOR_FILTER)]
+
+
+def get_searches(datastore, **kwargs):
+    """
+    Returns the msearch searches of a query, with the query vectors of the kNN searches as lists.
+    """
+    query = QueryWithEmbedding(query="emi", embedding=[0.5, 0.25], **kwargs)
+    searches = datastore._convert_queries_to_msearch_query([query])
+    for search in searches:
+        if "knn" in search:
+            search["knn"]["query_vector"] = search["knn"]["query_vector"].tolist()
+    return searches
+
+
+def make_knn(k, num_candidates, es_filter=None):
+    knn = {
+        "field": "embedding",
+        "query_vector": [0.5, 0.25],
+        "k": k,
+        "num_candidates": num_candidates,
+    }
+    if es_filter:
+        knn["filter"] = es_filter
+    return knn
+
+
+@pytest.mark.parametrize("filter,es_filter", FILTERS)
+def test_semantic_searches_push_the_filter_down_to_the_knn_search(
+    make_elasticsearch_datastore, filter, es_filter
+):
+    datastore = make_elasticsearch_datastore(search_type="semantic")
+
+    # Without top_k, K chunks out of NUM_CANDIDATES candidates
+    assert get_searches(datastore, filter=filter) == [
+        {"index": "rag"},
+        {"size": 5, "_source": True, "knn": make_knn(5, 50, es_filter)},
+    ]
+    # num_candidates scales with top_k
+    assert get_searches(datastore, filter=filter, top_k=20) == [
+        {"index": "rag"},
+        {"size": 20, "_source": True, "knn": make_knn(20, 200, es_filter)},
+    ]
+
+
+@pytest.mark.parametrize("filter,es_filter", FILTERS)
+def test_keyword_searches_filter_the_matching_chunks(
+    make_elasticsearch_datastore, filter, es_filter
+):
+    datastore = make_elasticsearch_datastore(search_type="keyword")
+    multi_match = {
+        "multi_match": {
+            "query": "emi",
+            "fields": ["text"],
+            "type": "best_fields",
+            "tie_breaker": 0.3,
+            "operator": "and",
+        }
+    }
+    query = (
+        {"bool": {"must": [multi_match], **es_filter["bool"]}}
+        if es_filter
+        else multi_match
+    )
+
+    assert get_searches(datastore, filter=filter) == [
+        {"index": "rag"},
+        {"size": 5, "_source": True, "query": query},
+    ]
+    assert get_searches(datastore, filter=filter, top_k=20)[1]["size"] == 20
+
+
+@pytest.mark.parametrize("filter,es_filter", FILTERS)
+def test_hybrid_searches_filter_both_legs(
+    make_elasticsearch_datastore, filter, es_filter
+):
+    datastore = make_elasticsearch_datastore(search_type="hybrid")
+    multi_match = {
+        "multi_match": {"query": "emi", "fields": ["text"], "type": "best_fields"}
+    }
+    query = (
+        {"bool": {"must": [multi_match], **es_filter["bool"]}}
+        if es_filter
+        else multi_match
+    )
+
+    # Both legs return WINDOW_SIZE hits to fuse, without their _source
+    assert get_searches(datastore, filter=filter) == [
+        {"index": "rag"},
+        {"size": 100, "_source": False, "query": query},
+        {"index": "rag"},
+        {"size": 100, "_source": False, "knn": make_knn(100, 1000, es_filter)},
+    ]
+
+
+def test_searches_of_a_business_unit_index_drop_the_business_unit_filter(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore(
+        bu_indices={"CIPS": {}}, search_type="semantic"
+    )
+
+    # Every chunk of the index belongs to the business unit
+    assert get_searches(
+        datastore, filter=DocumentMetadataFilter(bu="cips", author="alice")
+    ) == [
+        {"index": "rag-cips"},
+        {"size": 5, "_source": True, "knn": make_knn(5, 50, AUTHOR_FILTER)},
+    ]
+    assert get_searches(datastore, filter=DocumentMetadataFilter(bu="CIPS")) == [
+        {"index": "rag-cips"},
+        {"size": 5, "_source": True, "knn": make_knn(5, 50)},
+    ]
+    # Without a business unit, every index is searched
+    assert get_searches(datastore)[0] == {"index": "rag,rag-cips"}
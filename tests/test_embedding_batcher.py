@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+
+import numpy as np
+import pytest
+from services.embedding_batcher import EmbeddingMicroBatcher
+
+
+class RecordingEmbeddings:
+    def __init__(self, provider, error=None):
+        self.provider = provider
+        self.error = error
+        self.calls = []
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return self.provider.get_embeddings(texts)
+
+
+def test_concurrent_callers_share_a_request_and_get_their_own_embeddings(
+    embeddings,
+):
+    aget_embeddings = RecordingEmbeddings(embeddings)
+    batcher = EmbeddingMicroBatcher(aget_embeddings, max_wait_ms=20, max_batch_size=16)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.embed(["a b", "c d"]),
+            batcher.embed(["e f"]),
+            batcher.embed(["c d", "a b"]),
+        )
+
+    first, second, third = asyncio.run(run())
+
+    assert aget_embeddings.calls == [["a b", "c d", "e f"]]
+    expected = embeddings.get_embeddings(["a b", "c d", "e f"])
+    np.testing.assert_array_equal(first, expected[[0, 1]])
+    np.testing.assert_array_equal(second, expected[[2]])
+    np.testing.assert_array_equal(third, expected[[1, 0]])
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["texts"] == 5
+    assert stats["unique_texts"] == 3
+
+
+def test_a_full_batch_is_sent_without_waiting(embeddings):
+    aget_embeddings = RecordingEmbeddings(embeddings)
+    batcher = EmbeddingMicroBatcher(
+        aget_embeddings, max_wait_ms=10000, max_batch_size=2
+    )
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.embed(["a"]), batcher.embed(["b"])), timeout=1
+        )
+
+    asyncio.run(run())
+
+    assert aget_embeddings.calls == [["a", "b"]]
+
+
+def test_errors_are_raised_to_every_caller_of_the_batch(embeddings):
+    aget_embeddings = RecordingEmbeddings(embeddings, error=RuntimeError("Timeout"))
+    batcher = EmbeddingMicroBatcher(aget_embeddings, max_wait_ms=20, max_batch_size=16)
+
+    async def run():
+        return await asyncio.gather(
+            batcher.embed(["a"]), batcher.embed(["b"]), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+
+    assert len(aget_embeddings.calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_no_wait_embeds_each_call_directly(embeddings):
+    aget_embeddings = RecordingEmbeddings(embeddings)
+    batcher = EmbeddingMicroBatcher(aget_embeddings, max_wait_ms=0, max_batch_size=16)
+
+    async def run():
+        return await asyncio.gather(batcher.embed(["a"]), batcher.embed(["b"]))
+
+    asyncio.run(run())
+
+    assert aget_embeddings.calls == [["a"], ["b"]]
+
+
+def test_invalid_arguments(embeddings):
+    with pytest.raises(AssertionError):
+        EmbeddingMicroBatcher(RecordingEmbeddings(embeddings), -1, 16)
+    with pytest.raises(AssertionError):
+        EmbeddingMicroBatcher(RecordingEmbeddings(embeddings), 5, 0)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import threading
+import time
+
+import numpy as np
+import pytest
+from services.embedding_executor import (
+    EmbeddingExecutor,
+    get_retry_after,
+    pack_batches,
+)
+
+
+class RateLimitError(Exception):
+    def __init__(self, headers=None, http_status=429):
+        super().__init__("Rate limit exceeded")
+        self.http_status = http_status
+        self.headers = headers or {}
+
+
+def test_retry_after_is_read_from_the_headers():
+    assert get_retry_after(RateLimitError({"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(RateLimitError({"retry-after": "3"})) == 3.0
+    http_date = time.strftime(
+        "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30)
+    )
+    assert 25 <= get_retry_after(RateLimitError({"retry-after": http_date})) <= 31
+
+
+def test_retry_after_without_a_header_or_a_rate_limit():
+    assert get_retry_after(RateLimitError()) == 0.0
+    assert get_retry_after(RateLimitError({"retry-after": "soon"})) == 0.0
+    assert get_retry_after(RateLimitError(http_status=500)) is None
+    assert get_retry_after(ValueError()) is None
+
+
+def test_embeddings_are_returned_in_the_order_of_the_texts(embeddings):
+    texts = [f"text {i}" for i in range(10)]
+
+    def get_embeddings(batch):
+        # The first batches complete last
+        time.sleep(0.01 * (10 - int(batch[0].split()[1])))
+        return embeddings.get_embeddings(batch)
+
+    executor = EmbeddingExecutor(get_embeddings, batch_size=2, max_concurrency=4)
+    result = executor.embed(texts)
+
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, embeddings.get_embeddings(texts))
+    assert executor.stats()["requests"] == 5
+
+
+def test_concurrency_is_limited(embeddings):
+    in_flight = []
+    lock = threading.Lock()
+    peak = [0]
+
+    def get_embeddings(batch):
+        with lock:
+            in_flight.append(batch)
+            peak[0] = max(peak[0], len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(batch)
+        return embeddings.get_embeddings(batch)
+
+    executor = EmbeddingExecutor(get_embeddings, batch_size=1, max_concurrency=3)
+    executor.embed([f"text {i}" for i in range(9)])
+
+    assert peak[0] == 3
+
+
+def test_rate_limited_batches_are_retried(embeddings):
+    calls = []
+
+    def get_embeddings(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise RateLimitError({"retry-after-ms": "50"})
+        return embeddings.get_embeddings(batch)
+
+    executor = EmbeddingExecutor(get_embeddings, batch_size=8)
+    start = time.monotonic()
+    result = executor.embed(["a", "b"])
+
+    assert time.monotonic() - start >= 0.05
+    assert calls == [["a", "b"], ["a", "b"]]
+    assert len(result) == 2
+    assert executor.stats()["retries"] == 1
+
+
+def test_other_errors_and_exhausted_retries_are_raised(embeddings):
+    def fail(batch):
+        raise RuntimeError("Bad request")
+
+    with pytest.raises(RuntimeError):
+        EmbeddingExecutor(fail, batch_size=8).embed(["a"])
+
+    def rate_limited(batch):
+        raise RateLimitError({"retry-after-ms": "1"})
+
+    executor = EmbeddingExecutor(rate_limited, batch_size=8, max_retries=2)
+    with pytest.raises(RateLimitError):
+        executor.embed(["a"])
+    assert executor.stats()["retries"] == 2
+
+
+def test_batches_are_packed_up_to_the_item_and_token_limits():
+    assert pack_batches([1] * 5, max_items=2) == [(0, 2), (2, 4), (4, 5)]
+    assert pack_batches([3, 3, 3, 1, 1], max_items=10, max_tokens=6) == [
+        (0, 2),
+        (2, 5),
+    ]
+    assert pack_batches([], max_items=2) == []
+
+
+def test_a_text_larger_than_the_token_limit_gets_its_own_batch():
+    assert pack_batches([1, 10, 1], max_items=10, max_tokens=4) == [
+        (0, 1),
+        (1, 2),
+        (2, 3),
+    ]
+
+
+def test_requests_are_packed_by_tokens(embeddings):
+    calls = []
+
+    def get_embeddings(batch):
+        calls.append(batch)
+        return embeddings.get_embeddings(batch)
+
+    executor = EmbeddingExecutor(
+        get_embeddings, batch_size=10, batch_tokens=5, count_tokens=len
+    )
+    result = executor.embed(["aaa", "bb", "c", "dddd"])
+
+    assert calls == [["aaa", "bb"], ["c", "dddd"]]
+    assert len(result) == 4
+    assert executor.stats()["tokens"] == 10
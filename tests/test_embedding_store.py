@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import numpy as np
+from services.embedding_store import EmbeddingStore
+
+
+class CountingEmbeddings:
+    def __init__(self, provider):
+        self.provider = provider
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return self.provider.get_embeddings(texts)
+
+
+def test_identical_texts_are_embedded_once(tmp_path, embeddings):
+    store = EmbeddingStore(str(tmp_path / "store.sqlite"), embeddings.model)
+    get_embeddings = CountingEmbeddings(embeddings)
+
+    result = store.embed(["a b", "c d", "a b", "e f", "c d"], get_embeddings, 2)
+
+    assert get_embeddings.calls == [["a b", "c d"], ["e f"]]
+    assert result.shape == (5, embeddings.dimension)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result[0], result[2])
+    np.testing.assert_array_equal(result[1], result[4])
+    np.testing.assert_array_equal(
+        result, embeddings.get_embeddings(["a b", "c d", "a b", "e f", "c d"])
+    )
+    assert store.stats() == {"reused": 0, "computed": 3}
+
+
+def test_stored_texts_are_not_embedded_again(tmp_path, embeddings):
+    path = str(tmp_path / "store.sqlite")
+    EmbeddingStore(path, embeddings.model).embed(["a b"], embeddings.get_embeddings, 8)
+    # A new process reads the embeddings of the previous ones
+    store = EmbeddingStore(path, embeddings.model)
+    get_embeddings = CountingEmbeddings(embeddings)
+
+    result = store.embed(["a b", "g h"], get_embeddings, 8)
+
+    assert get_embeddings.calls == [["g h"]]
+    np.testing.assert_array_equal(result, embeddings.get_embeddings(["a b", "g h"]))
+    assert store.stats() == {"reused": 1, "computed": 1}
+
+
+def test_embeddings_are_stored_per_model(tmp_path, embeddings):
+    path = str(tmp_path / "store.sqlite")
+    EmbeddingStore(path, embeddings.model).embed(["a b"], embeddings.get_embeddings, 8)
+    store = EmbeddingStore(path, "other-model")
+    get_embeddings = CountingEmbeddings(embeddings)
+
+    store.embed(["a b"], get_embeddings, 8)
+
+    assert get_embeddings.calls == [["a b"]]
+
+
+def test_the_directory_of_the_store_is_created(tmp_path, embeddings):
+    path = tmp_path / "data" / "store.sqlite"
+
+    EmbeddingStore(str(path), embeddings.model)
+
+    assert path.exists()
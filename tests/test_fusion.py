@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import numpy as np
+import pytest
+from datastore.fusion import fuse_rankings
+from pydantic import ValidationError
+from pydantic_schemas.document import Fusion, Query
+
+
+def test_rrf_rewards_results_found_by_both_legs():
+    ids, scores = fuse_rankings(
+        [["a", "b", "c"], ["c", "d"]],
+        [[9.0, 5.0, 1.0], [0.9, 0.8]],
+        [1.0, 1.0],
+        method="rrf",
+        rank_constant=60,
+    )
+
+    assert ids == ["c", "a", "b", "d"]
+    np.testing.assert_allclose(scores, [1 / 63 + 1 / 61, 1 / 61, 1 / 62, 1 / 62])
+
+
+def test_rrf_ignores_the_scores_and_uses_the_weights():
+    ids, _ = fuse_rankings(
+        [["a", "b"], ["b", "a"]],
+        [[100.0, 0.0], [0.5, 0.4]],
+        [1.0, 2.0],
+        method="rrf",
+    )
+
+    assert ids == ["b", "a"]
+
+
+def test_linear_normalizes_the_scores_of_each_leg():
+    ids, scores = fuse_rankings(
+        [["a", "b", "c"], ["b", "c"]],
+        [[20.0, 15.0, 10.0], [0.9, 0.7]],
+        [1.0, 0.5],
+        method="linear",
+    )
+
+    assert ids == ["a", "b", "c"]
+    np.testing.assert_allclose(scores, [1.0, 1.0, 0.0])
+
+
+def test_linear_gives_equal_scores_the_full_weight():
+    ids, scores = fuse_rankings([["a", "b"]], [[3.0, 3.0]], [2.0], method="linear")
+
+    assert ids == ["a", "b"]
+    np.testing.assert_allclose(scores, [2.0, 2.0])
+
+
+def test_size_limits_the_fused_results():
+    ids, scores = fuse_rankings(
+        [["a", "b", "c"], ["d"]], [[3.0, 2.0, 1.0], [1.0]], [1.0, 1.0], size=2
+    )
+
+    assert len(ids) == len(scores) == 2
+
+
+def test_empty_legs():
+    ids, scores = fuse_rankings([[], []], [[], []], [1.0, 1.0])
+    assert ids == [] and len(scores) == 0
+
+    ids, _ = fuse_rankings([[], ["a"]], [[], [1.0]], [1.0, 1.0])
+    assert ids == ["a"]
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError, match="method"):
+        fuse_rankings([["a"]], [[1.0]], [1.0], method="max")
+    with pytest.raises(ValueError, match="weight"):
+        fuse_rankings([["a"]], [[1.0]], [1.0, 1.0])
+
+
+@pytest.mark.parametrize("weights", [[1.0], [1.0, 1.0, 1.0], [1.0, -0.5], []])
+def test_requests_with_invalid_weights_are_rejected(weights):
+    with pytest.raises(ValidationError, match="two non-negative numbers"):
+        Query.model_validate(
+            {"query": "What is EMI?", "fusion": {"method": "rrf", "weights": weights}}
+        )
+
+
+def test_requests_with_valid_weights_are_accepted():
+    query = Query.model_validate(
+        {"query": "What is EMI?", "fusion": {"weights": [0.0, 2.0]}}
+    )
+
+    assert query.fusion.weights == [0.0, 2.0]
+    assert Fusion().weights is None
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Behavior of the HNSW graph, the behavior shared with the other in-process datastores is tested in test_local_datastore.
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("hnswlib")
+
+from datastore.providers.hnsw_datastore import HnswDataStore  # noqa: E402
+from datastore.providers.local_datastore import LocalDataStore  # noqa: E402
+
+# More chunks than the candidates of a top 5 search, so searches walk the graph
+NUM_CHUNKS = 300
+
+
+def ranking(results):
+    return [(chunk.id, round(chunk.score, 5)) for chunk in results]
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(NUM_CHUNKS, 8)).astype(np.float32)
+
+
+@pytest.mark.parametrize("similarity", ["cosine", "dot_product", "l2_norm"])
+def test_graph_search_scores_like_the_exact_search(
+    make_local_datastore,
+    make_chunks,
+    upsert_chunks,
+    search_chunks,
+    vectors,
+    tmp_path,
+    similarity,
+):
+    hnsw = make_local_datastore(
+        HnswDataStore, path=tmp_path / "hnsw", similarity=similarity
+    )
+    exact = make_local_datastore(
+        LocalDataStore, path=tmp_path / "exact", similarity=similarity
+    )
+    if similarity == "dot_product":
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for datastore in [hnsw, exact]:
+        upsert_chunks(datastore, make_chunks("a", vectors))
+
+    for query in vectors[:10] + 0.05:
+        assert ranking(search_chunks(hnsw, query)) == ranking(
+            search_chunks(exact, query)
+        )
+
+
+def test_filtered_searches_only_return_matching_chunks(
+    make_local_datastore, make_chunks, upsert_chunks, search_chunks, vectors
+):
+    datastore = make_local_datastore(HnswDataStore)
+    upsert_chunks(
+        datastore,
+        make_chunks("a", vectors[:200], bu="CIPS"),
+        make_chunks("b", vectors[200:], bu="GBS"),
+    )
+
+    # 200 matches: searched on the graph, 100 matches: searched exactly
+    for bu, document_id in [("CIPS", "a"), ("GBS", "b")]:
+        results = search_chunks(datastore, vectors[0], top_k=10, bu=bu)
+        assert len(results) == 10
+        assert all(chunk.metadata.document_id == document_id for chunk in results)
+
+
+def test_the_graph_is_brought_up_to_date_when_loaded(
+    make_local_datastore, make_chunks, upsert_chunks, search_chunks, vectors
+):
+    datastore = make_local_datastore(HnswDataStore)
+    upsert_chunks(datastore, make_chunks("a", vectors[:200]))
+    asyncio.run(datastore.close())
+    datastore = make_local_datastore(HnswDataStore)
+    # Written after the graph was saved, and never saved
+    upsert_chunks(datastore, make_chunks("b", vectors[200:]))
+    asyncio.run(datastore._delete(ids=["a"]))
+
+    reloaded = make_local_datastore(HnswDataStore)
+
+    assert sorted(reloaded._graph.get_ids_list()) == sorted(reloaded._row_of.values())
+    results = search_chunks(reloaded, vectors[250], top_k=5)
+    assert results[0].id == "b_50"
+    assert all(chunk.metadata.document_id == "b" for chunk in results)
+
+
+def test_the_graph_is_rebuilt_after_a_compaction(
+    make_local_datastore, make_chunks, upsert_chunks, search_chunks, vectors
+):
+    datastore = make_local_datastore(HnswDataStore)
+    upsert_chunks(
+        datastore, make_chunks("a", vectors[:200]), make_chunks("b", vectors[200:])
+    )
+
+    asyncio.run(datastore._delete(ids=["a"]))
+
+    # The rows of b were renumbered from 0
+    assert datastore._num_rows == 100
+    assert sorted(datastore._graph.get_ids_list()) == list(range(100))
+    assert search_chunks(datastore, vectors[250], top_k=1)[0].id == "b_50"
+
+
+def test_the_graph_is_rebuilt_when_the_index_options_change(
+    make_local_datastore, make_chunks, upsert_chunks, search_chunks, vectors
+):
+    datastore = make_local_datastore(HnswDataStore)
+    upsert_chunks(datastore, make_chunks("a", vectors))
+    asyncio.run(datastore.close())
+
+    reloaded = make_local_datastore(
+        HnswDataStore, index_options={"m": 8, "ef_construction": 50}
+    )
+
+    assert reloaded._graph.M == 8
+    assert search_chunks(reloaded, vectors[3], top_k=1)[0].id == "a_3"
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+from unittest import mock
+
+from datastore.datastore import diff_chunks
+from datastore.providers import elasticsearch_datastore
+from datastore.providers.local_datastore import LocalDataStore
+from pydantic_schemas.document import Document, DocumentChunk, DocumentChunkMetadata
+
+
+def make_chunk(chunk_id, content_hash):
+    return DocumentChunk(
+        id=chunk_id,
+        text=chunk_id,
+        metadata=DocumentChunkMetadata(content_hash=content_hash),
+    )
+
+
+def test_diff_chunks_keeps_new_and_changed_chunks():
+    chunks = {
+        "d": [make_chunk("d_0", "a"), make_chunk("d_1", "b"), make_chunk("d_2", "c")]
+    }
+    existing = {"d_0": "a", "d_1": "changed", "d_3": "d"}
+
+    changed, vanished = diff_chunks(chunks, existing)
+
+    assert [chunk.id for chunk in changed["d"]] == ["d_1", "d_2"]
+    assert vanished == ["d_3"]
+
+
+def test_diff_chunks_rewrites_chunks_without_a_stored_hash():
+    changed, vanished = diff_chunks({"d": [make_chunk("d_0", "a")]}, {"d_0": None})
+
+    assert [chunk.id for chunk in changed["d"]] == ["d_0"]
+    assert vanished == []
+
+
+def test_incremental_upsert_only_embeds_changed_chunks(tmp_path):
+    datastore = LocalDataStore(path=str(tmp_path / "local"), recreate_index=True)
+    text = " ".join(f"sentence number {i} of the document." for i in range(400))
+    embedded = []
+
+    def embed_document_chunks(chunks):
+        embedded.append(len(chunks))
+        for chunk in chunks:
+            chunk.embedding = [1.0] + [0.0] * (datastore.vector_size - 1)
+
+    async def upsert(text):
+        await datastore.upsert([Document(id="d", text=text)], incremental=True)
+
+    with mock.patch("datastore.datastore.embed_document_chunks", embed_document_chunks):
+        asyncio.run(upsert(text))
+        asyncio.run(upsert(text))
+        asyncio.run(upsert(text[: len(text) // 2]))
+
+    num_chunks = embedded[0]
+    assert num_chunks > 2
+    # Unchanged document: nothing is embedded again
+    assert embedded[1] == 0
+    # Truncated document: at most the new last chunk is embedded, the chunks past it are deleted
+    assert embedded[2] <= 1
+    assert 0 < len(datastore._row_of) < num_chunks
+
+
+def scan_content_hashes(datastore):
+    scanned = []
+
+    async def fake_scan(client, index, query, _source):
+        scanned.append(index)
+        yield {"_id": "d_0", "_source": {"metadata": {"content_hash": "a"}}}
+
+    with mock.patch.object(elasticsearch_datastore, "async_scan", fake_scan):
+        hashes = asyncio.run(datastore._get_content_hashes(["d"]))
+    return scanned, hashes
+
+
+def test_content_hashes_are_read_from_the_live_aliases(make_elasticsearch_datastore):
+    datastore = make_elasticsearch_datastore(bu_indices={"CIPS": {}})
+
+    scanned, hashes = scan_content_hashes(datastore)
+
+    assert scanned == ["rag,rag-cips"]
+    assert hashes == {"d_0": "a"}
+    datastore.async_client.indices.refresh.assert_not_awaited()
+
+
+def test_content_hashes_are_read_from_the_new_index_during_a_reindex(
+    make_elasticsearch_datastore,
+):
+    datastore = make_elasticsearch_datastore(bu_indices={"CIPS": {}})
+    # What reindex() does for the duration of its context
+    datastore.write_indices["rag"] = "rag_v2"
+
+    scanned, _ = scan_content_hashes(datastore)
+
+    # Chunks missing from the new index are written again instead of being lost at the alias swap
+    assert scanned == ["rag_v2,rag-cips"]
+    datastore.async_client.indices.refresh.assert_awaited_once_with(index="rag_v2")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Behavior shared by the in-process datastores, run against each provider, see local_datastore_class.
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+from datastore.providers import local_datastore
+
+
+def ranking(results):
+    return [(chunk.id, round(chunk.score, 5)) for chunk in results]
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(40, 8)).astype(np.float32)
+
+
+def test_top_k_matches_an_exact_search(
+    local_datastore_class,
+    make_local_datastore,
+    make_chunks,
+    upsert_chunks,
+    search_chunks,
+    vectors,
+):
+    datastore = make_local_datastore(local_datastore_class)
+    upsert_chunks(
+        datastore, make_chunks("a", vectors[:20]), make_chunks("b", vectors[20:])
+    )
+    query = vectors[0] + 0.1
+
+    results = search_chunks(datastore, query, top_k=5)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    cosine = normalized @ (query / np.linalg.norm(query))
+    expected = np.argsort(-cosine)[:5]
+    ids = [f"a_{i}" if i < 20 else f"b_{i - 20}" for i in expected]
+    assert [chunk.id for chunk in results] == ids
+    # Scored like the Elasticsearch kNN search
+    np.testing.assert_allclose(
+        [chunk.score for chunk in results], (1 + cosine[expected]) / 2, rtol=1e-5
+    )
+
+
+@pytest.mark.parametrize("sparse_filter_ratio", [1, 1000])
+def test_filters_select_the_matching_chunks(
+    local_datastore_class,
+    make_local_datastore,
+    make_chunks,
+    upsert_chunks,
+    search_chunks,
+    vectors,
+    monkeypatch,
+    sparse_filter_ratio,
+):
+    # Both the dense path (scoring every row) and the sparse one (scoring the matching rows)
+    monkeypatch.setattr(local_datastore, "SPARSE_FILTER_RATIO", sparse_filter_ratio)
+    datastore = make_local_datastore(local_datastore_class)
+    upsert_chunks(
+        datastore,
+        make_chunks("a", vectors[:10], bu="CIPS", created_at="2023-01-01"),
+        make_chunks("b", vectors[10:20], bu="GBS", created_at="2023-06-01"),
+        make_chunks("c", vectors[20:30], bu="CIPS"),
+    )
+
+    def search(**filter):
+        results = search_chunks(datastore, vectors[15], top_k=30, **filter)
+        return [chunk.id for chunk in results]
+
+    by_bu = search(bu="CIPS")
+    by_document = search(document_id="b")
+    by_date = search(start_date="2023-03-01")
+
+    assert {chunk_id.split("_")[0] for chunk_id in by_bu} == {"a", "c"}
+    assert len(by_bu) == 20
+    assert by_document[0] == "b_5"
+    assert {chunk_id.split("_")[0] for chunk_id in by_document} == {"b"}
+    # Chunks without created_at never match a date range
+    assert {chunk_id.split("_")[0] for chunk_id in by_date} == {"b"}
+    assert search(bu="other") == []
+
+
+def test_upserting_a_chunk_again_replaces_it(
+    local_datastore_class,
+    make_local_datastore,
+    make_chunks,
+    upsert_chunks,
+    search_chunks,
+    vectors,
+):
+    datastore = make_local_datastore(local_datastore_class)
+    upsert_chunks(datastore, make_chunks("a", vectors[:2]))
+
+    upsert_chunks(datastore, make_chunks("a", [vectors[5]]))
+    results = search_chunks(datastore, vectors[5], top_k=10)
+
+    assert sorted(chunk.id for chunk in results) == ["a_0", "a_1"]
+    assert results[0].id == "a_0"
+    assert results[0].score == pytest.approx(1.0)
+
+
+def test_chunks_are_reloaded_from_disk(
+    local_datastore_class,
+    make_local_datastore,
+    make_chunks,
+    upsert_chunks,
+    search_chunks,
+    vectors,
+):
+    datastore = make_local_datastore(local_datastore_class)
+    upsert_chunks(datastore, make_chunks("a", vectors[:10], bu="CIPS"))
+    expected = ranking(search_chunks(datastore, vectors[3], top_k=3, bu="CIPS"))
+    asyncio.run(datastore.close())
+
+    reloaded = make_local_datastore(local_datastore_class)
+
+    assert ranking(search_chunks(reloaded, vectors[3], top_k=3, bu="CIPS")) == expected
+    with pytest.raises(ValueError, match="vector size"):
+        make_local_datastore(local_datastore_class, vector_size=4)
+
+
+def test_deleted_rows_are_compacted(
+    local_datastore_class,
+    make_local_datastore,
+    make_chunks,
+    upsert_chunks,
+    search_chunks,
+    vectors,
+    tmp_path,
+    monkeypatch,
+):
+    monkeypatch.setattr(local_datastore, "INITIAL_CAPACITY", 4)
+    datastore = make_local_datastore(local_datastore_class)
+    upsert_chunks(
+        datastore, make_chunks("a", vectors[:10]), make_chunks("b", vectors[10:20])
+    )
+    # The matrix grew past its initial capacity
+    assert len(datastore._matrix) >= 20
+
+    asyncio.run(datastore._delete(ids=["a"]))
+    assert datastore._num_rows == 20
+    asyncio.run(datastore._delete_chunk_ids(["b_0", "b_1"]))
+
+    # More than half of the rows were deleted: the live rows were copied to a new matrix
+    assert datastore._num_rows == 8
+    assert sorted(datastore._row_of.values()) == list(range(8))
+    assert len(list((tmp_path / "datastore").glob("embeddings_*.npy"))) == 1
+    results = search_chunks(datastore, vectors[15], top_k=20)
+    assert len(results) == 8
+    assert results[0].id == "b_5"
+    reloaded = make_local_datastore(local_datastore_class)
+    assert ranking(search_chunks(reloaded, vectors[15], top_k=20)) == ranking(results)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+"""
+Keyword and hybrid search of the local hybrid datastore, its semantic search is tested in test_local_datastore.
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+from datastore.providers.local_datastore import LocalDataStore
+from datastore.providers.local_hybrid_datastore import LocalHybridDataStore
+
+# One chunk per document
+TEXTS = {
+    "emi": "The equated monthly installment (EMI) is due on the first day of the month.",
+    "loan": "A personal loan is repaid in monthly installments over five years.",
+    "card": "The credit card statement is sent at the end of the billing cycle.",
+    "fx": "Foreign exchange fees apply to card payments made abroad.",
+}
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return {document_id: rng.normal(size=8).astype(np.float32) for document_id in TEXTS}
+
+
+@pytest.fixture
+def make_datastore(make_local_datastore, make_chunks, upsert_chunks, vectors):
+    def make_datastore(search_type, metadata={}):
+        datastore = make_local_datastore(LocalHybridDataStore, search_type=search_type)
+        upsert_chunks(
+            datastore,
+            *[
+                make_chunks(
+                    document_id,
+                    [vectors[document_id]],
+                    [text],
+                    **metadata.get(document_id, {}),
+                )
+                for document_id, text in TEXTS.items()
+            ],
+        )
+        return datastore
+
+    return make_datastore
+
+
+@pytest.fixture
+def search(search_chunks):
+    def search(datastore, text, embedding=np.ones(8), top_k=5, **filter):
+        results = search_chunks(datastore, embedding, top_k, text, **filter)
+        return [chunk.metadata.document_id for chunk in results]
+
+    return search
+
+
+def test_keyword_search_matches_all_the_terms(make_datastore, search):
+    datastore = make_datastore("keyword")
+
+    assert search(datastore, "monthly installments") == ["loan"]
+    assert sorted(search(datastore, "monthly")) == ["emi", "loan"]
+    assert search(datastore, "monthly mortgage") == []
+
+
+def test_keyword_search_reads_query_syntax_as_text(make_datastore, search):
+    datastore = make_datastore("keyword")
+
+    assert search(datastore, 'card -"fees" abroad*') == ["fx"]
+    assert search(datastore, "?!") == []
+
+
+def test_keyword_search_applies_the_filters(make_datastore, search):
+    datastore = make_datastore(
+        "keyword", metadata={"emi": {"bu": "CIPS"}, "loan": {"bu": "GBS"}}
+    )
+
+    assert search(datastore, "monthly", bu="CIPS") == ["emi"]
+    assert search(datastore, "monthly", document_id="loan") == ["loan"]
+
+
+def test_hybrid_search_fuses_the_keyword_and_semantic_results(
+    make_datastore, make_local_datastore, search, vectors
+):
+    datastore = make_datastore("hybrid")
+
+    # card only matches the terms, fx is only near the embedding
+    results = search(datastore, "billing cycle", embedding=vectors["fx"], top_k=2)
+
+    assert sorted(results) == ["card", "fx"]
+    semantic = make_local_datastore(LocalHybridDataStore, search_type="semantic")
+    assert search(semantic, "billing cycle", embedding=vectors["fx"], top_k=1) == ["fx"]
+
+
+def test_the_text_index_follows_replaced_and_deleted_chunks(
+    make_datastore, make_chunks, upsert_chunks, search, vectors
+):
+    datastore = make_datastore("keyword")
+
+    upsert_chunks(
+        datastore, make_chunks("emi", [vectors["emi"]], ["The installment changed."])
+    )
+    asyncio.run(datastore._delete(ids=["loan"]))
+
+    assert search(datastore, "monthly") == []
+    assert search(datastore, "changed") == ["emi"]
+
+
+def test_chunks_written_by_the_local_datastore_are_indexed(
+    make_local_datastore, make_chunks, upsert_chunks, search, vectors
+):
+    upsert_chunks(
+        make_local_datastore(LocalDataStore),
+        make_chunks("fx", [vectors["fx"]], [TEXTS["fx"]]),
+    )
+
+    datastore = make_local_datastore(LocalHybridDataStore, search_type="keyword")
+
+    assert search(datastore, "foreign exchange") == ["fx"]
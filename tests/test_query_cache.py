@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import time
+
+import pytest
+from datastore.cache import DiskQueryCacheBackend, InMemoryQueryCacheBackend, QueryCache
+from datastore.providers.local_datastore import LocalDataStore
+from pydantic_schemas.document import (
+    Document,
+    DocumentMetadataFilter,
+    Query,
+    QueryResult,
+)
+
+
+@pytest.fixture(params=["memory", "disk"])
+def make_backend(request, tmp_path):
+    def make_backend(max_size=10, ttl=60):
+        if request.param == "memory":
+            return InMemoryQueryCacheBackend(max_size, ttl)
+        return DiskQueryCacheBackend(
+            max_size, ttl, str(tmp_path / "query_cache.sqlite")
+        )
+
+    return make_backend
+
+
+def make_result(text):
+    return QueryResult(query=text, results=[])
+
+
+def test_keys_ignore_the_case_and_spacing_of_the_query():
+    cache = QueryCache(InMemoryQueryCacheBackend(10, 60))
+
+    key = cache.get_key(Query(query="What is  EMI?"), search_type="hybrid")
+
+    assert cache.get_key(Query(query=" what is emi? "), search_type="hybrid") == key
+    assert cache.get_key(Query(query="What is EMI"), search_type="hybrid") != key
+    assert (
+        cache.get_key(Query(query="What is EMI?", top_k=3), search_type="hybrid") != key
+    )
+    assert cache.get_key(Query(query="What is EMI?"), search_type="semantic") != key
+    filter = DocumentMetadataFilter(bu="CIPS")
+    assert (
+        cache.get_key(Query(query="What is EMI?", filter=filter), search_type="hybrid")
+        != key
+    )
+
+
+def test_entries_expire_after_the_ttl(make_backend):
+    backend = make_backend(ttl=0.05)
+    backend.set("a", make_result("a"))
+
+    assert backend.get("a").query == "a"
+    time.sleep(0.1)
+    assert backend.get("a") is None
+
+
+def test_the_least_recently_used_entries_are_evicted(make_backend):
+    backend = make_backend(max_size=2)
+    backend.set("a", make_result("a"))
+    time.sleep(0.01)
+    backend.set("b", make_result("b"))
+    time.sleep(0.01)
+    backend.get("a")
+    time.sleep(0.01)
+    backend.set("c", make_result("c"))
+
+    assert len(backend) == 2
+    assert backend.get("b") is None
+    assert backend.get("a") is not None
+    assert backend.get("c") is not None
+
+
+def test_invalidation_drops_the_entries_and_changes_the_keys(make_backend):
+    cache = QueryCache(make_backend())
+    query = Query(query="What is EMI?")
+    key = cache.get_key(query)
+    cache.set(key, make_result("What is EMI?"))
+
+    cache.invalidate()
+
+    assert cache.get(key) is None
+    assert cache.get_key(query) != key
+    assert cache.stats()["generation"] == 1
+
+
+def test_the_disk_generation_is_shared_by_the_processes_using_the_file(tmp_path):
+    path = str(tmp_path / "query_cache.sqlite")
+    backend = DiskQueryCacheBackend(10, 60, path)
+    other = DiskQueryCacheBackend(10, 60, path)
+    backend.set("a", make_result("a"))
+
+    other.invalidate()
+
+    assert backend.generation == 1
+    assert backend.get("a") is None
+
+
+def test_writes_to_the_datastore_invalidate_its_cache(tmp_path):
+    cache = QueryCache(InMemoryQueryCacheBackend(10, 60))
+    datastore = LocalDataStore(
+        path=str(tmp_path / "local"), recreate_index=True, search_type="semantic"
+    )
+    datastore.query_cache = cache
+    query = Query(query="monthly installment", top_k=1)
+
+    async def run():
+        await datastore.upsert([Document(id="a", text="The monthly installment.")])
+        first = await datastore.query([query])
+        again = await datastore.query([query])
+        await datastore.upsert(
+            [Document(id="b", text="The monthly installment is due.")]
+        )
+        after_upsert = await datastore.query([query])
+        return first, again, after_upsert
+
+    first, again, after_upsert = asyncio.run(run())
+
+    assert again == first
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert [chunk.id for chunk in first[0].results] == ["a_0"]
+    assert after_upsert[0].results[0].id in ["a_0", "b_0"]